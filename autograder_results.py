@@ -0,0 +1,60 @@
+import json
+import os
+from history_file import read_last_line
+
+
+def find_autograder_summary(f):
+    '''
+    Find the autograder summary (the last line) of an autograder_results.txt file by reading backwards from its end,
+    so the cost doesn't depend on how much output the autograder printed before it
+    :param f: the autograder_results.txt file, opened in binary mode
+    :return: (offset of the start of the summary line, the summary)
+    '''
+    offset, line = read_last_line(f)
+    if line is None:
+        raise ValueError("no autograder summary in %s" % f.name)
+
+    autograder_summary = json.loads(line)
+    assert isinstance(autograder_summary, dict), "autograder summary is not a dictionary: %s" % line
+    return offset, autograder_summary
+
+
+def read_autograder_summary(autograder_results):
+    '''
+    :param autograder_results: path to an autograder_results.txt file
+    :return: the autograder summary (a dictionary).  Raises ValueError if the last line is not a summary.
+    '''
+    with open(autograder_results, "rb") as f:
+        offset, autograder_summary = find_autograder_summary(f)
+
+    return autograder_summary
+
+
+def read_autograder_output(autograder_results):
+    '''
+    :param autograder_results: path to an autograder_results.txt file
+    :return: the lines the autograder printed before its summary
+    '''
+    with open(autograder_results, "rb") as f:
+        offset, autograder_summary = find_autograder_summary(f)
+        f.seek(0)
+        return f.read(offset).splitlines(True)
+
+
+def replace_autograder_summary(autograder_results, autograder_summary):
+    '''
+    Replace the autograder summary at the end of an autograder_results.txt file, in place: the file is truncated
+    where the old summary starts and the new one is appended, leaving the rest of the output untouched
+    :param autograder_results: path to an autograder_results.txt file
+    :param autograder_summary: a dictionary containing the new autograder summary
+    :return: None
+    '''
+    assert isinstance(autograder_summary, dict)
+
+    with open(autograder_results, "r+b") as f:
+        offset, old_autograder_summary = find_autograder_summary(f)
+        f.seek(offset)
+        f.truncate()
+        f.write(json.dumps(autograder_summary))
+        f.flush()
+        os.fsync(f.fileno())
@@ -0,0 +1,156 @@
+import Queue
+import json
+import os
+import subprocess
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+
+class AutograderWorker(object):
+    """A long-lived autograder process that grades one submission after another, so that its setup (imports, reference
+    data, ...) is paid for once rather than once per submission.
+
+    The protocol is line-delimited JSON over the worker's stdin and stdout.  For each submission, the worker is sent
+    one line:
+        {"directory": "<absolute path of the submission to grade>", "force": <bool>}
+    and it answers with any number of lines of output, followed by the same JSON summary the autograder command prints
+    as its last line today:
+        {"points_possible": <int>, "points_received": <int>, "team_login_ids": [...], ...}
+    The first line that is a JSON object ends the answer.  If the worker can't grade the submission, it answers with
+    {"error": "<message>"} instead.  A worker that exits is restarted for the next submission."""
+
+    def __init__(self, command):
+        '''
+        :param command: the command that starts a worker, as a list of arguments
+        '''
+        assert isinstance(command, list), "command is not a list: %s" % command
+
+        self.command = command
+        self.process = None
+        self.started = 0
+        self.graded = 0
+        self._lock = threading.Lock()
+        return
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+        self.started += 1
+
+    def grade(self, directory, force=False):
+        '''
+        Grade one submission
+        :param directory: the directory of the submission to grade
+        :param force: the same as passing -f to the autograder command
+        :return: (succeeded, output) where output is a list of the lines the worker printed, ending with its answer
+        '''
+        with self._lock:
+            if self.process is None or self.process.poll() is not None:
+                self.start()
+
+            request = {"directory": os.path.abspath(directory), "force": force}
+            output = []
+            try:
+                self.process.stdin.write(json.dumps(request) + "\n")
+                self.process.stdin.flush()
+
+                while True:
+                    line = self.process.stdout.readline()
+                    if not line:
+                        raise IOError("worker exited with code [%s]" % self.process.wait())
+                    if not line.endswith("\n"):
+                        line += "\n"
+                    output.append(line)
+
+                    try:
+                        answer = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(answer, dict):
+                        break
+            except (IOError, OSError) as e:
+                self.stop()
+                output.append("autograder worker [%s] failed: %s\n" % (" ".join(self.command), e))
+                return False, output
+
+            self.graded += 1
+            return "error" not in answer, output
+
+    def stop(self):
+        '''
+        Ask the worker to exit (by closing its stdin), and wait for it
+        :return: None
+        '''
+        if self.process is None:
+            return
+
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.process.wait()
+        self.process = None
+
+
+class AutograderWorkerPool(object):
+    """A fixed set of AutograderWorkers, each grading on its own thread.
+
+    Like JobScheduler.run, run records each job's queue time (from the start of the run until a worker took it) and
+    wall time, along with the peak number of jobs running at once."""
+
+    def __init__(self, command, size):
+        assert isinstance(size, int) and size > 0, "size is not a positive int: %s" % size
+
+        self.max_jobs = size
+        self.peak_concurrency = 0
+        self._running = 0
+        self._lock = threading.Lock()
+        self._idle_workers = Queue.Queue()
+        for i in range(size):
+            self._idle_workers.put(AutograderWorker(command))
+        return
+
+    def run(self, jobs):
+        '''
+        Run every job on a worker and wait for them all to finish
+        :param jobs: list of (name, function) tuples.  function(worker) does the job with the worker it is given and
+                     returns a return code.
+        :return: list of dictionaries with each job's "name", "returncode", "queue_time" and "wall_time" (in seconds),
+                 in the order the jobs finished
+        '''
+        start = time.time()
+
+        def run_job(job):
+            name, function = job
+            worker = self._idle_workers.get()
+            started_at = time.time()
+            with self._lock:
+                self._running += 1
+                self.peak_concurrency = max(self.peak_concurrency, self._running)
+
+            try:
+                returncode = function(worker)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                self._idle_workers.put(worker)
+
+            return {"name": name,
+                    "returncode": returncode,
+                    "queue_time": started_at - start,
+                    "wall_time": time.time() - started_at}
+
+        pool = ThreadPool(self.max_jobs)
+        try:
+            return list(pool.imap_unordered(run_job, jobs))
+        finally:
+            pool.close()
+            pool.join()
+
+    def stop(self):
+        '''
+        Stop every worker
+        :return: None
+        '''
+        while not self._idle_workers.empty():
+            self._idle_workers.get().stop()
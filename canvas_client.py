@@ -0,0 +1,201 @@
+import json
+import os
+import time
+from multiprocessing.pool import ThreadPool
+from canvas_session import get_session
+from utils import build_canvas_url, iterate_canvas_objects, post_file, get_header
+
+
+class CanvasClient(object):
+    """Runs many Canvas operations concurrently from a single process.
+
+    Each operation is an ordinary blocking call, and many of them can be submitted as tasks to a bounded pool of
+    threads, which share the process's CanvasSession: its pooled keep-alive connections, rate limit scheduler,
+    retries and response cache.  Threads spend nearly all their time waiting on the network, so one process with a
+    few dozen of them replaces as many separate Python interpreters.
+
+    The operations raise urllib2.HTTPError on failure, so one failed task doesn't take the others down with it."""
+
+    def __init__(self, token, concurrency=16):
+        assert isinstance(token, str), "token is not a string: %s" % token
+        assert isinstance(concurrency, int) and concurrency > 0, "concurrency is not a positive int: %s" % concurrency
+
+        self.token = token
+        self.concurrency = concurrency
+        self.session = get_session()
+        self._pool = None
+        return
+
+    # operations
+
+    def get(self, url):
+        '''
+        GET a single Canvas object
+        :param url: api url
+        :return: the decoded JSON response
+        '''
+        response = self.session.open(url, self.token)
+        try:
+            return json.loads(response.read())
+        finally:
+            response.close()
+
+    def get_all(self, url):
+        '''
+        GET every object in a paginated collection
+        :param url: api url of the first page
+        :return: list of objects
+        '''
+        return list(iterate_canvas_objects(url, self.token))
+
+    def upload_comment_file(self, course_id, assignment_id, user_id, path, name=None):
+        '''
+        Upload a file to attach to a submission comment, in 3 steps
+        (https://canvas.instructure.com/doc/api/file.file_uploads.html#method.file_uploads.post)
+        :param course_id: Canvas course_id
+        :param assignment_id: Canvas assignment_id
+        :param user_id: Canvas user_id of the student whose submission the comment is for
+        :param path: the file to upload
+        :param name: the name to give the file in Canvas (defaults to the file's own name)
+        :return: the Canvas id of the uploaded file.  Raises ValueError if the upload is not given a location to confirm.
+        '''
+        assert os.path.isfile(path), "path is not a file: %s" % path
+
+        if name is None:
+            name = os.path.basename(path)
+
+        # step 1: tell Canvas about the file
+        url = build_canvas_url(["courses", course_id, "assignments", assignment_id, "submissions", user_id,
+                                "comments", "files"])
+        response = self.session.open(url, self.token, data={"name": name, "size": os.path.getsize(path)})
+        upload = json.loads(response.read())
+        response.close()
+
+        # step 2: upload the file to the url Canvas gave us
+        body, headers = post_file(str(upload["upload_url"]), data=upload["upload_params"], file=path)
+        location = get_header("Location", headers)
+        if location is None:
+            location = json.loads(body).get("location")
+        if location is None:
+            raise ValueError("upload of %s did not return a location: %s" % (path, body))
+
+        # step 3: confirm the upload (safe to repeat, so retry it if it fails)
+        response = self.session.open(str(location), self.token, method="POST", retry=True)
+        uploaded_file = json.loads(response.read())
+        response.close()
+
+        return uploaded_file["id"]
+
+    def put_submission(self, course_id, assignment_id, user_id, grade=None, comment=None, file_ids=[], data={}):
+        '''
+        Grade and/or comment on a submission
+        :param course_id: Canvas course_id
+        :param assignment_id: Canvas assignment_id
+        :param user_id: Canvas user_id of the student
+        :param grade: the grade to post (e.g. "85.0%"), if any
+        :param comment: the text of a comment to add, if any
+        :param file_ids: ids of uploaded files (see upload_comment_file) to attach to the comment
+        :param data: any other form fields to send
+        :return: the updated submission
+        '''
+        put_data = dict(data)
+        if grade is not None:
+            put_data["submission[posted_grade]"] = grade
+        if comment is not None:
+            put_data["comment[text_comment]"] = comment
+
+        form = put_data.items()
+        for file_id in file_ids:
+            form.append(("comment[file_ids][]", file_id))
+
+        url = build_canvas_url(["courses", course_id, "assignments", assignment_id, "submissions", user_id])
+        response = self.session.open(url, self.token, data=form, method="PUT")
+        try:
+            return json.loads(response.read())
+        finally:
+            response.close()
+
+    def update_grades(self, course_id, assignment_id, grade_data):
+        '''
+        Grade (and optionally comment on) many submissions with one request.  Canvas does the work in the background.
+        :param course_id: Canvas course_id
+        :param assignment_id: Canvas assignment_id
+        :param grade_data: a dictionary mapping each student's user_id to a dictionary with "posted_grade" and/or
+                           "text_comment"
+        :return: the Progress object for the background job (see wait_for_progress)
+        '''
+        assert isinstance(grade_data, dict), "grade_data is not a dict: %s" % grade_data
+
+        form = []
+        for user_id in grade_data:
+            for field in grade_data[user_id]:
+                form.append(("grade_data[%s][%s]" % (user_id, field), grade_data[user_id][field]))
+
+        url = build_canvas_url(["courses", course_id, "assignments", assignment_id, "submissions", "update_grades"])
+        response = self.session.open(url, self.token, data=form, method="POST")
+        try:
+            return json.loads(response.read())
+        finally:
+            response.close()
+
+    def wait_for_progress(self, progress, poll_interval=2.0, timeout=600):
+        '''
+        Poll a Progress object until its job is finished
+        :param progress: the Progress object returned when the job was started
+        :param poll_interval: seconds between polls
+        :param timeout: give up (and return the last Progress seen) after this many seconds
+        :return: the final Progress object.  Its "workflow_state" is "completed" or "failed" if the job finished.
+        '''
+        url = build_canvas_url(["progress", progress["id"]])
+        deadline = time.time() + timeout
+
+        while progress["workflow_state"] not in ["completed", "failed"] and time.time() < deadline:
+            time.sleep(poll_interval)
+            progress = self.get(url)
+
+        return progress
+
+    # running operations concurrently
+
+    def submit(self, function, *args, **kwargs):
+        '''
+        Run function(*args, **kwargs) as a task in the pool
+        :return: a multiprocessing.pool.AsyncResult.  Its get() returns the function's result or raises its exception.
+        '''
+        return self._get_pool().apply_async(function, args, kwargs)
+
+    def map(self, function, items):
+        '''
+        Run function(item) for every item, concurrently
+        :return: the results, in the same order as items
+        '''
+        return self._get_pool().map(function, items)
+
+    def imap_unordered(self, function, items):
+        '''
+        Run function(item) for every item, concurrently
+        :return: an iterator over the results, in the order they finish
+        '''
+        return self._get_pool().imap_unordered(function, items)
+
+    def close(self):
+        '''
+        Wait for all submitted tasks to finish
+        :return: None
+        '''
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _get_pool(self):
+        # the threads are only started once there is something to run on them
+        if self._pool is None:
+            self._pool = ThreadPool(self.concurrency)
+        return self._pool
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
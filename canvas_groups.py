@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+from autograder_results import read_autograder_summary, replace_autograder_summary
+from grade_submission import results_file
+from utils import build_canvas_url, max_per_page
+
+
+# written to each group member's assignment directory by download_all_submissions.py -G
+group_file = "group.json"
+
+
+def get_groups(client, group_category_id):
+    '''
+    Fetch the groups in a group category (e.g. an assignment's group_category_id) along with their members
+    :param client: CanvasClient
+    :param group_category_id: Canvas group_category_id
+    :return: list of dictionaries with the group's "id", "name" and "user_ids"
+    '''
+    url = build_canvas_url(["group_categories", group_category_id, "groups"], {"per_page": max_per_page})
+    groups = client.get_all(url)
+
+    def get_members(group):
+        return client.get_all(build_canvas_url(["groups", group["id"], "users"], {"per_page": max_per_page}))
+
+    # the groups' member lists are fetched concurrently
+    members = client.map(get_members, groups)
+
+    return [{"id": group["id"], "name": group.get("name"), "user_ids": [member["id"] for member in group_members]}
+            for group, group_members in zip(groups, members)]
+
+
+def write_group_file(assignment_directory, group_id, group_name, login_ids, representative):
+    '''
+    Record which group a student is in, and which member's directory holds the group's submission
+    :param assignment_directory: the student's assignment directory
+    :param group_id: Canvas group id
+    :param group_name: the group's name in Canvas
+    :param login_ids: login_ids (netids) of the group's members
+    :param representative: login_id of the member whose submission is downloaded and graded for the whole group
+    :return: None
+    '''
+    group_summary = {"group_id": group_id, "group_name": group_name, "login_ids": sorted(login_ids),
+                     "representative": representative}
+
+    with open(os.path.join(assignment_directory, group_file), "w") as f:
+        json.dump(group_summary, f)
+
+
+def read_group_file(assignment_directory):
+    '''
+    :param assignment_directory: a student's assignment directory
+    :return: the group summary written by write_group_file, or None if the student's work isn't done as a group
+    '''
+    path = os.path.join(assignment_directory, group_file)
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def is_covered_by_group(submissions_directory, assignment_name, login_id):
+    '''
+    Check whether a student's submission is downloaded and graded in another group member's directory
+    :return: boolean
+    '''
+    group_summary = read_group_file(os.path.join(submissions_directory, login_id, assignment_name))
+    return group_summary is not None and group_summary["representative"] != login_id
+
+
+def fan_out_group_results(submissions_directory, assignment_name, representative):
+    '''
+    Give every member of the representative's group the results of grading the group's submission: the team in the
+    autograder summary is set to the group, and autograder_results.txt is copied to each member's assignment directory
+    :param submissions_directory: the path to the submissions directory
+    :param assignment_name: the name of the assignment
+    :param representative: login_id of the member whose directory holds the group's submission
+    :return: login_ids of the members the results were copied to
+    '''
+    assignment_directory = os.path.join(submissions_directory, representative, assignment_name)
+    group_summary = read_group_file(assignment_directory)
+    if group_summary is None:
+        return []
+
+    results_path = os.path.join(assignment_directory, results_file)
+    autograder_summary = read_autograder_summary(results_path)
+    autograder_summary["team_login_ids"] = group_summary["login_ids"]
+    replace_autograder_summary(results_path, autograder_summary)
+
+    members = []
+    for login_id in group_summary["login_ids"]:
+        member_directory = os.path.join(submissions_directory, login_id, assignment_name)
+        if login_id == representative or not os.path.isdir(member_directory):
+            continue
+
+        shutil.copyfile(results_path, os.path.join(member_directory, results_file))
+        members.append(login_id)
+
+    return members
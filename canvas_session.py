@@ -0,0 +1,338 @@
+import httplib
+import os
+import random
+import socket
+import threading
+import time
+import urllib
+import urllib2
+import urllib2_extension
+from response_cache import ResponseCache
+
+
+class RateLimitScheduler(object):
+    """Keep requests to Canvas just below its rate limit.
+
+    Canvas charges each request against a per-token bucket, reports what the request cost in the X-Request-Cost
+    header and what is left in the X-Rate-Limit-Remaining header, and answers with 403 (Rate Limit Exceeded) or 429
+    once the bucket is empty.  The requests in flight will each take about the average cost out of the bucket, so no
+    more are allowed in flight than the bucket can pay for above its low water mark.  Within that, the number grows by
+    one for every window of requests that comes back with plenty of bucket left, and is halved when the bucket (less
+    what the requests in flight will cost) runs low or a request is throttled.  While the bucket is low, new requests
+    are also delayed to give it time to refill."""
+
+    def __init__(self, max_in_flight=8, initial_in_flight=4, low_water=150.0, max_delay=2.0, throttle_backoff=5.0,
+                 cost_smoothing=0.2):
+        self.max_in_flight = max_in_flight
+        self.limit = float(min(initial_in_flight, max_in_flight))
+        self.low_water = low_water
+        self.max_delay = max_delay
+        self.throttle_backoff = throttle_backoff
+        self.cost_smoothing = cost_smoothing
+        self.in_flight = 0
+        self.remaining = None
+        self.request_cost = None
+        self.throttled = 0
+        self._condition = threading.Condition()
+        return
+
+    def get_projected_remaining(self):
+        """What will be left in the bucket once the requests in flight have been paid for (None if unknown)."""
+        if self.remaining is None:
+            return None
+        return self.remaining - self.in_flight * (self.request_cost or 0)
+
+    def acquire(self):
+        """Wait until another request may be sent."""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+
+            delay = 0
+            projected_remaining = self.get_projected_remaining()
+            if projected_remaining is not None and projected_remaining < self.low_water:
+                delay = self.max_delay * (1 - max(projected_remaining, 0) / self.low_water)
+
+            self.in_flight += 1
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def release(self, headers=None, throttled=False):
+        """Record how a request went.
+        :param headers: the response headers (a mimetools.Message), if there was a response
+        :param throttled: True if Canvas refused the request because of the rate limit
+        """
+        with self._condition:
+            self.in_flight -= 1
+
+            if headers is not None:
+                remaining = get_float_header(headers, "X-Rate-Limit-Remaining")
+                if remaining is not None:
+                    self.remaining = remaining
+
+                cost = get_float_header(headers, "X-Request-Cost")
+                if cost is not None:
+                    if self.request_cost is None:
+                        self.request_cost = cost
+                    else:
+                        self.request_cost += self.cost_smoothing * (cost - self.request_cost)
+
+            projected_remaining = self.get_projected_remaining()
+            if throttled:
+                self.throttled += 1
+                self.limit = max(1.0, self.limit / 2)
+            elif projected_remaining is not None and projected_remaining < self.low_water:
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                self.limit = min(float(self.max_in_flight), self.limit + 1 / self.limit)
+
+            if self.remaining is not None and self.request_cost:
+                # no more in flight than the bucket can pay for above the low water mark
+                affordable = (self.remaining - self.low_water) / self.request_cost
+                self.limit = max(1.0, min(self.limit, affordable))
+
+            self._condition.notify_all()
+
+    def wait_after_throttle(self, attempt):
+        time.sleep(self.throttle_backoff * attempt)
+
+
+def get_float_header(headers, header_name):
+    '''
+    :param headers: response headers (a mimetools.Message)
+    :return: the header's value as a float, or None if it is missing or not a number
+    '''
+    value = headers.getheader(header_name)
+    if value is None:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+# server errors that are usually transient
+retry_status_codes = [500, 502, 503, 504]
+
+
+def is_rate_limited(error):
+    '''
+    Check whether an HTTPError means Canvas throttled the request
+    :param error: urllib2.HTTPError
+    :return: boolean
+    '''
+    if error.code == 429:
+        return True
+    if error.code != 403:
+        return False
+
+    # a 403 may also be a real permissions problem, so check the body.  Keep the body around for the caller.
+    body = error.read()
+    error.read = lambda *args: body
+    return "Rate Limit Exceeded" in body
+
+
+class CanvasSession(object):
+    """A reusable HTTP session for Canvas.  Connections are kept alive and pooled per host, so repeated API calls
+    don't each pay for a new TCP + TLS handshake.  Requests that carry a token (i.e. Canvas API calls) go through a
+    RateLimitScheduler, and requests Canvas throttles are retried rather than failed."""
+
+    def __init__(self, max_connections_per_host=8, max_requests_in_flight=8, max_throttle_retries=6, max_retries=4,
+                 connect_timeout=15, read_timeout=120, cache_directory=None):
+        if cache_directory is None:
+            self.cache = None
+        else:
+            self.cache = ResponseCache(cache_directory)
+
+        self.pool = urllib2_extension.ConnectionPool(max_per_host=max_connections_per_host)
+        self.scheduler = RateLimitScheduler(max_in_flight=max_requests_in_flight)
+        self.max_throttle_retries = max_throttle_retries
+        self.max_retries = max_retries
+        self.backoff_base = 0.5
+        self.backoff_cap = 30.0
+        self.retries = 0
+        self.backoff_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+        handler = urllib2_extension.KeepAliveHandler(self.pool, connect_timeout=connect_timeout,
+                                                     read_timeout=read_timeout)
+        self.opener = urllib2.build_opener(handler)
+        self.no_redirect_opener = urllib2.build_opener(handler, urllib2_extension.NoRedirectHandler())
+        return
+
+    def open(self, url, token=None, data=None, method=None, body=None, headers={}, follow_redirects=True, retry=None,
+             timeouts=None):
+        '''
+        Open a url using a pooled connection
+        :param url: the url to open
+        :param token: Canvas token.  If provided, it is sent in the Authorization header.
+        :param data: a dictionary (or list of pairs) of form fields to url-encode and send as the request body
+        :param method: HTTP method (defaults to GET, or POST if there is data)
+        :param body: a request body to send as-is (instead of data)
+        :param headers: a dictionary of additional request headers
+        :param follow_redirects: if False, 3xx responses are returned instead of followed
+        :param retry: should the request be retried (with backoff) after a server error or a failed connection?
+                      Defaults to True for GET requests only, since other requests may not be safe to repeat.
+        :param timeouts: a (connect_timeout, read_timeout) tuple in seconds, overriding the session's timeouts
+        :return: a file-like response object, as returned by urllib2.urlopen
+        '''
+        assert isinstance(url, str), "url is not a string: %s" % url
+        assert isinstance(headers, dict), "headers is not a dict: %s" % headers
+
+        request = urllib2_extension.MethodRequest(url, method=method)
+
+        if token:
+            request.add_header("Authorization", "Bearer %s" % token)
+
+        for header_name in headers:
+            request.add_header(header_name, headers[header_name])
+
+        if data:
+            request.add_data(urllib.urlencode(data))
+        elif body is not None:
+            request.add_data(body)
+
+        if timeouts is not None:
+            request.connect_timeout, request.read_timeout = timeouts
+
+        if retry is None:
+            retry = request.get_method() == "GET"
+
+        if follow_redirects:
+            opener = self.opener
+        else:
+            opener = self.no_redirect_opener
+
+        # only Canvas API calls count against the rate limit
+        scheduled = bool(token)
+
+        if self.cache is None or not token or request.get_method() != "GET":
+            return self._open_with_retries(request, opener, retry, scheduled)
+
+        entry = self.cache.get(url, token)
+        conditional_headers = {}
+        if entry is not None:
+            conditional_headers = self.cache.get_conditional_headers(entry)
+            for header_name in conditional_headers:
+                request.add_header(header_name, conditional_headers[header_name])
+
+        try:
+            response = self._open_with_retries(request, opener, retry, scheduled)
+        except urllib2.HTTPError as e:
+            if e.code != 304 or entry is None:
+                raise
+            e.close()
+
+            cached_response = self.cache.get_cached_response(entry)
+            if cached_response is not None:
+                return cached_response
+
+            # the entry was evicted in the meantime, so ask again without the validators
+            for header_name in conditional_headers:
+                del request.headers[header_name.capitalize()]
+            response = self._open_with_retries(request, opener, retry, scheduled)
+
+        return self.cache.store(url, token, response)
+
+    def _open_with_retries(self, request, opener, retry, scheduled):
+        throttled_attempts = 0
+        failed_attempts = 0
+        while True:
+            if hasattr(request.data, "seek"):
+                request.data.seek(0)
+
+            if scheduled:
+                self.scheduler.acquire()
+
+            try:
+                response = opener.open(request)
+            except urllib2.HTTPError as e:
+                throttled = scheduled and is_rate_limited(e)
+                if scheduled:
+                    self.scheduler.release(e.info(), throttled)
+
+                if throttled and throttled_attempts < self.max_throttle_retries:
+                    throttled_attempts += 1
+                    e.close()
+                    self.scheduler.wait_after_throttle(throttled_attempts)
+                elif retry and e.code in retry_status_codes and failed_attempts < self.max_retries:
+                    failed_attempts += 1
+                    e.close()
+                    self.backoff(failed_attempts)
+                else:
+                    raise
+            except (urllib2.URLError, socket.error, httplib.HTTPException):
+                if scheduled:
+                    self.scheduler.release()
+
+                if retry and failed_attempts < self.max_retries:
+                    failed_attempts += 1
+                    self.backoff(failed_attempts)
+                else:
+                    raise
+            except:
+                if scheduled:
+                    self.scheduler.release()
+                raise
+            else:
+                if scheduled:
+                    self.scheduler.release(response.info())
+                return response
+
+    def backoff(self, attempt):
+        '''
+        Sleep before retrying a failed request: a random time ("full jitter") up to an exponentially growing cap
+        :param attempt: how many times the request has failed so far
+        :return: None
+        '''
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+        with self._stats_lock:
+            self.retries += 1
+            self.backoff_seconds += delay
+
+        time.sleep(delay)
+
+    @property
+    def connections_opened(self):
+        return self.pool.opened
+
+    @property
+    def connections_reused(self):
+        return self.pool.reused
+
+    def get_stats(self):
+        return {"connections_opened": self.connections_opened,
+                "connections_reused": self.connections_reused,
+                "requests_throttled": self.scheduler.throttled,
+                "requests_retried": self.retries,
+                "backoff_seconds": self.backoff_seconds,
+                "cache_hits": self.cache.hits if self.cache else 0,
+                "cache_misses": self.cache.misses if self.cache else 0}
+
+    def close(self):
+        self.pool.close()
+
+
+resources_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), "resources")
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    '''
+    Get the session shared by everything in this process
+    :return: CanvasSession
+    '''
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            cache_directory = None
+            if os.path.isdir(resources_directory):
+                cache_directory = os.path.join(resources_directory, "http_cache")
+            _session = CanvasSession(cache_directory=cache_directory)
+
+    return _session
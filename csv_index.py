@@ -0,0 +1,69 @@
+import csv
+import os
+import threading
+
+
+class CsvIndex(object):
+    """The rows of a .csv file (e.g. roster.csv or assignments.csv), indexed for lookups by column value.
+
+    The file is read once, and each column that is searched (e.g. id, login_id or name) gets a case-insensitive
+    dictionary from value to row, built the first time it is needed.  If the file changes (its mtime or size is
+    different), it is read again on the next lookup."""
+
+    def __init__(self, csv_file):
+        self.csv_file = csv_file
+        self.rows = []
+        self.loads = 0
+        self._indexes = {}
+        self._file_version = None
+        self._lock = threading.Lock()
+        return
+
+    def lookup(self, search_key, search_value):
+        '''
+        Find the first row whose search_key column matches search_value (ignoring case)
+        :return: the row (a dictionary), or None
+        '''
+        with self._lock:
+            self._reload_if_changed()
+
+            if search_key not in self._indexes:
+                index = {}
+                for row in self.rows:
+                    if search_key not in row:
+                        raise KeyError(search_key)
+                    index.setdefault(str(row[search_key]).lower(), row)
+                self._indexes[search_key] = index
+
+            return self._indexes[search_key].get(str(search_value).lower())
+
+    def _reload_if_changed(self):
+        stat = os.stat(self.csv_file)
+        file_version = (stat.st_mtime, stat.st_size)
+        if file_version == self._file_version:
+            return
+
+        with open(self.csv_file) as f:
+            reader = csv.DictReader(f) # values in the first row of the csvfile will be used as the fieldnames.
+            self.rows = list(reader)
+
+        self._indexes = {}
+        self._file_version = file_version
+        self.loads += 1
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_csv_index(csv_file):
+    '''
+    Get the index of a .csv file, shared by everything in this process
+    :return: CsvIndex
+    '''
+    path = os.path.realpath(csv_file)
+
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = CsvIndex(path)
+        return _indexes[path]
@@ -1,9 +1,14 @@
 from optparse import OptionParser
+import json
 import os
-import subprocess
+import time
+from canvas_client import CanvasClient
+from canvas_groups import get_groups, write_group_file
+from download_submission import download_submission, RETURNCODE_SUCCESS
+from state_store import StateStore
 from utils import get_token, download_all_objects_to_list, get_assignment_name_and_id, get_netid_from_user_id, \
-                  build_canvas_url, make_new_directory, write_to_log
-import sys
+                  build_canvas_url, make_new_directory, write_to_log, max_per_page, open_canvas_page_as_string, \
+                  get_run_session_stats, format_session_stats, format_durations
 
 
 parser = OptionParser(usage="Usage: %prog [options]",
@@ -30,6 +35,18 @@ parser.add_option("-o", "--download-filename",
 parser.add_option("-m",
                   dest="make_assignment_directory", action="store_true", default=False,
                   help="If the directory <assignment_name> doesn't exist, should it be created?")
+parser.add_option("-j", "--jobs",
+                  dest="jobs", default=8, type=int,
+                  help="The number of submissions to download at the same time.  Default: %default")
+parser.add_option("-G", "--groups",
+                  dest="groups", action="store_true", default=False,
+                  help="For a group assignment, download one submission per Canvas group, to the directory of the "
+                       "member with the first netid.  Every member's directory gets a group.json naming that member, "
+                       "and grade_all_submissions.py grades only that member's copy and gives the results to the "
+                       "rest of the group.")
+parser.add_option("-D", "--state-db",
+                  dest="state_db", default=None, type=str,
+                  help="Also record the downloads in this SQLite database (see state_store.py).")
 parser.add_option("-v", "--verbose",
                   dest="verbose", action="store_true", default=False,
                   help="Should additional output be printed?")
@@ -46,14 +63,50 @@ def get_or_make_directory(parent_directory, subdirectory):
         return target_directory
 
 
-def build_submissions_url(course_id, assignment_id, page_num):
+def build_submissions_url(course_id, assignment_id):
     api_subdirectories = ["courses", course_id, "assignments", assignment_id, "submissions"]
-    params = {"page_num": page_num}
+    params = {"per_page": max_per_page}
     url = build_canvas_url(api_subdirectories, params)
 
     return url
 
 
+def build_assignment_url(course_id, assignment_id):
+    return build_canvas_url(["courses", course_id, "assignments", assignment_id], params={})
+
+
+def download_queued_submission(job):
+    '''
+    Download one submission on a worker thread
+    :param job: dictionary of download_submission arguments, plus "netid" and "queued_at" (when the job was queued)
+    :return: (netid, returncode, seconds spent waiting in the queue, seconds spent downloading, bytes downloaded).
+             returncode is None if the download failed.
+    '''
+    started_at = time.time()
+    netid = job["netid"]
+    submission = job["remote_submission_summary"]
+
+    try:
+        returncode = download_submission(job["course_id"], job["assignment_id"], job["user_id"], netid,
+                                         job["download_directory"], job["token"],
+                                         download_filename=job["download_filename"],
+                                         make_assignment_directory=job["make_assignment_directory"],
+                                         remote_submission_summary=submission,
+                                         assignment_summary=job["assignment_summary"],
+                                         state_store=job["state_store"])
+    except Exception as e:
+        msg = "%s: download failed for netid [%s]: %s" % (__file__, netid, e)
+        print(msg)
+        write_to_log(msg)
+        returncode = None
+
+    downloaded_bytes = 0
+    if returncode == RETURNCODE_SUCCESS:
+        downloaded_bytes = submission["attachments"][0].get("size", 0)
+
+    return netid, returncode, started_at - job["queued_at"], time.time() - started_at, downloaded_bytes
+
+
 if __name__ == "__main__":
     (options, args) = parser.parse_args()
 
@@ -87,13 +140,61 @@ if __name__ == "__main__":
     assignment_name, assignment_id = get_assignment_name_and_id(assignment_name, assignment_id, assignment_list, course_id)
 
     token = get_token(token_json_file)
-    url = build_submissions_url(course_id, assignment_id, page_num=1)
+    url = build_submissions_url(course_id, assignment_id)
     submissions = []
     download_all_objects_to_list(url, token, mylist=submissions)
 
-    plist = {}
+    # the listing already has everything download_submission needs, so hand it over along with the assignment
+    # (fetched once for the whole run) rather than fetching both again for every student
+    assignment_summary = json.loads(open_canvas_page_as_string(build_assignment_url(course_id, assignment_id), token))
+
+    state_store = None
+    if options.state_db is not None:
+        state_store = StateStore(options.state_db)
+        state_store.record_assignment(assignment_id, assignment_name, course_id)
+
+    groups = []
+    if options.groups:
+        group_category_id = assignment_summary.get("group_category_id")
+        if group_category_id is None:
+            msg = "%s: [%s] is not a group assignment, so downloading every student's submission" % \
+                  (__file__, assignment_name)
+            print(msg)
+            write_to_log(msg)
+        else:
+            with CanvasClient(token, concurrency=max(1, options.jobs)) as group_client:
+                groups = get_groups(group_client, group_category_id)
+
+    groups_by_user_id = {}
+    for group in groups:
+        for user_id in group["user_ids"]:
+            groups_by_user_id[user_id] = group
+
+    jobs = []
+
+    def queue_download(netid, user_id, submission):
+        netid_directory = get_or_make_directory(parent_directory, netid)
+        assignment_directory = os.path.join(netid_directory, assignment_name)
+
+        if verbose:
+            print("queueing download for netid [%s] to %s" % (netid, assignment_directory))
+
+        jobs.append({"course_id": course_id,
+                     "assignment_id": assignment_id,
+                     "user_id": user_id,
+                     "netid": netid,
+                     "download_directory": assignment_directory,
+                     "token": token,
+                     "download_filename": download_filename,
+                     "make_assignment_directory": make_assignment_directory,
+                     "remote_submission_summary": submission,
+                     "assignment_summary": assignment_summary,
+                     "state_store": state_store,
+                     "queued_at": time.time()})
+
     count = 0
     weird_skips = 0
+    group_members = {}
     for submission in submissions:
         user_id = submission["user_id"]
         netid = get_netid_from_user_id(user_id, roster_file)
@@ -105,6 +206,13 @@ if __name__ == "__main__":
             weird_skips += 1
             continue
 
+        if user_id in groups_by_user_id:
+            # downloaded once for the whole group, below
+            group_members.setdefault(groups_by_user_id[user_id]["id"], []).append((netid, user_id, submission))
+            if state_store is not None:
+                state_store.record_student(user_id, netid)
+            continue
+
         # if there are no attempted submissions, then there is nothing to download
         # (note that the submission might have an 'id' assigned if we have already uploaded a grade for this student,
         #  e.g. if their partner submitted the assignment)
@@ -115,42 +223,89 @@ if __name__ == "__main__":
                 write_to_log(msg)
             continue
 
-        netid_directory = get_or_make_directory(parent_directory, netid)
-        assignment_directory = os.path.join(netid_directory, assignment_name)
-
-        args = ["python", "download_submission.py",
-                  "-c", str(course_id),
-                  "-a", assignment_name,
-                  "-i", str(assignment_id),
-                  "-u", str(user_id),
-                  "-n", netid,
-                  "-d", assignment_directory,
-                ]
-
-        if make_assignment_directory:
-            args.extend(["-m"])
+        if state_store is not None:
+            state_store.record_student(user_id, netid)
 
-        if download_filename is not None:
-            args.extend(["-o", download_filename])
+        queue_download(netid, user_id, submission)
 
-        args_as_string = " ".join(args)
-        if verbose:
-            print("calling " + args_as_string)
-        p = subprocess.Popen(args)
-        plist[netid] = p
+    # a group's members share one submission, so only download it for the member with the first netid
+    group_downloads = []
+    for group in groups:
+        members = sorted(group_members.get(group["id"], []))
+        submitted = [member for member in members if member[2]["attempt"] is not None]
+        if len(submitted) == 0:
+            if verbose and len(members) > 0:
+                msg = "%s: No submission for group [%s].  Skipping." % (__file__, group["name"])
+                print(msg)
+                write_to_log(msg)
+            continue
 
-    for netid in plist:
-        p = plist[netid]
-        p.wait()
-        if p.returncode == 0:
-            count += 1
+        representative, user_id, submission = submitted[0]
+        queue_download(representative, user_id, submission)
+        group_downloads.append((group, [member[0] for member in members], representative))
+
+    # download on a bounded pool of threads in this process, sharing its connections and rate limit scheduler
+    start = time.time()
+    queue_waits = []
+    latencies = []
+    total_bytes = 0
+    failures = 0
+    client = CanvasClient(token, concurrency=max(1, options.jobs))
+    with client:
+        for netid, returncode, queue_wait, latency, downloaded_bytes in \
+                client.imap_unordered(download_queued_submission, jobs):
+            queue_waits.append(queue_wait)
+            latencies.append(latency)
+            total_bytes += downloaded_bytes
+            if returncode == RETURNCODE_SUCCESS:
+                count += 1
+            elif returncode is None:
+                failures += 1
+    elapsed = time.time() - start
+
+    # tell every group member's directory where the group's submission is
+    for group, login_ids, representative in group_downloads:
+        for login_id in login_ids:
+            assignment_directory = os.path.join(parent_directory, login_id, assignment_name)
+            if not os.path.isdir(assignment_directory):
+                if not make_assignment_directory:
+                    continue
+                os.makedirs(assignment_directory, 0755)
+            write_group_file(assignment_directory, group["id"], group["name"], login_ids, representative)
 
     msg = "%d submissions downloaded" % count
     print(msg)
     write_to_log(msg)
 
+    msg = "%d downloads failed (see canvaslib.log)" % failures
+    print(msg)
+    write_to_log(msg)
+
     msg = "%d weird skips (see canvaslib.log)" % weird_skips
     print(msg)
     write_to_log(msg)
 
+    if groups:
+        msg = "%d groups downloaded once each, for %d students" % \
+              (len(group_downloads), sum(len(login_ids) for group, login_ids, representative in group_downloads))
+        print(msg)
+        write_to_log(msg)
+
+    if jobs:
+        msg = "%d jobs on %d workers in %.1f seconds (%.1f submissions/s, %.1f KB/s)" % \
+              (len(jobs), client.concurrency, elapsed, len(jobs) / max(elapsed, 0.001),
+               total_bytes / 1024.0 / max(elapsed, 0.001))
+        print(msg)
+        write_to_log(msg)
 
+        msg = "queue wait: %s" % format_durations(queue_waits)
+        print(msg)
+        write_to_log(msg)
+
+        msg = "download latency: %s" % format_durations(latencies)
+        print(msg)
+        write_to_log(msg)
+
+    msg = format_session_stats(get_run_session_stats())
+    print(msg)
+    write_to_log(msg)
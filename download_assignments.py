@@ -1,6 +1,7 @@
 from optparse import OptionParser
 import os
-from utils import get_token, download_all_objects_to_list, write_list_to_csv, build_canvas_url
+from utils import get_token, iterate_all_objects, write_objects_to_csv, build_canvas_url, max_per_page, \
+                  format_session_stats, get_run_session_stats
 
 
 parser = OptionParser(usage="Usage: %prog [options]",
@@ -13,9 +14,9 @@ parser.add_option("-t", "--token-json-file",
                   help="The path to a .json file containing the Canvas authorization token.")
 
 
-def build_assignments_url(course_id, page_num):
+def build_assignments_url(course_id):
     api_subdirectories = ["courses", course_id, "assignments"]
-    params = {"page_num": page_num}
+    params = {"per_page": max_per_page}
     url = build_canvas_url(api_subdirectories, params)
 
     return url
@@ -39,11 +40,10 @@ if __name__ == "__main__":
             print("download_assignments.py canceled.  Exiting.")
             exit()
 
-    url = build_assignments_url(course_id, page_num=1)
+    url = build_assignments_url(course_id)
     token = get_token(token_json_file)
-    assignments = []
-    download_all_objects_to_list(url, token, mylist=assignments)
-
-    write_list_to_csv(mylist=assignments, destination=assignments_file)
+    count = write_objects_to_csv(iterate_all_objects(url, token), destination=assignments_file)
+    print("%d assignments written" % count)
 
     print("Assignment list has been downloaded to " + assignments_file)
+    print(format_session_stats(get_run_session_stats()))
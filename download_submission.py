@@ -1,11 +1,15 @@
 from optparse import OptionParser
-import urllib2
+import atexit
 import json
 import os
 import sys
 import datetime
+# datetime.strptime imports _strptime lazily, which isn't thread safe; import it now, before downloads run on threads
+import _strptime
+from history_file import append_to_history
+from state_store import StateStore
 from utils import get_assignment_name_and_id, get_netid_and_user_id, build_canvas_url, open_canvas_page_as_string, \
-                  get_token, write_to_log
+                  get_token, write_to_log, write_session_stats_to_log, download_file
 
 
 parser = OptionParser(usage="Usage: %prog [options]",
@@ -39,8 +43,16 @@ parser.add_option("-u", "--user-id",
 parser.add_option("-m",
                   dest="make_assignment_directory", action="store_true", default=False,
                   help="If the directory <assignment_name> doesn't exist, should it be created?")
+parser.add_option("-D", "--state-db",
+                  dest="state_db", default=None, type=str,
+                  help="Also record the download in this SQLite database (see state_store.py).")
 
 
+RETURNCODE_SUCCESS = 0
+RETURNCODE_NOT_NEWER = 1
+RETURNCODE_NO_ATTACHMENTS = 2
+RETURNCODE_WRONG_ATTACHMENT_COUNT = 3
+
 
 def get_filename(assignment_name, netid):
     # TODO remove this function?
@@ -51,39 +63,31 @@ def get_filename(assignment_name, netid):
     return "xv6_" + assignment_name.replace(" ", "_") + "_" + netid + ".tar.gz"
 
 
-if __name__ == "__main__":
-
-    # Get command line options
-    (options, args) = parser.parse_args()
-
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-
-    # for token generation, see https://canvas.instructure.com/doc/api/file.oauth.html#manual-token-generation
-    token_json_file = roster_file = os.path.join(script_dir, "resources", "token.json")
-    token = get_token(token_json_file)
-
-    course_id = options.course_id    # e.g. course_id = "43589"
-    assert isinstance(course_id, int)
-
-    roster_file = os.path.join(script_dir, "resources", "roster.csv")
-    assignment_list = os.path.join(script_dir, "resources", "assignments.csv")
-
-    assignment_name = options.assignment_name
-    assignment_id = options.assignment_id    # e.g. assignment_id = "280047"
-    assignment_name, assignment_id = get_assignment_name_and_id(assignment_name, assignment_id, assignment_list)
-
-    download_directory = options.download_directory
-
-    netid = options.netid
-    user_id = options.user_id    # e.g. user_id = "44648"
-    netid, user_id = get_netid_and_user_id(netid, user_id, roster_file)
-
-    make_assignment_directory = options.make_assignment_directory
-
+def download_submission(course_id, assignment_id, user_id, netid, download_directory, token, download_filename=None,
+                        make_assignment_directory=False, remote_submission_summary=None, assignment_summary=None,
+                        state_store=None):
+    '''
+    Download a student's submission, if it is newer than the one already in download_directory
+    :param course_id: Canvas course_id
+    :param assignment_id: Canvas assignment_id
+    :param user_id: Canvas user_id of the student
+    :param netid: the student's netid (only used in messages)
+    :param download_directory: the path to download the submission to
+    :param token: Canvas token
+    :param download_filename: the name to give the downloaded file (defaults to the name of the uploaded file)
+    :param make_assignment_directory: create download_directory if it doesn't exist?
+    :param remote_submission_summary: the student's submission object, if the caller already has it (e.g. from the
+                                      assignment's submission listing).  Otherwise it is fetched from Canvas.
+    :param assignment_summary: the assignment object, if the caller already has it.  Otherwise it is fetched from
+                               Canvas.
+    :param state_store: a StateStore to record the download in, if any
+    :return: one of the RETURNCODE_* constants
+    '''
     # download submission info
-    url = build_canvas_url(["courses", course_id, "assignments", assignment_id, "submissions", user_id], params={})
-    response = open_canvas_page_as_string(url, token)
-    remote_submission_summary = json.loads(response)
+    if remote_submission_summary is None:
+        url = build_canvas_url(["courses", course_id, "assignments", assignment_id, "submissions", user_id], params={})
+        response = open_canvas_page_as_string(url, token)
+        remote_submission_summary = json.loads(response)
 
     # only download new submissions
     submission_summary_file = "submission.json"
@@ -95,7 +99,7 @@ if __name__ == "__main__":
 
         local_submitted_at = datetime.datetime.strptime(local_submission_summary["submitted_at"], "%Y-%m-%dT%H:%M:%SZ").timetuple()
 
-        if remote_submission_summary["submitted_at"] != "null":
+        if remote_submission_summary["submitted_at"] not in [None, "null"]:
             remote_submitted_at = datetime.datetime.strptime(remote_submission_summary["submitted_at"], "%Y-%m-%dT%H:%M:%SZ").timetuple()
 
             if not (remote_submitted_at > local_submitted_at):
@@ -104,13 +108,13 @@ if __name__ == "__main__":
                       (__file__, remote_submission_summary["submitted_at"], local_submission_summary["submitted_at"], netid)
                 print(msg)
                 write_to_log(msg)
-                sys.exit(1)
+                return RETURNCODE_NOT_NEWER
 
     if "attachments" not in remote_submission_summary:
         msg = "%s: No attachments submitted for netid [%s] user_id [%s]. Exiting." % (__file__, netid, user_id)
         print(msg)
         write_to_log(msg)
-        sys.exit(2)
+        return RETURNCODE_NO_ATTACHMENTS
 
     attachments = remote_submission_summary["attachments"]
 
@@ -118,13 +122,13 @@ if __name__ == "__main__":
         msg = "%s: Expected 1 attachment, got [%s]. Exiting." % (__file__, len(attachments))
         print(msg)
         write_to_log(msg)
-        sys.exit(3)
+        return RETURNCODE_WRONG_ATTACHMENT_COUNT
 
     # if we get this far, we're doing the download
     # First, download assignment info
-    url = build_canvas_url(["courses", course_id, "assignments", assignment_id], params={})
-    assignment_response = open_canvas_page_as_string(url, token)
-    assignment_response = json.loads(assignment_response)
+    if assignment_summary is None:
+        url = build_canvas_url(["courses", course_id, "assignments", assignment_id], params={})
+        assignment_summary = json.loads(open_canvas_page_as_string(url, token))
     assignment_summary_path = os.path.join(download_directory, "assignment.json")
 
     if not os.path.isdir(download_directory) and make_assignment_directory:
@@ -136,36 +140,69 @@ if __name__ == "__main__":
     assert os.path.isdir(download_directory), "download_directory is not a valid directory: %s" % download_directory
 
     with open(assignment_summary_path, "w") as f:
-        json.dump(assignment_response, f)
+        json.dump(assignment_summary, f)
 
     file_url = attachments[0]["url"]
     if not os.path.isdir(download_directory):
         os.mkdir(download_directory, 0755)
 
-    filename = options.download_filename
+    filename = download_filename
     if filename is None:
         filename = attachments[0]["filename"]
 
     download_path = os.path.join(download_directory, filename)
 
-    request = urllib2.Request(file_url)
-    download_response = urllib2.urlopen(request)
-    with open(download_path, "wb") as local_file:
-        local_file.write(download_response.read())
+    download_file(str(file_url), download_path)
 
-    # update summary file and history file (list of all summaries)
-    submissions_history_file = "submissions_history.json"
+    # update summary file and history file (one summary per line)
+    submissions_history_file = "submissions_history.jsonl"
     submissions_history_path = os.path.join(download_directory, submissions_history_file)
-    if os.path.isfile(submissions_history_path):
-        with open(submissions_history_path, "r") as f:
-            submissions_history = json.load(f)
-    else:
-        submissions_history = []
-
-    submissions_history.append(remote_submission_summary)
-    with open(submissions_history_path, "w") as f:
-        json.dump(submissions_history, f)
+    append_to_history(submissions_history_path, remote_submission_summary)
 
     with open(local_submission_summary_path, "w") as f:
         json.dump(remote_submission_summary, f)
 
+    if state_store is not None:
+        state_store.record_submission(netid, assignment_summary["name"], remote_submission_summary["submitted_at"])
+
+    return RETURNCODE_SUCCESS
+
+
+if __name__ == "__main__":
+
+    # Get command line options
+    (options, args) = parser.parse_args()
+
+    atexit.register(write_session_stats_to_log, __file__)
+
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # for token generation, see https://canvas.instructure.com/doc/api/file.oauth.html#manual-token-generation
+    token_json_file = roster_file = os.path.join(script_dir, "resources", "token.json")
+    token = get_token(token_json_file)
+
+    course_id = options.course_id    # e.g. course_id = "43589"
+    assert isinstance(course_id, int)
+
+    roster_file = os.path.join(script_dir, "resources", "roster.csv")
+    assignment_list = os.path.join(script_dir, "resources", "assignments.csv")
+
+    assignment_name = options.assignment_name
+    assignment_id = options.assignment_id    # e.g. assignment_id = "280047"
+    assignment_name, assignment_id = get_assignment_name_and_id(assignment_name, assignment_id, assignment_list)
+
+    download_directory = options.download_directory
+
+    netid = options.netid
+    user_id = options.user_id    # e.g. user_id = "44648"
+    netid, user_id = get_netid_and_user_id(netid, user_id, roster_file)
+
+    state_store = None
+    if options.state_db is not None:
+        state_store = StateStore(options.state_db)
+
+    returncode = download_submission(course_id, assignment_id, user_id, netid, download_directory, token,
+                                     download_filename=options.download_filename,
+                                     make_assignment_directory=options.make_assignment_directory,
+                                     state_store=state_store)
+    sys.exit(returncode)
@@ -1,7 +1,16 @@
 from optparse import OptionParser
+import functools
+import multiprocessing
 import os
-from utils import get_assignment_name_and_id, write_to_log
-import subprocess
+from autograder_worker import AutograderWorkerPool
+from canvas_groups import is_covered_by_group, fan_out_group_results
+from grade_submission import grade_submission, get_student_ids, split_autograder_command, bookkeeping_files, \
+                             record_grading_run
+from grading_cache import GradingCache
+from job_scheduler import JobScheduler
+from sandbox import sandbox_methods
+from state_store import StateStore
+from utils import get_assignment_name_and_id, write_to_log, format_durations
 import time
 
 
@@ -43,6 +52,38 @@ parser.add_option("-C", "--autograder-command",
                        "'points_received': <int>, "
                        "'team_login_ids': [login_id_1, login_id_2, ...]}"
                        "It may optionally contain the field 'submitter_login_id': <login_id>")
+parser.add_option("-j", "--jobs",
+                  dest="jobs", default=multiprocessing.cpu_count(), type=int,
+                  help="The maximum number of submissions to grade at the same time.  Default: the number of cores "
+                       "(%default)")
+parser.add_option("--max-load",
+                  dest="max_load", default=None, type=float,
+                  help="Don't start grading another submission while the 1 minute load average is at or above this.  "
+                       "Default: the number of jobs")
+parser.add_option("--min-free-memory",
+                  dest="min_free_memory", default=1024, type=int,
+                  help="Don't start grading another submission while less than this many MB of memory are "
+                       "available.  Default: %default")
+parser.add_option("-s", "--sandbox",
+                  dest="sandbox_method", default="auto", type="choice", choices=sandbox_methods,
+                  help="How to make the scratch copy of each submission that is graded: 'reflink', 'hardlink', 'copy' "
+                       "or 'auto'.  See grade_submission.py -h.  Default: %default")
+parser.add_option("-t", "--scratch-directory",
+                  dest="scratch_directory", default=None, type=str,
+                  help="Where to make the scratch copies, e.g. a tmpfs such as /dev/shm.  Default: the submissions "
+                       "directory")
+parser.add_option("-W", "--worker-command",
+                  dest="worker_command", default=None, type=str,
+                  help="Instead of running the autograder command once per submission, start --jobs warm autograder "
+                       "workers with this command and hand the submissions to them.  See autograder_worker.py for the "
+                       "protocol the workers must speak.")
+parser.add_option("-K", "--grading-cache",
+                  dest="grading_cache_directory", default=None, type=str,
+                  help="Keep a cache of autograder results in this directory, keyed by each submission's content and "
+                       "the autograder command, and reuse them for identical submissions.  See grade_submission.py -h.")
+parser.add_option("-D", "--state-db",
+                  dest="state_db", default=None, type=str,
+                  help="Also record the grading runs in this SQLite database (see state_store.py).")
 
 
 RETURNCODE_SUCCESS = 0
@@ -50,6 +91,67 @@ RETURNCODE_NO_SUBMISSION = 1
 RETURNCODE_OTHER = 2
 RETURNCODE_ALREADY_GRADED = 3
 RETURNCODE_FAILED = 4
+RETURNCODE_CACHED = 5
+
+roster_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), "resources", "roster.csv")
+
+
+def build_grade_submission_arguments(submissions_directory, assignment_name, netid, autograder_command,
+                                     make_assignment_directory=False, force_do_grading=False, sandbox_method="auto",
+                                     scratch_directory=None, grading_cache_directory=None, state_db=None):
+    '''
+    Build the command line that grades one student's submission with grade_submission.py
+    :return: list of arguments
+    '''
+    arguments = ["python", "grade_submission.py",
+                 "-d", submissions_directory,
+                 "-a", assignment_name,
+                 "-l", netid,
+                 "-C", autograder_command]
+
+    if make_assignment_directory:
+        arguments.append("-m")
+
+    if force_do_grading:
+        arguments.append("-f")
+
+    arguments.extend(["-s", sandbox_method])
+    if scratch_directory is not None:
+        arguments.extend(["-t", scratch_directory])
+
+    if grading_cache_directory is not None:
+        arguments.extend(["-K", grading_cache_directory])
+
+    if state_db is not None:
+        arguments.extend(["-D", state_db])
+
+    return arguments
+
+
+def grade_with_worker(worker, submissions_directory, assignment_name, netid, state_store=None, **grade_arguments):
+    '''
+    Grade one student's submission in this process, using a warm autograder worker
+    :return: the same return code grade_submission.py would exit with
+    '''
+    print("Attempting to grade submissions for: %s" % netid)
+
+    login_id, user_id = get_student_ids(netid, None, roster_file)
+    if login_id is None:
+        return RETURNCODE_OTHER
+
+    try:
+        returncode = grade_submission(submissions_directory, assignment_name, login_id, worker=worker,
+                                      **grade_arguments)
+    except Exception as e:
+        msg = "%s: grading failed for student [%s]: %s" % (__file__, netid, e)
+        write_to_log(msg)
+        print(msg)
+        returncode = RETURNCODE_FAILED
+
+    if state_store is not None:
+        record_grading_run(state_store, submissions_directory, assignment_name, login_id, returncode)
+
+    return returncode
 
 
 if __name__ == "__main__":
@@ -58,7 +160,9 @@ if __name__ == "__main__":
     (options, args) = parser.parse_args()
 
     autograder_command = options.autograder_command
-    assert isinstance(autograder_command, str), "autograder_command is invalid or not provided: %s" % autograder_command
+    worker_command = options.worker_command
+    assert isinstance(autograder_command, str) or isinstance(worker_command, str), \
+        "autograder_command is invalid or not provided: %s" % autograder_command
 
     submissions_directory = options.submissions_directory
     assert isinstance(submissions_directory, str), "submissions_directory not provided? [%s]" % submissions_directory
@@ -85,37 +189,83 @@ if __name__ == "__main__":
 
     netids = os.listdir(submissions_directory)
 
+    # a group's submission is only graded in the directory it was downloaded to (see download_all_submissions.py -G)
+    group_covered = [netid for netid in netids if is_covered_by_group(submissions_directory, assignment_name, netid)]
+    netids = [netid for netid in netids if netid not in group_covered]
+
     graded = []
+    cached = []
     no_submission_count = 0
     other_list = []
     already_graded = 0
     fail_list = []
     unknown_list = []
-    plist = {}
-    for netid in netids:
-        print("Attempting to grade submissions for: %s" % netid)
-        arguments = ["python", "grade_submission.py",
-                "-d", submissions_directory,
-                "-a", assignment_name,
-                "-l", netid,
-                "-C", autograder_command]
-
-        if make_assignment_directory:
-            arguments.append("-m")
-
-        if force_do_grading:
-            arguments.append("-f")
-
-        p = subprocess.Popen(arguments)
-        plist[netid] = p
-
-    for netid in plist:
-        p = plist[netid]
-        p.wait()
-        return_code = p.returncode
-        
+    fanned_out = []
+    assert options.jobs > 0, "jobs must be positive: %s" % options.jobs
+
+    grading_cache = None
+    if options.grading_cache_directory is not None:
+        grading_cache = GradingCache(options.grading_cache_directory, excluded_files=bookkeeping_files)
+
+    state_store = None
+    if options.state_db is not None:
+        state_store = StateStore(options.state_db)
+
+    if worker_command is not None:
+        # grade in this process, on warm workers that are started once for the whole run
+        jobs = []
+        for netid in netids:
+            jobs.append((netid, functools.partial(grade_with_worker,
+                                                  submissions_directory=submissions_directory,
+                                                  assignment_name=assignment_name,
+                                                  netid=netid,
+                                                  make_assignment_directory=make_assignment_directory,
+                                                  force_do_grading=force_do_grading,
+                                                  sandbox_method=options.sandbox_method,
+                                                  scratch_directory=options.scratch_directory,
+                                                  grading_cache=grading_cache,
+                                                  state_store=state_store)))
+
+        scheduler = AutograderWorkerPool(split_autograder_command(worker_command), options.jobs)
+        try:
+            results = scheduler.run(jobs)
+        finally:
+            scheduler.stop()
+    else:
+        jobs = []
+        for netid in netids:
+            print("Attempting to grade submissions for: %s" % netid)
+            arguments = build_grade_submission_arguments(submissions_directory, assignment_name, netid,
+                                                         autograder_command,
+                                                         make_assignment_directory=make_assignment_directory,
+                                                         force_do_grading=force_do_grading,
+                                                         sandbox_method=options.sandbox_method,
+                                                         scratch_directory=options.scratch_directory,
+                                                         grading_cache_directory=options.grading_cache_directory,
+                                                         state_db=options.state_db)
+            jobs.append((netid, arguments))
+
+        max_load = options.max_load
+        if max_load is None:
+            max_load = float(options.jobs)
+
+        scheduler = JobScheduler(options.jobs, max_load=max_load,
+                                 min_available_memory=options.min_free_memory * 1024 * 1024)
+        results = scheduler.run(jobs)
+
+    for result in results:
+        netid = result["name"]
+        return_code = result["returncode"]
+        write_to_log("%s: graded in %.1f seconds after %.1f seconds in the queue (return code %s)" %
+                     (netid, result["wall_time"], result["queue_time"], return_code))
+
+        if return_code in [RETURNCODE_SUCCESS, RETURNCODE_CACHED]:
+            fanned_out += fan_out_group_results(submissions_directory, assignment_name, netid)
+
         if return_code == RETURNCODE_SUCCESS:
             graded.append(netid)
+        elif return_code == RETURNCODE_CACHED:
+            cached.append(netid)
         elif return_code == RETURNCODE_NO_SUBMISSION:
             no_submission_count += 1
         elif return_code == RETURNCODE_OTHER:
@@ -133,6 +283,21 @@ if __name__ == "__main__":
     write_to_log(msg)
     print(msg)
 
+    msg = "%d submissions graded from the grading cache: %s..." % (len(cached), cached[:7])
+    write_to_log(msg)
+    print(msg)
+
+    if force_do_grading:
+        msg = "%d submissions regraded because of -f" % len(graded)
+        write_to_log(msg)
+        print(msg)
+
+    if len(group_covered) > 0:
+        msg = "%d group members skipped (graded with their group), %d given their group's new results" % \
+              (len(group_covered), len(fanned_out))
+        write_to_log(msg)
+        print(msg)
+
     msg = "%d directories skipped (no submission)" % no_submission_count
     write_to_log(msg)
     print(msg)
@@ -154,6 +319,22 @@ if __name__ == "__main__":
         write_to_log(msg)
         print(msg)
 
+    msg = "job wall time: %s" % format_durations([result["wall_time"] for result in results])
+    write_to_log(msg)
+    print(msg)
+
+    msg = "job queue time: %s" % format_durations([result["queue_time"] for result in results])
+    write_to_log(msg)
+    print(msg)
+
+    msg = "peak concurrency: %d of %d jobs" % (scheduler.peak_concurrency, scheduler.max_jobs)
+    if worker_command is not None:
+        msg += " (on warm autograder workers)"
+    else:
+        msg += " (launches held back %d times for load or memory)" % scheduler.throttled_launches
+    write_to_log(msg)
+    print(msg)
+
     msg = "%d seconds elapsed" % duration
     write_to_log(msg)
     print(msg)
\ No newline at end of file
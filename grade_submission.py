@@ -1,11 +1,19 @@
 from optparse import OptionParser
 import os
+from autograder_worker import AutograderWorker
+from grading_cache import GradingCache
+from history_file import append_to_history
+from autograder_results import read_autograder_summary, read_autograder_output, replace_autograder_summary
+from sandbox import Sandbox, sandbox_methods
+from state_store import StateStore
 from utils import get_assignment_name_and_id, get_netid_and_user_id, write_to_log, convert_Z_to_UTC
 import shutil
 import subprocess
 import json
 import sys
 import datetime
+# datetime.strptime imports _strptime lazily, which isn't thread safe; import it now, before grading runs on threads
+import _strptime
 
 parser = OptionParser(usage="Usage: %prog [options]",
                       description="Grade a single submission.  Not all arguments are required.                "
@@ -46,35 +54,55 @@ parser.add_option("-C", "--autograder-command",
                        "'points_received': <int>, "
                        "'team_login_ids': [login_id_1, login_id_2, ...]}"
                        "It may optionally contain the field 'submitter_login_id': <login_id>")
+parser.add_option("-s", "--sandbox",
+                  dest="sandbox_method", default="auto", type="choice", choices=sandbox_methods,
+                  help="How to make the scratch copy of the submission that is graded: 'reflink' (copy-on-write, on "
+                       "filesystems that support it), 'hardlink' (only safe if the autograder never modifies existing "
+                       "files in place), 'copy', or 'auto' (reflink if possible, otherwise copy).  Default: %default")
+parser.add_option("-t", "--scratch-directory",
+                  dest="scratch_directory", default=None, type=str,
+                  help="Where to make the scratch copy, e.g. a tmpfs such as /dev/shm.  Default: the submissions "
+                       "directory")
+parser.add_option("-W", "--worker-command",
+                  dest="worker_command", default=None, type=str,
+                  help="Instead of running the autograder command, grade with a warm autograder worker started by "
+                       "this command.  See autograder_worker.py for the protocol it must speak.")
+parser.add_option("-K", "--grading-cache",
+                  dest="grading_cache_directory", default=None, type=str,
+                  help="Keep a cache of autograder results in this directory, keyed by the submission's content and "
+                       "the autograder command, and reuse them for identical submissions (e.g. a resubmission of the "
+                       "same archive, or a teammate's copy).  Clear it whenever the autograder changes.")
+parser.add_option("-D", "--state-db",
+                  dest="state_db", default=None, type=str,
+                  help="Also record the grading run in this SQLite database (see state_store.py).")
 
 RETURNCODE_SUCCESS = 0
 RETURNCODE_NO_SUBMISSION = 1
 RETURNCODE_OTHER = 2
 RETURNCODE_ALREADY_GRADED = 3
 RETURNCODE_FAILED = 4
+RETURNCODE_CACHED = 5
+
+submission_summary_file = "submission.json"
+results_file = "autograder_results.txt"
+autograder_history_file = "autograder_history.jsonl"
+
+# files that the download and grading scripts keep in each assignment directory, as opposed to the student's own files
+# (including the .json history files that the .jsonl ones replace)
+bookkeeping_files = [submission_summary_file, results_file, autograder_history_file, "submissions_history.jsonl",
+                     "assignment.json", "group.json", "autograder_history.json", "submissions_history.json"]
 
 
 def update_autograder_history_file(autograder_history_file, autograder_summary):
     '''
-    Add this autograder_summary to the list of summaries in the history file
-    :param autograder_history_file: filename of a json file containing a list of autograder summaries
+    Add this autograder_summary to the end of the history file
+    :param autograder_history_file: filename of a json lines file containing one autograder summary per line
     :param autograder_summary: a dictionary containing this autograder summary
     :return: None
     '''
     assert isinstance(autograder_summary, dict)
 
-    if os.path.isfile(autograder_history_file):
-        with open(autograder_history_file, "r") as f:
-            autograder_history = json.load(f)
-    else:
-        autograder_history = []
-
-    assert isinstance(autograder_history, list)
-
-    autograder_history.append(autograder_summary)
-
-    with open(autograder_history_file, "w") as f:
-        json.dump(autograder_history, f)
+    append_to_history(autograder_history_file, autograder_summary)
 
 
 def get_submitted_at(submission_summary_file):
@@ -99,14 +127,11 @@ def should_do_grading(submission_summary_file, results_file):
     submitted_at = get_submitted_at(submission_summary_file)
 
     # get Canvas time of the file that was graded
-    with open(results_file, "r") as f:
-        # get graded version (if any)
-        lines = f.readlines()
-        try:
-            summary = json.loads(lines[-1])
-        except (ValueError, IndexError) as E:
-            # if we can't read the autograder summary, must do grading
-            return True, None, None
+    try:
+        summary = read_autograder_summary(results_file)
+    except ValueError as E:
+        # if we can't read the autograder summary, must do grading
+        return True, None, None
 
     if "graded_version" not in summary.keys():
         # if there is no info about the graded version, must do grading
@@ -129,64 +154,151 @@ def should_do_grading(submission_summary_file, results_file):
         return True, graded_version, submitted_at
 
 
-if __name__ == "__main__":
-    (options, args) = parser.parse_args()
+def remove_temp_directory(sandbox, temp_directory, login_id):
+    '''
+    Delete the temporary directory (and the sandbox in it, if one was made), and log how long the sandbox took to make
+    and remove
+    :return: None
+    '''
+    if sandbox is not None:
+        sandbox.destroy()
+    shutil.rmtree(temp_directory, ignore_errors=True)
 
-    autograder_command = options.autograder_command
-    assert isinstance(autograder_command, str), "autograder_command is invalid or not provided: %s" % autograder_command
+    if sandbox is not None and sandbox.method is not None:
+        msg = "%s: for student [%s], %s" % (__file__, login_id, sandbox.describe())
+        write_to_log(msg)
 
-    submissions_directory = options.submissions_directory
-    assert isinstance(submissions_directory, str), "submissions_directory not provided? [%s]" % submissions_directory
-    assert os.path.isdir(
-        submissions_directory), "submissions_directory is not a valid directory: %s" % submissions_directory
 
-    assignment_name = options.assignment_name
-    assignment_id = options.assignment_id
-    assert isinstance(assignment_name, str) or isinstance(assignment_id, int), \
-        "A valid assignment_name or assignment_id must be provided.\n" \
-        "assignment_name: [%s]\n" \
-        "assignment_id: [%s]" % (assignment_name, assignment_id)
+def record_grading_run(state_store, submissions_directory, assignment_name, login_id, returncode):
+    '''
+    Record a grading run in the state store, with the autograder summary if the submission was graded
+    :param returncode: what grade_submission returned
+    :return: None
+    '''
+    if returncode in [RETURNCODE_NO_SUBMISSION, RETURNCODE_ALREADY_GRADED]:
+        # nothing was graded
+        return
 
-    user_id = options.user_id
-    login_id = options.login_id
-    assert isinstance(login_id, str) or isinstance(user_id, int), \
-        "A valid login_id or user_id must be provided.\n" \
-        "login_id: [%s]\n" \
-        "user_id: [%s]" % (login_id, user_id)
+    autograder_summary = None
+    if returncode in [RETURNCODE_SUCCESS, RETURNCODE_CACHED]:
+        autograder_summary = read_autograder_summary(
+            os.path.join(submissions_directory, login_id, assignment_name, results_file))
 
-    roster_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                       "resources",
-                                       "roster.csv")
-    assert os.path.isfile(roster_file), "roster_file is not a valid file: %s" % roster_file
+    state_store.record_grading_run(login_id, assignment_name, returncode, autograder_summary)
 
-    assignment_list = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                       "resources",
-                                       "assignments.csv")
-    assert os.path.isfile(assignment_list), "assignment_list is not a valid file: %s" % assignment_list
 
-    course_id = options.course_id  # this arg is optional
+def split_autograder_command(autograder_command):
+    '''
+    Split an autograder command into a list of arguments, changing a leading '~' in any of them to $HOME
+    '''
+    args = autograder_command.split(" ")
+
+    # change '~' to $HOME
+    HOME = os.environ["HOME"]
+    for i in range(0, len(args)):
+        if args[i].startswith('~'):
+            args[i] = args[i].replace('~', HOME, 1)
+
+    return args
 
-    assignment_name, assignment_id = get_assignment_name_and_id(assignment_name, assignment_id, assignment_list,
-                                                                course_id)
 
+def get_student_ids(login_id, user_id, roster_file):
+    '''
+    Look the student up in the roster
+    :return: (login_id, user_id), or (None, None) if the student isn't in the roster
+    '''
     try:
-        login_id, user_id = get_netid_and_user_id(login_id, user_id, roster_file)
+        return get_netid_and_user_id(login_id, user_id, roster_file)
     except:
         msg = "%s: unable to find student in roster.  netid [%s] user_id [%s].  Dropped class?.  Exiting." % \
               (__file__, str(login_id), str(user_id))
         print(msg)
         write_to_log(msg)
-        sys.exit(RETURNCODE_OTHER)
+        return None, None
 
-    assignment_directory = os.path.join(submissions_directory, login_id, assignment_name)
 
-    make_assignment_directory = options.make_assignment_directory
-    assert isinstance(make_assignment_directory,
-                      bool), "-m flag did not give valid bool: %s" % make_assignment_directory
+def clean_login_ids(autograder_summary):
+    '''
+    Remove the "_tmp" that grading in the scratch directory adds to the login_ids in an autograder summary
+    :param autograder_summary: the autograder's summary, which is updated
+    :return: None
+    '''
+    if "submitter_login_id" in autograder_summary.keys():
+        submitter_login_id = str(autograder_summary["submitter_login_id"])
+        if submitter_login_id.endswith("_tmp"):
+            submitter_login_id = submitter_login_id[:-4]
+        autograder_summary["submitter_login_id"] = submitter_login_id
 
-    force_do_grading = options.force_do_grading
-    assert isinstance(force_do_grading,
-                      bool), "-f flag did not give valid bool: %s" % force_do_grading
+    clean_netids = []
+    for netid in autograder_summary["team_login_ids"]:
+        if netid.endswith("_tmp"):
+            netid = netid[:-4]
+        clean_netids.append(netid)
+
+    autograder_summary["team_login_ids"] = clean_netids
+
+
+def record_results(output, autograder_summary, login_id, assignment_directory):
+    '''
+    Finish the autograder summary and record it (with the rest of the autograder's output) in the student's assignment
+    directory: as the last line of autograder_results.txt, and in autograder_history.jsonl
+    :param output: the lines the autograder printed before its summary, or None if they are already in
+                   autograder_results.txt (followed by the autograder's summary, which is replaced)
+    :param autograder_summary: the autograder's summary
+    :param login_id: the student's login_id (netid)
+    :param assignment_directory: the student's assignment directory
+    :return: the finished summary
+    '''
+    clean_login_ids(autograder_summary)
+    if "submitter_login_id" not in autograder_summary.keys():
+        # use the command line option login_id as the submitter
+        autograder_summary["submitter_login_id"] = login_id
+
+    # record which submission was graded
+    submitted_at = get_submitted_at(os.path.join(assignment_directory, submission_summary_file))
+    autograder_summary["graded_version"] = submitted_at
+
+    results_path = os.path.join(assignment_directory, results_file)
+    if output is None:
+        replace_autograder_summary(results_path, autograder_summary)
+    else:
+        lines = list(output)
+        lines.append(json.dumps(autograder_summary))
+        with open(results_path, "w") as f:
+            f.writelines(lines)
+
+    # print summary
+    print("Summary:")
+    print(json.dumps(autograder_summary))
+
+    # update autograder_history file
+    update_autograder_history_file(os.path.join(assignment_directory, autograder_history_file), autograder_summary)
+
+    return autograder_summary
+
+
+def grade_submission(submissions_directory, assignment_name, login_id, autograder_command=None, worker=None,
+                     make_assignment_directory=False, force_do_grading=False, sandbox_method="auto",
+                     scratch_directory=None, grading_cache=None):
+    '''
+    Grade a student's submission in a sandbox, and record the results in the student's assignment directory
+    :param submissions_directory: the path to the submissions directory
+    :param assignment_name: the name of the assignment
+    :param login_id: the student's login_id (netid)
+    :param autograder_command: the command that grades a submission (run from within the sandbox)
+    :param worker: an AutograderWorker to grade the submission with, instead of running autograder_command
+    :param make_assignment_directory: create the assignment directory if it doesn't exist?
+    :param force_do_grading: grade even if the submission appears to already have been graded?
+    :param sandbox_method: how to make the sandbox (see sandbox.Sandbox)
+    :param scratch_directory: where to make the sandbox (defaults to submissions_directory)
+    :param grading_cache: a GradingCache.  If the same content was already graded with the same command, its results
+                          are reused instead of grading again (unless force_do_grading).
+    :return: one of the RETURNCODE_* constants, or the autograder command's exit code if it failed
+    '''
+    assert autograder_command is not None or worker is not None, "autograder_command or worker must be provided"
+
+    submissions_directory = os.path.abspath(submissions_directory)
+    assignment_directory = os.path.join(submissions_directory, login_id, assignment_name)
 
     if not os.path.isdir(assignment_directory):
         msg = "%s: Directory does not exist: %s" % (__file__, assignment_directory)
@@ -196,117 +308,205 @@ if __name__ == "__main__":
                    "with the '-m true' option."
             print(msg)
             write_to_log(msg)
-            sys.exit(RETURNCODE_NO_SUBMISSION)
+            return RETURNCODE_NO_SUBMISSION
         else:
             msg += ". Creating directory."
             print(msg)
             write_to_log(msg)
             os.mkdir(assignment_directory, 0755)
 
-    # make a temporary directory in the submissions directory (to be safe, make it the same depth as actual assignment
+    # check if this submission has already been graded
+    do_grading, graded_version, submitted_at = should_do_grading(
+        os.path.join(assignment_directory, submission_summary_file), os.path.join(assignment_directory, results_file))
+
+    if not (do_grading or force_do_grading):
+        msg = "%s: for student [%s], this submission [%s] was previously graded at [%s].  Exiting." % (
+            __file__, login_id, submitted_at, graded_version)
+        write_to_log(msg)
+        print(msg)
+        return RETURNCODE_ALREADY_GRADED
+
+    # check if the same content was already graded (e.g. an identical resubmission, or a teammate's copy)
+    cache_key = None
+    if grading_cache is not None:
+        if worker is not None:
+            cache_key = grading_cache.get_key(assignment_directory, " ".join(worker.command))
+        else:
+            cache_key = grading_cache.get_key(assignment_directory, autograder_command)
+
+        entry = grading_cache.get(cache_key)
+        if entry is not None and not force_do_grading:
+            autograder_summary = entry["summary"]
+
+            # these results are for this student's submission now (entries stored by older versions may still have
+            # the scratch directory's "_tmp" names)
+            clean_login_ids(autograder_summary)
+            autograder_summary["submitter_login_id"] = login_id
+            if login_id not in autograder_summary["team_login_ids"]:
+                autograder_summary["team_login_ids"] = [login_id]
+
+            record_results(entry["output"], autograder_summary, login_id, assignment_directory)
+
+            msg = "%s: for student [%s], reused cached results [%s]" % (__file__, login_id, cache_key)
+            write_to_log(msg)
+            print(msg)
+            return RETURNCODE_CACHED
+
+    # make a temporary directory in the scratch directory (to be safe, make it the same depth as actual assignment
     # subdirectory
-    temp_directory = os.path.join(submissions_directory, login_id + "_tmp")
+    if scratch_directory is None:
+        scratch_directory = submissions_directory
+    assert os.path.isdir(scratch_directory), "scratch_directory is not a valid directory: %s" % scratch_directory
+
+    temp_directory = os.path.join(os.path.abspath(scratch_directory), login_id + "_tmp")
     if os.path.isdir(temp_directory):
         msg = "%s: Directory [%s] already exists.  Exiting with code [%d]" % (
         __file__, temp_directory, RETURNCODE_FAILED)
+        print(msg)
+        write_to_log(msg)
+        return RETURNCODE_FAILED
     os.mkdir(temp_directory, 0755)
 
-    # copy the student's submission to the temporary directory
-    destination_directory = os.path.join(temp_directory, assignment_name)
-    shutil.copytree(src=assignment_directory, dst=destination_directory)
+    # whatever happens, delete the temporary directory, so that it doesn't stop this student being graded next time
+    sandbox = None
+    try:
+        # copy the student's submission to the temporary directory
+        destination_directory = os.path.join(temp_directory, assignment_name)
+        # grading writes to the bookkeeping files, so they can't be hard links
+        sandbox = Sandbox(assignment_directory, destination_directory, method=sandbox_method,
+                          mutable_files=bookkeeping_files)
+        sandbox.create()
+
+        results_path = os.path.join(destination_directory, results_file)
+
+        if worker is not None:
+            # hand the submission to the warm worker, and save its output as autograder_results.txt
+            succeeded, output = worker.grade(destination_directory, force=force_do_grading)
+            with open(results_path, "w") as f:
+                f.writelines(output)
+
+            if not succeeded:
+                msg = "%s: autograder worker failed for student [%s]: %s" % (__file__, login_id, output[-1].strip())
+                write_to_log(msg)
+                print(msg)
+                shutil.copy2(results_path, assignment_directory)
+                return RETURNCODE_FAILED
+        else:
+            # run the autograder command from within the sandbox, piping output to autograder_results.txt
+            with open(results_path, "w") as f:
+                args = split_autograder_command(autograder_command)
 
-    # change directory into the temporary directory
-    os.chdir(destination_directory)
+                if force_do_grading and "-f" not in args:
+                    args.append("-f")
 
-    # check if this submission has already been graded
-    submission_summary_file = "submission.json"
-    results_file = "autograder_results.txt"
-    do_grading, graded_version, submitted_at = should_do_grading(submission_summary_file, results_file)
+                returncode = subprocess.call(args, stdout=f, stderr=subprocess.STDOUT, cwd=destination_directory)
 
-    if do_grading or force_do_grading:
-        # run the autograder command, piping output to autograder_results.txt
-        with open(results_file, "w") as f:
-            args = autograder_command.split(" ")
+            if returncode != 0:
+                msg = "%s: command failed [%s] with exit code [%d] for student [%s].  Exiting." % (
+                    __file__, " ".join(args), returncode, login_id)
+                write_to_log(msg)
+                print(msg)
+                shutil.copy2(results_path, assignment_directory)
+                return returncode
 
-            # change '~' to $HOME
-            HOME = os.environ["HOME"]
-            for i in range(0, len(args)):
-                if args[i].startswith('~'):
-                    args[i] = args[i].replace('~', HOME, 1)
+        # process autograder json summary
+        try:
+            autograder_summary = read_autograder_summary(results_path)
+        except ValueError as E:
+            msg = "%s: for student [%s], error [%s]" % (__file__, login_id, E)
+            write_to_log(msg)
+            print(msg)
+            shutil.copy2(results_path, assignment_directory)
+            return RETURNCODE_OTHER
 
-            if force_do_grading and "-f" not in args:
-                args.append("-f")
+        if cache_key is not None:
+            # cache the team's real login_ids, so that a hit can tell whether its student is on the team
+            clean_login_ids(autograder_summary)
+            grading_cache.store(cache_key, read_autograder_output(results_path), dict(autograder_summary))
 
-            returncode = subprocess.call(args, stdout=f, stderr=subprocess.STDOUT)
+        # record the results in the student's assignment subdirectory, moving the output rather than rewriting it
+        shutil.move(results_path, os.path.join(assignment_directory, results_file))
+        record_results(None, autograder_summary, login_id, assignment_directory)
+        return RETURNCODE_SUCCESS
+    finally:
+        remove_temp_directory(sandbox, temp_directory, login_id)
 
-        if returncode != 0:
-            msg = "%s: command failed [%s] with exit code [%d] for student [%s].  Exiting." % (
-                __file__, " ".join(args), returncode, login_id)
-            write_to_log(msg)
-            print(msg)
-            shutil.copy2(results_file, assignment_directory)
-            shutil.rmtree(temp_directory, ignore_errors=True)
-            sys.exit(returncode)
 
-    else:
-        msg = "%s: for student [%s], this submission [%s] was previously graded at [%s].  Exiting." % (
-            __file__, login_id, submitted_at, graded_version)
-        write_to_log(msg)
-        print(msg)
-        shutil.rmtree(temp_directory)
-        sys.exit(RETURNCODE_ALREADY_GRADED)
+if __name__ == "__main__":
+    (options, args) = parser.parse_args()
 
-    # process autograder json summary
-    lines = open(results_file, "r").readlines()
-    try:
-        autograder_summary = json.loads(lines[-1])
-    except ValueError as E:
-        msg = "%s: for student [%s], error [%s]" % (__file__, login_id, E)
-        write_to_log(msg)
-        print(msg)
-        shutil.copy2(results_file, assignment_directory)
-        shutil.rmtree(temp_directory)
-        sys.exit(RETURNCODE_OTHER)
+    autograder_command = options.autograder_command
+    worker_command = options.worker_command
+    assert isinstance(autograder_command, str) or isinstance(worker_command, str), \
+        "autograder_command is invalid or not provided: %s" % autograder_command
 
-    if "submitter_login_id" in autograder_summary.keys():
-        # if submitter_login_id is already there, make sure it doesn't end in "_tmp"
-        submitter_login_id = str(autograder_summary["submitter_login_id"])
-        if submitter_login_id.endswith("_tmp"):
-            submitter_login_id = submitter_login_id[:-4]
-            autograder_summary["submitter_login_id"] = submitter_login_id
-    else:
-        # otherwise, use the command line option login_id as the submitter
-        autograder_summary["submitter_login_id"] = login_id
+    submissions_directory = options.submissions_directory
+    assert isinstance(submissions_directory, str), "submissions_directory not provided? [%s]" % submissions_directory
+    assert os.path.isdir(
+        submissions_directory), "submissions_directory is not a valid directory: %s" % submissions_directory
 
-    # record which submission was graded
-    submitted_at = get_submitted_at(submission_summary_file)
-    autograder_summary["graded_version"] = submitted_at
+    assignment_name = options.assignment_name
+    assignment_id = options.assignment_id
+    assert isinstance(assignment_name, str) or isinstance(assignment_id, int), \
+        "A valid assignment_name or assignment_id must be provided.\n" \
+        "assignment_name: [%s]\n" \
+        "assignment_id: [%s]" % (assignment_name, assignment_id)
 
-    clean_netids = []
-    dirty_netids = autograder_summary["team_login_ids"]
-    for netid in dirty_netids:
-        if netid.endswith("_tmp"):
-            netid = netid[:-4]
-        clean_netids.append(netid)
+    user_id = options.user_id
+    login_id = options.login_id
+    assert isinstance(login_id, str) or isinstance(user_id, int), \
+        "A valid login_id or user_id must be provided.\n" \
+        "login_id: [%s]\n" \
+        "user_id: [%s]" % (login_id, user_id)
 
-    autograder_summary["team_login_ids"] = clean_netids
+    roster_file = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                       "resources",
+                                       "roster.csv")
+    assert os.path.isfile(roster_file), "roster_file is not a valid file: %s" % roster_file
 
-    lines[-1] = json.dumps(autograder_summary)
-    open(results_file, "w").writelines(lines)
+    assignment_list = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                       "resources",
+                                       "assignments.csv")
+    assert os.path.isfile(assignment_list), "assignment_list is not a valid file: %s" % assignment_list
 
-    # print summary
-    print("Summary:")
-    print(lines[-1])
+    course_id = options.course_id  # this arg is optional
 
-    # copy autograder_results.txt to the student's assignment subdirectory
-    shutil.copy2(results_file, assignment_directory)
-    shutil.copy2(submission_summary_file, assignment_directory)
+    assignment_name, assignment_id = get_assignment_name_and_id(assignment_name, assignment_id, assignment_list,
+                                                                course_id)
 
-    # update autograder_history file and copy to student's subdirectory
-    autograder_history_file = "autograder_history.json"
-    update_autograder_history_file(autograder_history_file, autograder_summary)
-    shutil.copy2(autograder_history_file, assignment_directory)
+    login_id, user_id = get_student_ids(login_id, user_id, roster_file)
+    if login_id is None:
+        sys.exit(RETURNCODE_OTHER)
 
-    # delete the temporary directory and exit
-    shutil.rmtree(temp_directory)
-    sys.exit(RETURNCODE_SUCCESS)
+    make_assignment_directory = options.make_assignment_directory
+    assert isinstance(make_assignment_directory,
+                      bool), "-m flag did not give valid bool: %s" % make_assignment_directory
+
+    force_do_grading = options.force_do_grading
+    assert isinstance(force_do_grading,
+                      bool), "-f flag did not give valid bool: %s" % force_do_grading
+
+    # a worker started just for this one submission saves nothing, but it is handy for testing a worker
+    worker = None
+    if worker_command is not None:
+        worker = AutograderWorker(split_autograder_command(worker_command))
+
+    grading_cache = None
+    if options.grading_cache_directory is not None:
+        grading_cache = GradingCache(options.grading_cache_directory, excluded_files=bookkeeping_files)
+
+    try:
+        returncode = grade_submission(submissions_directory, assignment_name, login_id,
+                                      autograder_command=autograder_command, worker=worker,
+                                      make_assignment_directory=make_assignment_directory,
+                                      force_do_grading=force_do_grading, sandbox_method=options.sandbox_method,
+                                      scratch_directory=options.scratch_directory, grading_cache=grading_cache)
+    finally:
+        if worker is not None:
+            worker.stop()
+
+    if options.state_db is not None:
+        record_grading_run(StateStore(options.state_db), submissions_directory, assignment_name, login_id,
+                           returncode)
+
+    sys.exit(returncode)
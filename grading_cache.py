@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+class GradingCache(object):
+    """An on-disk cache of autograder results, keyed by what was graded rather than when it was submitted.
+
+    The key is a hash of the autograder command and of every file in the submission (names and contents), except the
+    bookkeeping files that differ between students or submissions of the same content (e.g. submission.json).  So a
+    byte-identical resubmission, or a teammate's copy of the same archive, is a hit.  Each entry is stored as
+    <key>.out, holding the autograder's output exactly as it was printed (which need not be valid UTF-8), and
+    <key>.json, holding its summary.
+
+    The cache can't tell when the autograder itself changes, so clear it (or use a new directory) when it does."""
+
+    def __init__(self, directory, excluded_files=[]):
+        '''
+        :param directory: where to keep the cache.  Created if it doesn't exist.
+        :param excluded_files: paths (relative to the submission directory) of files to leave out of the key
+        '''
+        self.directory = directory
+        self.excluded_files = [os.path.normpath(path) for path in excluded_files]
+
+        if not os.path.isdir(directory):
+            os.mkdir(directory, 0700)
+        return
+
+    def get_key(self, submission_directory, autograder_command):
+        '''
+        :param submission_directory: the directory of the submission to be graded
+        :param autograder_command: the command (or worker command) that grades it
+        :return: the cache key for grading this submission with this command
+        '''
+        assert os.path.isdir(submission_directory), "not a directory: %s" % submission_directory
+
+        key = hashlib.sha1()
+        key.update("command\0%s\0" % autograder_command)
+
+        paths = []
+        for directory, subdirectories, filenames in os.walk(submission_directory):
+            for filename in filenames:
+                path = os.path.relpath(os.path.join(directory, filename), submission_directory)
+                if os.path.normpath(path) not in self.excluded_files:
+                    paths.append(path)
+
+        for path in sorted(paths):
+            full_path = os.path.join(submission_directory, path)
+            key.update("file\0%s\0" % path)
+            if os.path.islink(full_path):
+                key.update("link\0%s\0" % os.readlink(full_path))
+                continue
+
+            key.update("%d\0" % os.path.getsize(full_path))
+            with open(full_path, "rb") as f:
+                for chunk in iter(lambda: f.read(64 * 1024), ""):
+                    key.update(chunk)
+
+        return key.hexdigest()
+
+    def get(self, key):
+        '''
+        :return: the cached entry (a dictionary with "output", a list of lines as byte strings, and "summary"), or None
+        '''
+        try:
+            with open(os.path.join(self.directory, key + ".json"), "r") as f:
+                entry = json.load(f)
+
+            with open(os.path.join(self.directory, key + ".out"), "rb") as f:
+                entry["output"] = f.read().splitlines(True)
+        except (IOError, ValueError):
+            return None
+
+        return entry
+
+    def store(self, key, output, summary):
+        '''
+        :param key: see get_key
+        :param output: the lines the autograder printed, not including its summary
+        :param summary: the autograder's summary
+        :return: None
+        '''
+        # write the output first, so the summary never points at output that isn't there yet
+        self._write_atomically(key + ".out", "".join(output))
+        self._write_atomically(key + ".json", json.dumps({"summary": summary, "stored_at": time.time()}))
+
+    def _write_atomically(self, filename, content):
+        fd, temp_path = tempfile.mkstemp(prefix="." + filename + ".", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.rename(temp_path, os.path.join(self.directory, filename))
+        except:
+            os.remove(temp_path)
+            raise
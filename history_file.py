@@ -0,0 +1,198 @@
+from optparse import OptionParser
+import fcntl
+import json
+import os
+import tempfile
+
+
+parser = OptionParser(usage="Usage: %prog [options]",
+                      description="Convert every *_history.json file (a JSON list) in the submissions directory to a "
+                                  "*_history.jsonl file (one JSON record per line).  The scripts convert a history "
+                                  "file the first time they add to it anyway; this does them all at once.  "
+                                  "For example, try:                                                             "
+                                  "python " + __file__ + " -d <submissions-directory>")
+parser.add_option("-d", "--submissions-directory",
+                  dest="submissions_directory", default=None, type=str,
+                  help="The path to the submissions directory.")
+
+read_block_size = 4096
+
+
+def get_legacy_path(path):
+    '''
+    :param path: path of a .jsonl history file
+    :return: the path of the .json history file it replaces
+    '''
+    return os.path.splitext(path)[0] + ".json"
+
+
+def append_to_history(path, record):
+    '''
+    Add a record to the end of a history file: one line of JSON, written with a single write and flushed to disk
+    before returning.  Appending costs the same however long the history is, and a crash can at worst leave a partial
+    last line, which the readers skip.
+    :param path: path of the .jsonl history file
+    :param record: a dictionary
+    :return: None
+    '''
+    line = json.dumps(record) + "\n"
+
+    fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+        # the first append converts any old-style history, while holding the lock
+        if os.fstat(fd).st_size == 0:
+            legacy_records = read_legacy_history(get_legacy_path(path))
+            if legacy_records:
+                line = "".join(json.dumps(legacy_record) + "\n" for legacy_record in legacy_records) + line
+        else:
+            # if an earlier append was cut short, start a new line rather than extend the partial one
+            os.lseek(fd, -1, os.SEEK_END)
+            if os.read(fd, 1) != "\n":
+                line = "\n" + line
+
+        os.write(fd, line)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    legacy_path = get_legacy_path(path)
+    if os.path.isfile(legacy_path):
+        os.remove(legacy_path)
+
+
+def read_legacy_history(legacy_path):
+    '''
+    :param legacy_path: path of a .json history file (a JSON list of records)
+    :return: the list of records, or [] if there is no such file
+    '''
+    if not os.path.isfile(legacy_path):
+        return []
+
+    with open(legacy_path, "r") as f:
+        records = json.load(f)
+
+    assert isinstance(records, list), "history is not a list: %s" % legacy_path
+    return records
+
+
+def iterate_history(path):
+    '''
+    Stream the records of a history file, oldest first, without reading the whole file into memory
+    :param path: path of the .jsonl history file.  If it doesn't exist yet, the old-style .json history is read.
+    :return: iterator over the records
+    '''
+    if not os.path.isfile(path):
+        for record in read_legacy_history(get_legacy_path(path)):
+            yield record
+        return
+
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # a partial line from an interrupted append
+                continue
+
+
+def read_last_line(f, end=None):
+    '''
+    Read the last non-blank line of a file by reading backwards from its end, so the cost doesn't depend on the file's
+    size
+    :param f: a file opened in binary mode
+    :param end: treat the file as ending at this offset (defaults to its actual end)
+    :return: (offset of the start of the line, the line), or (None, None) if there is no non-blank line
+    '''
+    if end is None:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+
+    position = end
+    tail = ""
+    while position > 0:
+        read_size = min(read_block_size, position)
+        position -= read_size
+        f.seek(position)
+        tail = f.read(read_size) + tail
+
+        content = tail.rstrip()
+        if "\n" in content:
+            start = content.rindex("\n") + 1
+            return position + start, tail[start:]
+
+    if not tail.strip():
+        return None, None
+    return 0, tail
+
+
+def read_latest_from_history(path):
+    '''
+    Jump to the most recent record of a history file without reading the rest of it
+    :param path: path of the .jsonl history file.  If it doesn't exist yet, the old-style .json history is read.
+    :return: the record, or None if the history is empty
+    '''
+    if not os.path.isfile(path):
+        records = read_legacy_history(get_legacy_path(path))
+        return records[-1] if records else None
+
+    with open(path, "rb") as f:
+        end = None
+        while True:
+            offset, line = read_last_line(f, end)
+            if line is None:
+                return None
+            try:
+                return json.loads(line)
+            except ValueError:
+                # a partial line from an interrupted append, so look at the line before it
+                end = offset
+
+
+def migrate_json_history(legacy_path):
+    '''
+    Convert an old-style .json history file to a .jsonl history file (unless that already exists), atomically
+    :param legacy_path: path of the .json history file
+    :return: the path of the .jsonl history file
+    '''
+    path = os.path.splitext(legacy_path)[0] + ".jsonl"
+    if os.path.isfile(path):
+        return path
+
+    records = read_legacy_history(legacy_path)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+    os.remove(legacy_path)
+    return path
+
+
+if __name__ == "__main__":
+    (options, args) = parser.parse_args()
+
+    submissions_directory = options.submissions_directory
+    assert isinstance(submissions_directory, str), "submissions_directory not provided? [%s]" % submissions_directory
+    assert os.path.isdir(
+        submissions_directory), "submissions_directory is not a valid directory: %s" % submissions_directory
+
+    count = 0
+    for directory, subdirectories, filenames in os.walk(submissions_directory):
+        for filename in filenames:
+            if filename.endswith("_history.json"):
+                migrate_json_history(os.path.join(directory, filename))
+                count += 1
+
+    print("%d history files converted" % count)
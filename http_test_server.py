@@ -0,0 +1,25 @@
+from unittest import TestCase
+import BaseHTTPServer
+import SocketServer
+import threading
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class HTTPServerTestCase(TestCase):
+    """Serves handler_class (a BaseHTTPRequestHandler) on a local port for the length of each test, at self.base_url.
+    Subclasses that override setUp or tearDown call these too."""
+    handler_class = None
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = "http://127.0.0.1:%d" % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,106 @@
+import os
+import subprocess
+import time
+
+
+def get_load_average():
+    '''
+    :return: the 1 minute load average, or None if it isn't available on this system
+    '''
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+def get_available_memory(meminfo_path="/proc/meminfo"):
+    '''
+    :return: the memory available for new processes (MemAvailable), in bytes, or None if it isn't available on this
+             system
+    '''
+    try:
+        with open(meminfo_path, "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError, IndexError):
+        pass
+    return None
+
+
+class JobScheduler(object):
+    """Run a queue of commands as subprocesses, at most max_jobs at a time.
+
+    A new job is only launched while the machine has room for it: the 1 minute load average is below max_load and
+    at least min_available_memory bytes are available.  When it doesn't, launches wait (but one job is always allowed
+    to run, so the queue can't stall).  Each job's queue time (from the start of the run until it was launched) and
+    wall time (from launch until it exited) are recorded, along with the peak number of jobs running at once."""
+
+    def __init__(self, max_jobs, max_load=None, min_available_memory=None, poll_interval=0.1):
+        assert isinstance(max_jobs, int) and max_jobs > 0, "max_jobs is not a positive int: %s" % max_jobs
+
+        self.max_jobs = max_jobs
+        self.max_load = max_load
+        self.min_available_memory = min_available_memory
+        self.poll_interval = poll_interval
+        self.peak_concurrency = 0
+        self.throttled_launches = 0
+        return
+
+    def is_overloaded(self):
+        '''
+        :return: True if the machine is too busy to launch another job
+        '''
+        if self.max_load is not None:
+            load = get_load_average()
+            if load is not None and load >= self.max_load:
+                return True
+
+        if self.min_available_memory is not None:
+            available_memory = get_available_memory()
+            if available_memory is not None and available_memory < self.min_available_memory:
+                return True
+
+        return False
+
+    def run(self, jobs):
+        '''
+        Run every job and wait for them all to finish
+        :param jobs: list of (name, arguments) tuples, where arguments is a command for subprocess.Popen
+        :return: list of dictionaries with each job's "name", "returncode", "queue_time" and "wall_time" (in seconds),
+                 in the order the jobs finished
+        '''
+        start = time.time()
+        queue = list(jobs)
+        queue.reverse()
+        running = {}
+        results = []
+        was_overloaded = False
+
+        while queue or running:
+            # launch as many jobs as there is room for
+            while queue and len(running) < self.max_jobs:
+                if running and self.is_overloaded():
+                    if not was_overloaded:
+                        self.throttled_launches += 1
+                    was_overloaded = True
+                    break
+                was_overloaded = False
+
+                name, arguments = queue.pop()
+                launched_at = time.time()
+                running[name] = (subprocess.Popen(arguments), launched_at)
+                self.peak_concurrency = max(self.peak_concurrency, len(running))
+
+            time.sleep(self.poll_interval)
+
+            for name in list(running):
+                p, launched_at = running[name]
+                if p.poll() is not None:
+                    del running[name]
+                    results.append({"name": name,
+                                    "returncode": p.returncode,
+                                    "queue_time": launched_at - start,
+                                    "wall_time": time.time() - launched_at})
+
+        return results
@@ -1,13 +1,19 @@
 from optparse import OptionParser
 import os
-import json
-from utils import get_assignment_name_and_id, write_to_log, write_header_row
-import subprocess
+from utils import get_assignment_name_and_id, write_to_log, write_header_row, \
+                  get_run_session_stats, format_session_stats, get_token, get_user_id_from_netid, build_canvas_url
+from canvas_client import CanvasClient
+from state_store import StateStore
+from autograder_results import read_autograder_summary, replace_autograder_summary
+from upload_result_comment import upload_result_comment
+from canvas_groups import is_covered_by_group, read_group_file
+import collections
 import csv
 import copy
-import sys
+import threading
 import time
 import datetime
+import urllib2
 
 
 parser = OptionParser(usage="Usage: %prog [options]",
@@ -37,9 +43,27 @@ parser.add_option("-U",
                   dest="upload_results", default=False, action="store_true",
                   help="If this flag is present, script uploads comment attachment to Canvas containing "
                        "autograder_results.  Also uploads score.")
+parser.add_option("-B",
+                  dest="bulk_upload", default=False, action="store_true",
+                  help="If this flag is present, script uploads all new grades to Canvas in one bulk request (implies "
+                       "-U).  The autograder_results files are not attached.")
+parser.add_option("-T", "--bulk-comment",
+                  dest="bulk_comment", default=None, type=str,
+                  help="With -B, a text comment to add to each submission.  It may refer to fields of the autograder "
+                       "summary, e.g. 'Autograder score: %(points_received)s/%(points_possible)s'")
 parser.add_option("-c", "--course-id",
                   dest="course_id", default=None, type=int,
                   help="The Canvas course_id.  e.g. 43589.  Only required when uploading results.")
+parser.add_option("-j", "--jobs",
+                  dest="jobs", default=8, type=int,
+                  help="With -U, the number of uploads to run at the same time.  Default: %default")
+parser.add_option("-D", "--state-db",
+                  dest="state_db", default=None, type=str,
+                  help="Also record the uploads in this SQLite database (see state_store.py).")
+
+resources_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), "resources")
+roster_file = os.path.join(resources_directory, "roster.csv")
+token_json_file = os.path.join(resources_directory, "token.json")
 
 RETURNCODE_SUCCESS = 0
 RETURNCODE_ALREADY_UPLOADED = 1
@@ -48,34 +72,169 @@ RETURNCODE_FAILED = 4
 
 netid_to_upload_time = {}
 
+# teammates share a results file, so their uploads and bookkeeping take turns with it
+results_file_locks = {}
+results_file_locks_lock = threading.Lock()
+
+
+def get_results_file_lock(autograder_results):
+    '''
+    :param autograder_results: path to file containing autograder results
+    :return: the threading.Lock for that file
+    '''
+    path = os.path.realpath(autograder_results)
+
+    with results_file_locks_lock:
+        if path not in results_file_locks:
+            results_file_locks[path] = threading.Lock()
+        return results_file_locks[path]
+
+
+def is_group_assignment(client, course_id, assignment_id):
+    '''
+    Check whether an assignment is a group assignment whose grades go to the whole group, so that one group comment
+    (with the grade) on any member's submission reaches all of them
+    :param client: CanvasClient
+    :param course_id: Canvas course_id
+    :param assignment_id: Canvas assignment_id
+    :return: boolean
+    '''
+    assignment = client.get(build_canvas_url(["courses", course_id, "assignments", assignment_id]))
+    return assignment.get("group_category_id") is not None and \
+           not assignment.get("grade_group_students_individually", False)
+
+
+def is_canvas_group(team_uploads):
+    '''
+    Check whether a team is exactly one of the assignment's Canvas groups, as recorded in group.json by
+    download_all_submissions.py -G.  The team in the autograder summary comes from the submission itself, so it
+    can't be trusted to match the group that a group comment would reach.
+    :param team_uploads: list of (student, user_id, autograder_summary, autograder_results) tuples that share a
+                         results file
+    :return: boolean
+    '''
+    group_summary = read_group_file(os.path.dirname(os.path.realpath(team_uploads[0][3])))
+    if group_summary is None:
+        return False
+
+    return sorted(str(login_id) for login_id in group_summary["login_ids"]) == \
+           sorted(pending_upload[0] for pending_upload in team_uploads)
+
+
+def upload_team_results(client, course_id, assignment_id, team_uploads, group_comment=False):
+    '''
+    Upload a team's results file once, then attach it to a comment on each teammate's submission, along with their
+    grade.  With group_comment, a single group comment on the first teammate's submission covers the whole team.
+    Runs as a task on the client's pool, so the steps of many teams' uploads overlap.
+    :param client: CanvasClient
+    :param course_id: Canvas course_id
+    :param assignment_id: Canvas assignment_id
+    :param team_uploads: list of (student, user_id, autograder_summary, autograder_results) tuples that share a
+                         results file
+    :param group_comment: post one group comment instead of a comment per teammate?
+    :return: list of (pending_upload, True if the upload succeeded), one for each of team_uploads
+    '''
+    file_id = None
+    results = []
+    for pending_upload in (team_uploads[:1] if group_comment else team_uploads):
+        student, user_id, autograder_summary, autograder_results = pending_upload
+
+        try:
+            file_id, submission = upload_result_comment(client, course_id, assignment_id, user_id, student,
+                                                        autograder_results, autograder_summary["percent_as_string"],
+                                                        get_results_file_lock(autograder_results), file_id,
+                                                        group_comment)
+        except Exception as E:
+            msg = "%s: upload for netid [%s] failed [%s]" % (__file__, student, E)
+            write_to_log(msg)
+            print(msg)
+            results.append((pending_upload, False))
+        else:
+            results.append((pending_upload, True))
+
+    if group_comment:
+        # the group comment and grade went to every teammate, or to none of them
+        succeeded = results[0][1]
+        results = [(pending_upload, succeeded) for pending_upload in team_uploads]
+
+    return results
+
+
+def bulk_upload_grades(client, course_id, assignment_id, pending_uploads, bulk_comment=None):
+    '''
+    Post all the pending grades with a single update_grades request and wait for Canvas to finish the job
+    :param client: CanvasClient
+    :param course_id: Canvas course_id
+    :param assignment_id: Canvas assignment_id
+    :param pending_uploads: list of (student, user_id, autograder_summary, autograder_results) tuples
+    :param bulk_comment: optional comment text, formatted with each student's autograder summary
+    :return: (the last Progress object seen for the job, or None if nothing was sent; the pending uploads that were
+             sent; the pending uploads left out because the comment couldn't be formatted with their summary)
+    '''
+    grade_data = {}
+    sent_uploads = []
+    left_out_uploads = []
+    for pending_upload in pending_uploads:
+        student, user_id, autograder_summary, autograder_results = pending_upload
+        student_grade_data = {"posted_grade": autograder_summary["percent_as_string"]}
+        if bulk_comment:
+            try:
+                student_grade_data["text_comment"] = bulk_comment % autograder_summary
+            except (KeyError, TypeError, ValueError) as E:
+                msg = "%s: unable to format the comment for netid [%s] [%s: %s].  Skipping upload." % \
+                      (__file__, student, type(E).__name__, E)
+                write_to_log(msg)
+                print(msg)
+                left_out_uploads.append(pending_upload)
+                continue
+
+        grade_data[user_id] = student_grade_data
+        sent_uploads.append(pending_upload)
+
+    if len(grade_data) == 0:
+        return None, sent_uploads, left_out_uploads
+
+    progress = client.update_grades(course_id, assignment_id, grade_data)
+    progress = client.wait_for_progress(progress)
+
+    msg = "%s: bulk grade update [%s] finished with state [%s] %s" % \
+          (__file__, progress.get("id"), progress["workflow_state"], progress.get("message") or "")
+    write_to_log(msg)
+    print(msg)
+
+    return progress, sent_uploads, left_out_uploads
+
 
-def record_uploaded_version(autograder_summary, student, autograder_results):
+def record_uploaded_version(autograder_summary, student, autograder_results, state_store=None,
+                            assignment_name=None):
     '''
     Update the autograder_summary so that uploaded_version matches graded_version and save to autograder_results file
     :param autograder_summary: dictionary containing the autograder summary
     :param student: login_id (netid) of student
     :param autograder_results: path to file containing autograder results
+    :param state_store: a StateStore to also record the upload in, if any
+    :param assignment_name: the name of the assignment (only needed with state_store)
     :return: None
     '''
     assert isinstance(autograder_summary, dict)
     assert isinstance(student, str), "student is not a string: %s" % student
 
-    if "uploaded_version" not in autograder_summary.keys():
-        autograder_summary["uploaded_version"] = {}
-
-    autograder_summary["uploaded_version"][student] = autograder_summary["graded_version"]
-
-    # replace autograder_summary at end of autograder_results file
-    with open(autograder_results, "r") as f:
-        lines = f.readlines()
-
-    lines[-1] = json.dumps(autograder_summary)
+    with get_results_file_lock(autograder_results):
+        # keep the uploaded versions that teammates sharing this file have recorded since it was read
+        uploaded_version = autograder_summary.get("uploaded_version", {})
+        uploaded_version.update(read_autograder_summary(autograder_results).get("uploaded_version", {}))
+        uploaded_version[student] = autograder_summary["graded_version"]
+        autograder_summary["uploaded_version"] = uploaded_version
 
-    with open(autograder_results, "w") as f:
-        f.writelines(lines)
+        # replace autograder_summary at end of autograder_results file
+        replace_autograder_summary(autograder_results, autograder_summary)
 
     netid_to_upload_time[student] = autograder_summary["uploaded_version"][student]
 
+    if state_store is not None:
+        state_store.record_upload(student, assignment_name, autograder_summary["graded_version"],
+                                  autograder_summary.get("percent_as_string"))
+
 
 def check_grade_is_new(autograder_summary, student):
     '''
@@ -121,44 +280,25 @@ def check_grade_is_new(autograder_summary, student):
         return True
 
 
-if __name__ == "__main__":
-    start = time.time()
-
-    (options, args) = parser.parse_args()
-
-    submissions_directory = options.submissions_directory
-    assert isinstance(submissions_directory, str), "submissions_directory not provided? [%s]" % submissions_directory
-    assert os.path.isdir(
-        submissions_directory), "submissions_directory is not a valid directory: %s" % submissions_directory
-
-    assignment_name = options.assignment_name
-    assignment_id = options.assignment_id
-    assert isinstance(assignment_name, str) or isinstance(assignment_id, int), \
-        "A valid assignment_name or assignment_id must be provided.\n" \
-        "assignment_name: [%s]\n" \
-        "assignment_id: [%s]" % (assignment_name, assignment_id)
-
-    assignment_list = options.assignment_list
-    assert os.path.isfile(assignment_list), "assignment_list is not a valid file: %s" % assignment_list
-
-    assignment_name, assignment_id = get_assignment_name_and_id(assignment_name, assignment_id, assignment_list)
-
-    course_id = options.course_id
-
-    upload_results = options.upload_results
-    assert isinstance(upload_results, bool), "-U flag did not make valid bool: %s" % upload_results
-    if upload_results:
-        assert isinstance(course_id, int), "course_id must be a valid int when uploading results: %s" % course_id
-
-
-    netids = os.listdir(submissions_directory)
-
-    success_count = 0
+def collect_grades(submissions_directory, assignment_name, upload_results=False, roster_file=roster_file):
+    '''
+    Read the autograder summary in each student's assignment directory, for the grades csv and the uploads to do.
+    Teammates' directories hold copies of the same results, so each student's upload is only queued once.
+    :param submissions_directory: the path to the submissions directory
+    :param assignment_name: the name of the assignment
+    :param upload_results: work out which grades need uploading?
+    :param roster_file: the roster to look up students' user_ids in
+    :return: (list of each student's summary for the grades csv,
+              list of (student, user_id, autograder_summary, autograder_results) tuples for the uploads to do,
+              list of students whose uploads can't be done,
+              the number of students whose grade is already uploaded)
+    '''
     fail_list = []
-    unknown_list = []
     grades = []
     already_uploaded_count = 0
-    for netid in netids:
+    pending_uploads = []
+    pending_students = set()
+    for netid in os.listdir(submissions_directory):
         assignment_directory = os.path.join(submissions_directory, netid, assignment_name)
 
         if not os.path.isdir(assignment_directory):
@@ -167,6 +307,10 @@ if __name__ == "__main__":
             print(msg)
             continue
 
+        if is_covered_by_group(submissions_directory, assignment_name, netid):
+            # the results in the group's directory cover this student
+            continue
+
         autograder_results = os.path.join(assignment_directory, "autograder_results.txt")
         if not os.path.isfile(autograder_results):
             msg = "%s: %s is not a file.  Skipping." % (__file__, autograder_results)
@@ -174,20 +318,13 @@ if __name__ == "__main__":
             print(msg)
             continue
 
-        with open(autograder_results, "r") as f:
-            lines = f.readlines()
-
-        last_line = lines[-1]
-
         try:
-            autograder_summary = json.loads(last_line)
+            autograder_summary = read_autograder_summary(autograder_results)
         except ValueError as E:
             msg = "%s: Unable to load summary [%s] for student [%s]" % (__file__, E, netid)
             write_to_log(msg)
             print(msg)
             continue
-        else:
-            assert isinstance(autograder_summary , dict)
 
         team_netids = autograder_summary["team_login_ids"]
         points_received = autograder_summary["points_received"]
@@ -209,22 +346,20 @@ if __name__ == "__main__":
             grades.append(copy.deepcopy(this_autograder_summary))
 
             if upload_results == True:
-                if can_do_upload:
-                    args = ["python", "upload_result_comment.py",
-                            "-c", str(course_id),
-                            "-f", autograder_results,
-                            "-g", percent_as_string,
-                            "-a", assignment_name,
-                            "-l", student]
-                    return_code = subprocess.call(args)
-
-                    if return_code == RETURNCODE_SUCCESS:
-                        success_count += 1
-                        record_uploaded_version(this_autograder_summary, student, autograder_results)
-                    elif return_code == RETURNCODE_FAILED:
+                if can_do_upload and student in pending_students:
+                    # a teammate's results file already covers this student
+                    continue
+                elif can_do_upload:
+                    try:
+                        user_id = get_user_id_from_netid(student, roster_file)
+                    except Exception as E:
+                        msg = "%s: unable to find netid [%s] in roster [%s].  Skipping upload." % (__file__, student, E)
+                        write_to_log(msg)
+                        print(msg)
                         fail_list.append(student)
-                    else:
-                        unknown_list.append(student)
+                        continue
+                    pending_uploads.append((student, user_id, this_autograder_summary, autograder_results))
+                    pending_students.add(student)
                 else:
                     already_uploaded_count += 1
                     msg = "%s: Grade is not new for netid [%s].  Skipping upload." % (__file__, student)
@@ -232,6 +367,127 @@ if __name__ == "__main__":
                     print(msg)
                     continue
 
+    return grades, pending_uploads, fail_list, already_uploaded_count
+
+
+if __name__ == "__main__":
+    start = time.time()
+
+    (options, args) = parser.parse_args()
+
+    submissions_directory = options.submissions_directory
+    assert isinstance(submissions_directory, str), "submissions_directory not provided? [%s]" % submissions_directory
+    assert os.path.isdir(
+        submissions_directory), "submissions_directory is not a valid directory: %s" % submissions_directory
+
+    assignment_name = options.assignment_name
+    assignment_id = options.assignment_id
+    assert isinstance(assignment_name, str) or isinstance(assignment_id, int), \
+        "A valid assignment_name or assignment_id must be provided.\n" \
+        "assignment_name: [%s]\n" \
+        "assignment_id: [%s]" % (assignment_name, assignment_id)
+
+    assignment_list = options.assignment_list
+    assert os.path.isfile(assignment_list), "assignment_list is not a valid file: %s" % assignment_list
+
+    assignment_name, assignment_id = get_assignment_name_and_id(assignment_name, assignment_id, assignment_list)
+
+    course_id = options.course_id
+
+    bulk_upload = options.bulk_upload
+    bulk_comment = options.bulk_comment
+
+    upload_results = options.upload_results or bulk_upload
+    assert isinstance(upload_results, bool), "-U flag did not make valid bool: %s" % upload_results
+    if upload_results:
+        assert isinstance(course_id, int), "course_id must be a valid int when uploading results: %s" % course_id
+
+
+    state_store = None
+    if options.state_db is not None:
+        state_store = StateStore(options.state_db)
+
+    success_count = 0
+    unknown_list = []
+    grades, pending_uploads, fail_list, already_uploaded_count = \
+        collect_grades(submissions_directory, assignment_name, upload_results)
+
+    if len(pending_uploads) > 0 and not bulk_upload:
+        # each team's results file is uploaded once, however many teammates it is for
+        teams = collections.OrderedDict()
+        for pending_upload in pending_uploads:
+            teams.setdefault(os.path.realpath(pending_upload[3]), []).append(pending_upload)
+
+        client = CanvasClient(get_token(token_json_file), concurrency=max(1, options.jobs))
+
+        try:
+            group_comments = is_group_assignment(client, course_id, assignment_id)
+        except urllib2.URLError as E:
+            msg = "%s: unable to get assignment [%s], so not using group comments [%s]" % (__file__, assignment_id, E)
+            write_to_log(msg)
+            print(msg)
+            group_comments = False
+
+        # upload the results files and grades concurrently, recording each one as it finishes
+        team_tasks = []
+        for team_uploads in teams.values():
+            # a group comment reaches the student's whole Canvas group, so only use it when the team due an upload is
+            # known to be that group; otherwise each teammate gets their own comment with the shared file
+            group_comment = group_comments and len(team_uploads) > 1 and is_canvas_group(team_uploads)
+            team_tasks.append((team_uploads, group_comment))
+
+        def upload_team(team_task):
+            return upload_team_results(client, course_id, assignment_id, *team_task)
+
+        with client:
+            for results in client.imap_unordered(upload_team, team_tasks):
+                for pending_upload, succeeded in results:
+                    student, user_id, this_autograder_summary, autograder_results = pending_upload
+                    if succeeded:
+                        success_count += 1
+                        record_uploaded_version(this_autograder_summary, student, autograder_results, state_store,
+                                                assignment_name)
+                    else:
+                        fail_list.append(student)
+
+        msg = "%d results files uploaded for %d students (%d teams with a group comment)" % \
+              (len(team_tasks), len(pending_uploads), len([task for task in team_tasks if task[1]]))
+        write_to_log(msg)
+        print(msg)
+
+    elif len(pending_uploads) > 0:
+        client = CanvasClient(get_token(token_json_file))
+
+        try:
+            progress, sent_uploads, left_out_uploads = bulk_upload_grades(client, course_id, assignment_id,
+                                                                          pending_uploads, bulk_comment)
+        except urllib2.URLError as E:
+            msg = "%s: bulk grade update failed [%s]" % (__file__, E)
+            write_to_log(msg)
+            print(msg)
+            progress, sent_uploads, left_out_uploads = None, [], pending_uploads
+
+        workflow_state = progress["workflow_state"] if progress is not None else None
+        for student, user_id, this_autograder_summary, autograder_results in sent_uploads:
+            if workflow_state == "completed":
+                success_count += 1
+                record_uploaded_version(this_autograder_summary, student, autograder_results, state_store,
+                                        assignment_name)
+            elif workflow_state == "failed":
+                fail_list.append(student)
+            else:
+                # the job may still finish; the grades aren't recorded as uploaded, so the next run posts them again
+                unknown_list.append(student)
+
+        for student, user_id, this_autograder_summary, autograder_results in left_out_uploads:
+            fail_list.append(student)
+
+        if len(unknown_list) > 0:
+            msg = "%s: stopped waiting for bulk grade update [%s] in state [%s].  Check its progress at %s" % \
+                  (__file__, progress.get("id"), workflow_state, build_canvas_url(["progress", progress.get("id")]))
+            write_to_log(msg)
+            print(msg)
+
     grades_csv = os.path.join(submissions_directory, "..", assignment_name + "_grades.csv")
     with open(grades_csv, "w") as f:
         fieldnames = grades[0].keys()
@@ -257,7 +513,12 @@ if __name__ == "__main__":
     print(msg)
 
     if len(unknown_list) > 0:
-        msg = "%d grades had UNKNOWN problem: %s" % (len(unknown_list), unknown_list)
+        msg = "%d grades unknown (bulk grade update still running): %s" % (len(unknown_list), unknown_list)
+        write_to_log(msg)
+        print(msg)
+
+    if upload_results:
+        msg = format_session_stats(get_run_session_stats())
         write_to_log(msg)
         print(msg)
 
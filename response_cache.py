@@ -0,0 +1,189 @@
+import hashlib
+import httplib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib
+from StringIO import StringIO
+
+
+class ResponseCache(object):
+    """An on-disk cache of Canvas API responses, revalidated with conditional requests.
+
+    Each entry is keyed by url and token scope (a hash of the token, so that different tokens never share entries)
+    and stored as two files: <key>.json holds the url, the validators (ETag and Last-Modified) and the response
+    headers, and <key>.body holds the response body.  Entries older than max_age seconds are ignored, and once the
+    cache grows past max_size bytes, the least recently used entries are removed."""
+
+    def __init__(self, directory, max_age=7 * 24 * 60 * 60, max_size=100 * 1024 * 1024, prune_probability=0.02):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_size = max_size
+        self.prune_probability = prune_probability
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.mkdir(directory, 0700)
+        return
+
+    def get_key(self, url, token):
+        scope = hashlib.sha1(token).hexdigest()
+        return hashlib.sha1(scope + "\n" + url).hexdigest()
+
+    def get(self, url, token):
+        '''
+        Look up a cached response
+        :param url: the url that was requested
+        :param token: the Canvas token it was requested with
+        :return: a dictionary with the entry's "url", "etag", "last_modified", "headers" and "key", or None
+        '''
+        key = self.get_key(url, token)
+        metadata_path = os.path.join(self.directory, key + ".json")
+
+        try:
+            if time.time() - os.path.getmtime(metadata_path) > self.max_age:
+                self.remove(key)
+                return None
+
+            with open(metadata_path, "r") as f:
+                entry = json.load(f)
+        except (OSError, IOError, ValueError):
+            return None
+
+        if entry.get("url") != url:
+            return None
+
+        entry["key"] = key
+        return entry
+
+    def get_conditional_headers(self, entry):
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = str(entry["etag"])
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = str(entry["last_modified"])
+        return headers
+
+    def store(self, url, token, response):
+        '''
+        Store a 200 response, if it has a validator
+        :param url: the url that was requested
+        :param token: the Canvas token it was requested with
+        :param response: the response
+        :return: a response to hand to the caller in place of the (now consumed) original one
+        '''
+        headers = response.info()
+        etag = headers.getheader("ETag")
+        last_modified = headers.getheader("Last-Modified")
+
+        with self._lock:
+            self.misses += 1
+
+        if not etag and not last_modified:
+            return response
+
+        body = response.read()
+        response.close()
+
+        key = self.get_key(url, token)
+        entry = {"url": url,
+                 "etag": etag,
+                 "last_modified": last_modified,
+                 "headers": headers.headers,
+                 "stored_at": time.time()}
+
+        # write the body first, so the metadata never points at a body that isn't there yet
+        self._write_atomically(key + ".body", body)
+        self._write_atomically(key + ".json", json.dumps(entry))
+
+        if random.random() < self.prune_probability:
+            self.prune()
+
+        return self._make_response(url, body, headers)
+
+    def get_cached_response(self, entry):
+        '''
+        Serve an entry from disk (after the server answered 304 Not Modified)
+        :param entry: the entry returned by get
+        :return: a response, or None if the body is missing
+        '''
+        body_path = os.path.join(self.directory, entry["key"] + ".body")
+        try:
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except IOError:
+            return None
+
+        # mark the entry as recently used (and fresh) again
+        now = time.time()
+        for filename in [entry["key"] + ".json", entry["key"] + ".body"]:
+            try:
+                os.utime(os.path.join(self.directory, filename), (now, now))
+            except OSError:
+                pass
+
+        with self._lock:
+            self.hits += 1
+
+        headers = httplib.HTTPMessage(StringIO("".join(entry["headers"])))
+        return self._make_response(entry["url"], body, headers)
+
+    def remove(self, key):
+        for filename in [key + ".json", key + ".body"]:
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                pass
+
+    def prune(self):
+        '''
+        Remove expired entries, then the least recently used entries until the cache is under max_size
+        :return: None
+        '''
+        entries = {}
+        for filename in os.listdir(self.directory):
+            key, extension = os.path.splitext(filename)
+            if extension not in [".json", ".body"]:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, filename))
+            except OSError:
+                continue
+            mtime, size = entries.get(key, (0, 0))
+            entries[key] = (max(mtime, stat.st_mtime), size + stat.st_size)
+
+        now = time.time()
+        total_size = 0
+        for key, (mtime, size) in entries.items():
+            if now - mtime > self.max_age:
+                self.remove(key)
+                del entries[key]
+            else:
+                total_size += size
+
+        for key, (mtime, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total_size <= self.max_size:
+                break
+            self.remove(key)
+            total_size -= size
+
+    def _write_atomically(self, filename, content):
+        fd, temp_path = tempfile.mkstemp(prefix="." + filename + ".", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.rename(temp_path, os.path.join(self.directory, filename))
+        except:
+            os.remove(temp_path)
+            raise
+
+    def _make_response(self, url, body, headers):
+        response = urllib.addinfourl(StringIO(body), headers, url)
+        response.code = 200
+        response.msg = "OK"
+        return response
@@ -0,0 +1,112 @@
+import os
+import shutil
+import subprocess
+import time
+
+
+sandbox_methods = ["auto", "reflink", "hardlink", "copy"]
+
+
+class Sandbox(object):
+    """A scratch copy of a student's assignment directory to grade in, so grading never touches the original.
+
+    The copy is made in one of these ways:
+      reflink:  cp --reflink=always.  Files share their blocks with the originals until one side writes to them, so the
+                copy is nearly free.  Needs a filesystem that supports it (e.g. btrfs, XFS).
+      hardlink: every file is a hard link to the original, except mutable_files, which are copied.  Nearly free on any
+                filesystem, but only safe if grading never modifies an existing file in place (writing to a linked file
+                changes the original too), so it is never chosen automatically.
+      copy:     shutil.copytree.
+      auto:     reflink if the filesystem supports it, otherwise copy.
+    If the chosen way fails (e.g. because the scratch space is on another filesystem), the sandbox falls back to a
+    plain copy.  The time spent creating and removing the sandbox is recorded."""
+
+    def __init__(self, source_directory, sandbox_directory, method="auto", mutable_files=[]):
+        '''
+        :param source_directory: the directory to copy
+        :param sandbox_directory: where to put the copy.  Its parent must exist, and it must not.
+        :param method: one of sandbox_methods
+        :param mutable_files: paths (relative to source_directory) of files that grading will write to
+        '''
+        assert os.path.isdir(source_directory), "source_directory is not a directory: %s" % source_directory
+        assert method in sandbox_methods, "method is not one of %s: %s" % (sandbox_methods, method)
+
+        self.source_directory = source_directory
+        self.sandbox_directory = sandbox_directory
+        self.requested_method = method
+        self.method = None
+        self.mutable_files = mutable_files
+        self.setup_seconds = None
+        self.teardown_seconds = None
+        return
+
+    def create(self):
+        '''
+        Make the copy
+        :return: the name of the way it was made ("reflink", "hardlink" or "copy")
+        '''
+        start = time.time()
+
+        if self.requested_method in ["auto", "reflink"] and self._copy_with_reflinks():
+            self.method = "reflink"
+        elif self.requested_method == "hardlink" and self._copy_with_hardlinks():
+            self.method = "hardlink"
+        else:
+            shutil.copytree(src=self.source_directory, dst=self.sandbox_directory)
+            self.method = "copy"
+
+        self.setup_seconds = time.time() - start
+        return self.method
+
+    def destroy(self):
+        '''
+        Remove the copy
+        :return: None
+        '''
+        start = time.time()
+        shutil.rmtree(self.sandbox_directory, ignore_errors=True)
+        self.teardown_seconds = time.time() - start
+
+    def describe(self):
+        msg = "sandbox [%s] made by %s in %.2f seconds" % (self.sandbox_directory, self.method, self.setup_seconds)
+        if self.teardown_seconds is not None:
+            msg += ", removed in %.2f seconds" % self.teardown_seconds
+        return msg
+
+    def _copy_with_reflinks(self):
+        with open(os.devnull, "w") as devnull:
+            try:
+                returncode = subprocess.call(["cp", "-a", "--reflink=always", self.source_directory,
+                                              self.sandbox_directory], stdout=devnull, stderr=devnull)
+            except OSError:
+                returncode = -1
+
+        if returncode != 0:
+            shutil.rmtree(self.sandbox_directory, ignore_errors=True)
+            return False
+        return True
+
+    def _copy_with_hardlinks(self):
+        mutable_files = [os.path.normpath(path) for path in self.mutable_files]
+
+        try:
+            for directory, subdirectories, filenames in os.walk(self.source_directory):
+                relative_directory = os.path.relpath(directory, self.source_directory)
+                target_directory = os.path.normpath(os.path.join(self.sandbox_directory, relative_directory))
+                os.mkdir(target_directory)
+                shutil.copystat(directory, target_directory)
+
+                for name in subdirectories + filenames:
+                    source = os.path.join(directory, name)
+                    target = os.path.join(target_directory, name)
+                    if os.path.islink(source):
+                        os.symlink(os.readlink(source), target)
+                    elif name in filenames:
+                        if os.path.normpath(os.path.join(relative_directory, name)) in mutable_files:
+                            shutil.copy2(source, target)
+                        else:
+                            os.link(source, target)
+        except OSError:
+            shutil.rmtree(self.sandbox_directory, ignore_errors=True)
+            return False
+        return True
@@ -0,0 +1,183 @@
+from optparse import OptionParser
+import sqlite3
+import threading
+import time
+
+
+parser = OptionParser(usage="Usage: %prog [options]",
+                      description="List stale work recorded in a state database.  For example, try:              "
+                                  "python " + __file__ + " -D <state-db> -a <assignment_name> --ungraded")
+parser.add_option("-D", "--state-db",
+                  dest="state_db", default=None, type=str,
+                  help="The path to the state database that the download, grade and record scripts wrote to.")
+parser.add_option("-a", "--assignment-name",
+                  dest="assignment_name", default=None, type=str,
+                  help="The name of the assignment.  e.g. 'proj4'")
+parser.add_option("--ungraded",
+                  dest="ungraded", action="store_true", default=False,
+                  help="List students whose latest downloaded submission hasn't been graded.")
+parser.add_option("--unuploaded",
+                  dest="unuploaded", action="store_true", default=False,
+                  help="List students whose latest grade hasn't been uploaded to Canvas.")
+
+
+schema = '''
+CREATE TABLE IF NOT EXISTS students (
+    user_id INTEGER PRIMARY KEY,
+    login_id TEXT NOT NULL,
+    name TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS students_login_id ON students (login_id);
+
+CREATE TABLE IF NOT EXISTS assignments (
+    assignment_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    course_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS assignments_name ON assignments (name);
+
+CREATE TABLE IF NOT EXISTS submissions (
+    login_id TEXT NOT NULL,
+    assignment_name TEXT NOT NULL,
+    submitted_at TEXT,
+    downloaded_at REAL NOT NULL,
+    PRIMARY KEY (login_id, assignment_name)
+);
+
+CREATE TABLE IF NOT EXISTS grading_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    login_id TEXT NOT NULL,
+    assignment_name TEXT NOT NULL,
+    returncode INTEGER NOT NULL,
+    graded_version TEXT,
+    points_received REAL,
+    points_possible REAL,
+    graded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS grading_runs_student ON grading_runs (assignment_name, login_id, graded_version);
+
+CREATE TABLE IF NOT EXISTS uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    login_id TEXT NOT NULL,
+    assignment_name TEXT NOT NULL,
+    uploaded_version TEXT,
+    grade TEXT,
+    uploaded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS uploads_student ON uploads (assignment_name, login_id, uploaded_version);
+'''
+
+# grading_runs.returncode values that mean the submission was graded (see grade_submission.py)
+graded_returncodes = [0, 5]
+
+
+class StateStore(object):
+    """An optional SQLite database of what has been downloaded, graded and uploaded, so questions like "who has
+    ungraded work?" can be answered without walking the submissions directory.
+
+    The files in each student's assignment directory are still what the scripts go by; the database is a record kept
+    alongside them.  Each write is its own transaction.  Several processes (e.g. grade_submission.py processes started
+    by grade_all_submissions.py) may write to the same database at once."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(schema)
+        return
+
+    def _execute(self, statement, parameters=()):
+        with self._lock:
+            with self._connection:
+                return self._connection.execute(statement, parameters).fetchall()
+
+    def record_student(self, user_id, login_id, name=None):
+        self._execute("INSERT OR REPLACE INTO students (user_id, login_id, name) VALUES (?, ?, ?)",
+                      (user_id, login_id, name))
+
+    def record_assignment(self, assignment_id, name, course_id=None):
+        self._execute("INSERT OR REPLACE INTO assignments (assignment_id, name, course_id) VALUES (?, ?, ?)",
+                      (assignment_id, name, course_id))
+
+    def record_submission(self, login_id, assignment_name, submitted_at):
+        '''
+        Record that a student's submission was downloaded
+        '''
+        self._execute("INSERT OR REPLACE INTO submissions (login_id, assignment_name, submitted_at, downloaded_at) "
+                      "VALUES (?, ?, ?, ?)", (login_id, assignment_name, submitted_at, time.time()))
+
+    def record_grading_run(self, login_id, assignment_name, returncode, autograder_summary=None):
+        '''
+        Record that a student's submission was graded (or that grading failed)
+        :param returncode: grade_submission.py's return code
+        :param autograder_summary: the autograder summary, if grading succeeded
+        '''
+        if autograder_summary is None:
+            autograder_summary = {}
+
+        self._execute("INSERT INTO grading_runs (login_id, assignment_name, returncode, graded_version, "
+                      "points_received, points_possible, graded_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                      (login_id, assignment_name, returncode, autograder_summary.get("graded_version"),
+                       autograder_summary.get("points_received"), autograder_summary.get("points_possible"),
+                       time.time()))
+
+    def record_upload(self, login_id, assignment_name, uploaded_version, grade=None):
+        '''
+        Record that a student's grade was uploaded to Canvas
+        :param uploaded_version: the graded_version of the results that were uploaded
+        '''
+        self._execute("INSERT INTO uploads (login_id, assignment_name, uploaded_version, grade, uploaded_at) "
+                      "VALUES (?, ?, ?, ?, ?)", (login_id, assignment_name, uploaded_version, grade, time.time()))
+
+    def get_ungraded(self, assignment_name):
+        '''
+        :return: login_ids of students whose latest downloaded submission has no successful grading run
+        '''
+        rows = self._execute("SELECT s.login_id FROM submissions s WHERE s.assignment_name = ? AND NOT EXISTS ("
+                             "SELECT 1 FROM grading_runs g WHERE g.assignment_name = s.assignment_name AND "
+                             "g.login_id = s.login_id AND g.graded_version = s.submitted_at AND g.returncode IN (%s)) "
+                             "ORDER BY s.login_id" % ", ".join("?" * len(graded_returncodes)),
+                             [assignment_name] + graded_returncodes)
+        return [str(row["login_id"]) for row in rows]
+
+    def get_unuploaded(self, assignment_name):
+        '''
+        :return: login_ids of students whose latest successfully graded version hasn't been uploaded
+        '''
+        rows = self._execute("SELECT g.login_id FROM grading_runs g WHERE g.assignment_name = ? AND g.returncode IN "
+                             "(%s) AND g.id = (SELECT MAX(latest.id) FROM grading_runs latest WHERE "
+                             "latest.assignment_name = g.assignment_name AND latest.login_id = g.login_id AND "
+                             "latest.returncode IN (%s)) AND NOT EXISTS (SELECT 1 FROM uploads u WHERE "
+                             "u.assignment_name = g.assignment_name AND u.login_id = g.login_id AND "
+                             "u.uploaded_version = g.graded_version) ORDER BY g.login_id" %
+                             (", ".join("?" * len(graded_returncodes)), ", ".join("?" * len(graded_returncodes))),
+                             [assignment_name] + graded_returncodes + graded_returncodes)
+        return [str(row["login_id"]) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+if __name__ == "__main__":
+    (options, args) = parser.parse_args()
+
+    assert isinstance(options.state_db, str), "state_db not provided? [%s]" % options.state_db
+    assert isinstance(options.assignment_name, str), "assignment_name not provided? [%s]" % options.assignment_name
+    assert options.ungraded or options.unuploaded, "--ungraded and/or --unuploaded must be provided"
+
+    store = StateStore(options.state_db)
+
+    if options.ungraded:
+        login_ids = store.get_ungraded(options.assignment_name)
+        print("%d students with ungraded submissions: %s" % (len(login_ids), " ".join(login_ids)))
+
+    if options.unuploaded:
+        login_ids = store.get_unuploaded(options.assignment_name)
+        print("%d students with grades not uploaded: %s" % (len(login_ids), " ".join(login_ids)))
+
+    store.close()
@@ -0,0 +1,48 @@
+from unittest import TestCase
+import json
+import os
+import shutil
+import tempfile
+import history_file
+from autograder_results import read_autograder_summary, read_autograder_output, replace_autograder_summary
+
+
+class TestAutograderResults(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "autograder_results.txt")
+        self.output = ["building line %d\n" % i for i in range(1000)]
+        with open(self.path, "w") as f:
+            f.writelines(self.output)
+            f.write(json.dumps({"points_received": 7, "graded_version": "2018-03-01T12:00:00Z"}) + "\n")
+
+        self.original_block_size = history_file.read_block_size
+        history_file.read_block_size = 64
+
+    def tearDown(self):
+        history_file.read_block_size = self.original_block_size
+        shutil.rmtree(self.directory)
+
+    def test_read(self):
+        self.assertEqual(read_autograder_summary(self.path)["points_received"], 7)
+        self.assertEqual(read_autograder_output(self.path), self.output)
+
+    def test_replace(self):
+        replace_autograder_summary(self.path, {"points_received": 7, "uploaded_version": {"abc123": "x" * 200}})
+
+        self.assertEqual(read_autograder_summary(self.path)["uploaded_version"], {"abc123": "x" * 200})
+        with open(self.path, "r") as f:
+            lines = f.readlines()
+        self.assertEqual(lines[:-1], self.output)
+
+        replace_autograder_summary(self.path, {"points_received": 8})
+        self.assertEqual(read_autograder_summary(self.path), {"points_received": 8})
+        self.assertEqual(read_autograder_output(self.path), self.output)
+
+    def test_no_summary(self):
+        with open(self.path, "w") as f:
+            f.write("Traceback (most recent call last):\n")
+        self.assertRaises(ValueError, read_autograder_summary, self.path)
+
+        open(self.path, "w").close()
+        self.assertRaises(ValueError, read_autograder_summary, self.path)
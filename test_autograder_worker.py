@@ -0,0 +1,105 @@
+from unittest import TestCase
+import json
+import os
+import shutil
+import sys
+import tempfile
+from autograder_worker import AutograderWorker, AutograderWorkerPool
+from grade_submission import grade_submission, RETURNCODE_SUCCESS, RETURNCODE_ALREADY_GRADED, RETURNCODE_FAILED
+
+
+# a worker that grades a submission by the length of its answer.txt, and counts how many times it was started
+worker_script = r'''
+import json, os, sys
+with open(sys.argv[1], "a") as f:
+    f.write("started\n")
+for line in iter(sys.stdin.readline, ""):
+    request = json.loads(line)
+    path = os.path.join(request["directory"], "answer.txt")
+    if not os.path.isfile(path):
+        print(json.dumps({"error": "no answer.txt"}))
+    else:
+        print("grading " + request["directory"])
+        print(json.dumps({"points_possible": 10, "points_received": len(open(path).read()),
+                          "team_login_ids": [os.path.basename(os.path.dirname(request["directory"]))]}))
+    sys.stdout.flush()
+'''
+
+
+class TestAutograderWorker(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.starts_file = os.path.join(self.directory, "starts.txt")
+        script = os.path.join(self.directory, "worker.py")
+        with open(script, "w") as f:
+            f.write(worker_script)
+        self.command = [sys.executable, script, self.starts_file]
+
+        self.submissions_directory = os.path.join(self.directory, "submissions")
+        for login_id, answer in [("abc123", "1234567"), ("def456", "12345")]:
+            assignment_directory = os.path.join(self.submissions_directory, login_id, "proj4")
+            os.makedirs(assignment_directory)
+            with open(os.path.join(assignment_directory, "answer.txt"), "w") as f:
+                f.write(answer)
+            with open(os.path.join(assignment_directory, "submission.json"), "w") as f:
+                json.dump({"submitted_at": "2018-03-01T12:00:00Z"}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_start_count(self):
+        with open(self.starts_file, "r") as f:
+            return len(f.readlines())
+
+    def get_results(self, login_id):
+        with open(os.path.join(self.submissions_directory, login_id, "proj4", "autograder_results.txt"), "r") as f:
+            return f.readlines()
+
+    def test_worker_grades_many_submissions_once_started(self):
+        worker = AutograderWorker(self.command)
+        try:
+            for login_id in ["abc123", "def456"]:
+                self.assertEqual(grade_submission(self.submissions_directory, "proj4", login_id, worker=worker),
+                                 RETURNCODE_SUCCESS)
+        finally:
+            worker.stop()
+
+        self.assertEqual(self.get_start_count(), 1)
+
+        lines = self.get_results("abc123")
+        self.assertTrue(lines[0].startswith("grading "))
+        summary = json.loads(lines[-1])
+        self.assertEqual(summary["points_received"], 7)
+        self.assertEqual(summary["team_login_ids"], ["abc123"])
+        self.assertEqual(summary["graded_version"], "2018-03-01T12:00:00Z")
+
+        # the sandboxes are gone
+        self.assertEqual(sorted(os.listdir(self.submissions_directory)), ["abc123", "def456"])
+
+    def test_worker_error_fails_the_submission(self):
+        os.remove(os.path.join(self.submissions_directory, "abc123", "proj4", "answer.txt"))
+
+        worker = AutograderWorker(self.command)
+        try:
+            self.assertEqual(grade_submission(self.submissions_directory, "proj4", "abc123", worker=worker),
+                             RETURNCODE_FAILED)
+        finally:
+            worker.stop()
+
+    def test_pool_reuses_its_workers(self):
+        pool = AutograderWorkerPool(self.command, 2)
+        jobs = []
+        for i in range(3):
+            for login_id in ["abc123", "def456"]:
+                jobs.append((login_id, lambda worker, login_id=login_id:
+                             grade_submission(self.submissions_directory, "proj4", login_id, worker=worker)))
+        try:
+            results = pool.run(jobs[:2])
+            results += pool.run(jobs[2:])
+        finally:
+            pool.stop()
+
+        returncodes = sorted(result["returncode"] for result in results)
+        self.assertEqual(returncodes, [RETURNCODE_SUCCESS] * 2 + [RETURNCODE_ALREADY_GRADED] * 4)
+        self.assertTrue(self.get_start_count() <= 2)
+        self.assertTrue(pool.peak_concurrency <= 2)
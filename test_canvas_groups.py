@@ -0,0 +1,61 @@
+from unittest import TestCase
+import json
+import os
+import shutil
+import tempfile
+from autograder_results import read_autograder_summary
+from canvas_client import CanvasClient
+from canvas_groups import get_groups, write_group_file, is_covered_by_group, fan_out_group_results
+
+
+class GroupsCanvasClient(CanvasClient):
+    """Answers the groups API from a dictionary of group id to member user_ids"""
+
+    def __init__(self, members):
+        CanvasClient.__init__(self, "token", concurrency=2)
+        self.members = members
+
+    def get_all(self, url):
+        if "/group_categories/" in url:
+            return [{"id": group_id, "name": "Team %d" % group_id} for group_id in sorted(self.members)]
+        group_id = int(url.split("/groups/")[1].split("/")[0])
+        return [{"id": user_id} for user_id in self.members[group_id]]
+
+
+class TestCanvasGroups(TestCase):
+    def setUp(self):
+        self.submissions_directory = tempfile.mkdtemp()
+        for login_id in ["abc123", "def456", "ghi789"]:
+            os.makedirs(os.path.join(self.submissions_directory, login_id, "proj4"))
+
+    def tearDown(self):
+        shutil.rmtree(self.submissions_directory)
+
+    def test_get_groups(self):
+        with GroupsCanvasClient({1: [11, 22], 2: [33]}) as client:
+            groups = get_groups(client, 99)
+
+        self.assertEqual(groups, [{"id": 1, "name": "Team 1", "user_ids": [11, 22]},
+                                  {"id": 2, "name": "Team 2", "user_ids": [33]}])
+
+    def test_fan_out_group_results(self):
+        for login_id in ["abc123", "def456"]:
+            write_group_file(os.path.join(self.submissions_directory, login_id, "proj4"), 1, "Team 1",
+                             ["def456", "abc123"], "abc123")
+        with open(os.path.join(self.submissions_directory, "abc123", "proj4", "autograder_results.txt"), "w") as f:
+            f.write("checking answer.txt\n")
+            f.write(json.dumps({"team_login_ids": ["abc123"], "points_received": 9}))
+
+        self.assertFalse(is_covered_by_group(self.submissions_directory, "proj4", "abc123"))
+        self.assertTrue(is_covered_by_group(self.submissions_directory, "proj4", "def456"))
+        self.assertFalse(is_covered_by_group(self.submissions_directory, "proj4", "ghi789"))
+
+        self.assertEqual(fan_out_group_results(self.submissions_directory, "proj4", "abc123"), ["def456"])
+        self.assertEqual(fan_out_group_results(self.submissions_directory, "proj4", "ghi789"), [])
+
+        for login_id in ["abc123", "def456"]:
+            autograder_summary = read_autograder_summary(
+                os.path.join(self.submissions_directory, login_id, "proj4", "autograder_results.txt"))
+            self.assertEqual(autograder_summary, {"team_login_ids": ["abc123", "def456"], "points_received": 9})
+        self.assertFalse(os.path.exists(os.path.join(self.submissions_directory, "ghi789", "proj4",
+                                                     "autograder_results.txt")))
@@ -0,0 +1,153 @@
+from unittest import TestCase
+import BaseHTTPServer
+import StringIO
+import mimetools
+import shutil
+import tempfile
+import urllib2
+from http_test_server import HTTPServerTestCase
+from canvas_session import CanvasSession, RateLimitScheduler, get_session
+from utils import open_canvas_page
+
+
+class ThrottlingRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """/throttled/ is rate limited on its first two requests.  /flaky/ fails with a 503 on its first request.
+    /forbidden/ is always a plain 403."""
+    protocol_version = "HTTP/1.1"
+    throttled_requests = 0
+    flaky_requests = 0
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if self.path == "/forbidden/":
+            self.reply(403, "403 Forbidden")
+        elif self.path == "/cached/":
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.reply(304, "")
+            else:
+                self.reply(200, "[1, 2, 3]", etag='"v1"')
+        elif self.path == "/flaky/":
+            ThrottlingRequestHandler.flaky_requests += 1
+            if ThrottlingRequestHandler.flaky_requests == 1:
+                self.reply(503, "Service Unavailable")
+            else:
+                self.reply(200, "[]")
+        elif ThrottlingRequestHandler.throttled_requests < 2:
+            ThrottlingRequestHandler.throttled_requests += 1
+            self.reply(403, "403 Forbidden (Rate Limit Exceeded)", remaining="0.0")
+        else:
+            self.reply(200, "[]", remaining="650.5")
+
+    do_POST = do_GET
+
+    def reply(self, code, body, remaining=None, etag=None):
+        self.send_response(code)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        if remaining is not None:
+            self.send_header("X-Rate-Limit-Remaining", remaining)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCanvasSession(HTTPServerTestCase):
+    handler_class = ThrottlingRequestHandler
+
+    def setUp(self):
+        ThrottlingRequestHandler.throttled_requests = 0
+        ThrottlingRequestHandler.flaky_requests = 0
+        HTTPServerTestCase.setUp(self)
+
+        self.session = CanvasSession()
+        self.session.scheduler.throttle_backoff = 0
+        self.session.scheduler.max_delay = 0
+        self.session.backoff_base = 0
+
+    def tearDown(self):
+        self.session.close()
+        HTTPServerTestCase.tearDown(self)
+
+    def test_throttled_requests_are_retried(self):
+        page = self.session.open(self.base_url + "/throttled/", "token")
+
+        self.assertEqual(page.read(), "[]")
+        self.assertEqual(self.session.scheduler.throttled, 2)
+        self.assertEqual(self.session.scheduler.remaining, 650.5)
+        self.assertEqual(self.session.scheduler.in_flight, 0)
+
+    def test_other_errors_are_raised(self):
+        with self.assertRaises(urllib2.HTTPError) as context:
+            self.session.open(self.base_url + "/forbidden/", "token")
+
+        self.assertEqual(context.exception.read(), "403 Forbidden")
+        self.assertEqual(self.session.scheduler.throttled, 0)
+
+    def test_open_canvas_page_raises_errors(self):
+        try:
+            with self.assertRaises(urllib2.HTTPError) as context:
+                open_canvas_page(self.base_url + "/forbidden/", "token")
+            self.assertEqual(context.exception.code, 403)
+        finally:
+            get_session().close()
+
+    def test_server_errors_are_retried_for_gets(self):
+        page = self.session.open(self.base_url + "/flaky/", "token")
+
+        self.assertEqual(page.read(), "[]")
+        self.assertEqual(self.session.retries, 1)
+
+    def test_server_errors_are_not_retried_for_posts(self):
+        with self.assertRaises(urllib2.HTTPError) as context:
+            self.session.open(self.base_url + "/flaky/", "token", data={"a": "b"})
+
+        self.assertEqual(context.exception.code, 503)
+        self.assertEqual(self.session.retries, 0)
+
+    def test_not_modified_responses_are_served_from_the_cache(self):
+        cache_directory = tempfile.mkdtemp()
+        try:
+            session = CanvasSession(cache_directory=cache_directory)
+
+            self.assertEqual(session.open(self.base_url + "/cached/", "token").read(), "[1, 2, 3]")
+            page = session.open(self.base_url + "/cached/", "token")
+
+            self.assertEqual(page.read(), "[1, 2, 3]")
+            self.assertEqual(page.info().getheader("ETag"), '"v1"')
+            self.assertEqual(session.cache.misses, 1)
+            self.assertEqual(session.cache.hits, 1)
+
+            # another token doesn't share the entry
+            session.open(self.base_url + "/cached/", "other token").read()
+            self.assertEqual(session.cache.misses, 2)
+            session.close()
+        finally:
+            shutil.rmtree(cache_directory)
+
+
+def make_headers(remaining, cost):
+    return mimetools.Message(StringIO.StringIO("X-Rate-Limit-Remaining: %s\r\nX-Request-Cost: %s\r\n\r\n" %
+                                               (remaining, cost)))
+
+
+class TestRateLimitScheduler(TestCase):
+    def test_expensive_requests_limit_the_requests_in_flight(self):
+        scheduler = RateLimitScheduler(max_delay=0)
+        self.assertEqual(int(scheduler.limit), 4)
+
+        # the bucket only has room above the low water mark for 2 more requests that cost 100
+        scheduler.acquire()
+        scheduler.release(make_headers(400, 100))
+        self.assertEqual(scheduler.request_cost, 100)
+        self.assertEqual(int(scheduler.limit), 2)
+
+        # cheap requests bring the average cost down, and the limit back up
+        for i in range(40):
+            scheduler.acquire()
+            scheduler.release(make_headers(600, 1))
+        self.assertTrue(scheduler.request_cost < 2)
+        self.assertEqual(int(scheduler.limit), scheduler.max_in_flight)
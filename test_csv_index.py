@@ -0,0 +1,43 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+from csv_index import CsvIndex
+from utils import get_netid_from_user_id, get_user_id_from_netid
+
+
+class TestCsvIndex(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.roster_file = os.path.join(self.directory, "roster.csv")
+        self.write_roster("id,login_id,name\n44648,ABC123,Ann\n44649,def456,Bob\n44650,def456,Bob again\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_roster(self, content):
+        with open(self.roster_file, "w") as f:
+            f.write(content)
+
+    def test_lookups_ignore_case_and_find_the_first_row(self):
+        index = CsvIndex(self.roster_file)
+
+        self.assertEqual(index.lookup("login_id", "abc123")["id"], "44648")
+        self.assertEqual(index.lookup("id", 44649)["login_id"], "def456")
+        self.assertEqual(index.lookup("login_id", "DEF456")["name"], "Bob")
+        self.assertEqual(index.lookup("name", "nobody"), None)
+        self.assertEqual(index.loads, 1)
+
+    def test_changed_file_is_reloaded(self):
+        index = CsvIndex(self.roster_file)
+        self.assertEqual(index.lookup("id", 44651), None)
+
+        self.write_roster("id,login_id,name\n44651,ghi789,Cy\n")
+        os.utime(self.roster_file, (0, 0))
+        self.assertEqual(index.lookup("id", 44651)["login_id"], "ghi789")
+        self.assertEqual(index.loads, 2)
+
+    def test_helpers_use_the_index(self):
+        self.assertEqual(get_netid_from_user_id(44648, self.roster_file), "ABC123")
+        self.assertEqual(get_user_id_from_netid("def456", self.roster_file), 44649)
+        self.assertRaises(Exception, get_user_id_from_netid, "nobody", self.roster_file)
@@ -0,0 +1,75 @@
+import BaseHTTPServer
+import json
+import os
+import shutil
+import tempfile
+from http_test_server import HTTPServerTestCase
+from canvas_session import get_session
+from download_submission import download_submission, RETURNCODE_SUCCESS, RETURNCODE_NOT_NEWER
+
+
+class FileRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the submitted file at /files/1, and records every path requested."""
+    protocol_version = "HTTP/1.1"
+    paths = []
+
+    def do_GET(self):
+        FileRequestHandler.paths.append(self.path)
+        body = "submitted file" if self.path == "/files/1" else ""
+        self.send_response(200 if body else 404)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownloadSubmission(HTTPServerTestCase):
+    handler_class = FileRequestHandler
+
+    def setUp(self):
+        FileRequestHandler.paths = []
+        HTTPServerTestCase.setUp(self)
+        self.download_directory = tempfile.mkdtemp()
+
+        self.submission = {"user_id": 44648,
+                           "submitted_at": "2018-03-01T12:00:00Z",
+                           "attachments": [{"url": self.base_url + "/files/1",
+                                            "filename": "proj4.tar.gz"}]}
+        self.assignment = {"id": 280047, "name": "proj4"}
+
+    def tearDown(self):
+        get_session().close()
+        HTTPServerTestCase.tearDown(self)
+        shutil.rmtree(self.download_directory)
+
+    def download(self):
+        return download_submission(43589, 280047, 44648, "abc123", self.download_directory, "token",
+                                   remote_submission_summary=self.submission, assignment_summary=self.assignment)
+
+    def test_summaries_provided_by_caller_are_not_fetched(self):
+        self.assertEqual(self.download(), RETURNCODE_SUCCESS)
+
+        # only the file itself was requested
+        self.assertEqual(FileRequestHandler.paths, ["/files/1"])
+
+        with open(os.path.join(self.download_directory, "proj4.tar.gz"), "r") as f:
+            self.assertEqual(f.read(), "submitted file")
+        with open(os.path.join(self.download_directory, "assignment.json"), "r") as f:
+            self.assertEqual(json.load(f), self.assignment)
+        with open(os.path.join(self.download_directory, "submission.json"), "r") as f:
+            self.assertEqual(json.load(f)["submitted_at"], "2018-03-01T12:00:00Z")
+
+    def test_submission_not_newer_is_skipped(self):
+        self.assertEqual(self.download(), RETURNCODE_SUCCESS)
+        self.assertEqual(self.download(), RETURNCODE_NOT_NEWER)
+        self.assertEqual(FileRequestHandler.paths, ["/files/1"])
+
+    def test_filename_decoded_from_json(self):
+        # a listing decoded from JSON has unicode filenames, so the download path is unicode too
+        self.submission = json.loads(json.dumps(self.submission))
+        self.assertEqual(self.download(), RETURNCODE_SUCCESS)
+
+        with open(os.path.join(self.download_directory, "proj4.tar.gz"), "r") as f:
+            self.assertEqual(f.read(), "submitted file")
@@ -0,0 +1,112 @@
+from unittest import TestCase
+import json
+import os
+import shutil
+import sys
+import tempfile
+from grade_submission import grade_submission, bookkeeping_files, RETURNCODE_SUCCESS, RETURNCODE_CACHED
+from grading_cache import GradingCache
+
+
+# an autograder that scores answer.txt by its length, and counts how many times it ran
+grader_script = r'''
+import json, os, sys
+with open(sys.argv[1], "a") as f:
+    f.write("ran\n")
+print("checking answer.txt")
+print(json.dumps({"points_possible": 10, "points_received": len(open("answer.txt").read()),
+                  "team_login_ids": ["abc123", "def456"]}))
+'''
+
+
+class TestGradingCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.runs_file = os.path.join(self.directory, "runs.txt")
+        self.script = os.path.join(self.directory, "grader.py")
+        with open(self.script, "w") as f:
+            f.write(grader_script)
+        self.command = "%s %s %s" % (sys.executable, self.script, self.runs_file)
+
+        self.submissions_directory = os.path.join(self.directory, "submissions")
+        for login_id, submitted_at in [("abc123", "2018-03-01T12:00:00Z"), ("def456", "2018-03-02T12:00:00Z"),
+                                       ("ghi789", "2018-03-03T12:00:00Z")]:
+            assignment_directory = os.path.join(self.submissions_directory, login_id, "proj4")
+            os.makedirs(assignment_directory)
+            with open(os.path.join(assignment_directory, "answer.txt"), "w") as f:
+                f.write("1234567")
+            with open(os.path.join(assignment_directory, "submission.json"), "w") as f:
+                json.dump({"submitted_at": submitted_at}, f)
+
+        self.cache = GradingCache(os.path.join(self.directory, "cache"), excluded_files=bookkeeping_files)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def grade(self, login_id, force_do_grading=False):
+        return grade_submission(self.submissions_directory, "proj4", login_id, autograder_command=self.command,
+                                force_do_grading=force_do_grading, grading_cache=self.cache)
+
+    def get_run_count(self):
+        with open(self.runs_file, "r") as f:
+            return len(f.readlines())
+
+    def get_summary(self, login_id):
+        with open(os.path.join(self.submissions_directory, login_id, "proj4", "autograder_results.txt"), "r") as f:
+            lines = f.readlines()
+        self.assertEqual(lines[0], "checking answer.txt\n")
+        return json.loads(lines[-1])
+
+    def test_identical_submissions_are_graded_once(self):
+        self.assertEqual(self.grade("abc123"), RETURNCODE_SUCCESS)
+        self.assertEqual(self.grade("def456"), RETURNCODE_CACHED)
+        self.assertEqual(self.get_run_count(), 1)
+
+        summary = self.get_summary("def456")
+        self.assertEqual(summary["points_received"], 7)
+        self.assertEqual(summary["submitter_login_id"], "def456")
+        self.assertEqual(summary["team_login_ids"], ["abc123", "def456"])
+        self.assertEqual(summary["graded_version"], "2018-03-02T12:00:00Z")
+
+        # not on the team that was graded, so the results are only for this student
+        self.assertEqual(self.grade("ghi789"), RETURNCODE_CACHED)
+        self.assertEqual(self.get_summary("ghi789")["team_login_ids"], ["ghi789"])
+
+    def test_team_named_after_the_scratch_directory(self):
+        # an autograder that works out the team from its working directory sees the scratch directory's name
+        with open(self.script, "w") as f:
+            f.write(grader_script.replace('"abc123"', '"abc123_tmp"'))
+
+        self.assertEqual(self.grade("abc123"), RETURNCODE_SUCCESS)
+        self.assertEqual(self.get_summary("abc123")["team_login_ids"], ["abc123", "def456"])
+
+        # an identical resubmission is still the team's
+        with open(os.path.join(self.submissions_directory, "abc123", "proj4", "submission.json"), "w") as f:
+            json.dump({"submitted_at": "2018-03-04T12:00:00Z"}, f)
+        self.assertEqual(self.grade("abc123"), RETURNCODE_CACHED)
+        self.assertEqual(self.get_summary("abc123")["team_login_ids"], ["abc123", "def456"])
+
+    def test_output_that_is_not_utf8(self):
+        # e.g. gcc's quotes, and a student's program printing arbitrary bytes
+        output = "\xe2\x80\x98main\xe2\x80\x99 returned \xff\xfe\n"
+        with open(self.script, "w") as f:
+            f.write(grader_script.replace('print("checking answer.txt")',
+                                          'print("checking answer.txt")\nsys.stdout.write(%r)' % output))
+
+        self.assertEqual(self.grade("abc123"), RETURNCODE_SUCCESS)
+        self.assertEqual(self.grade("def456"), RETURNCODE_CACHED)
+
+        with open(os.path.join(self.submissions_directory, "def456", "proj4", "autograder_results.txt"), "rb") as f:
+            self.assertEqual(f.readlines()[:2], ["checking answer.txt\n", output])
+        self.assertEqual(sorted(os.listdir(self.submissions_directory)), ["abc123", "def456", "ghi789"])
+
+    def test_changed_or_forced_submissions_are_graded(self):
+        self.assertEqual(self.grade("abc123"), RETURNCODE_SUCCESS)
+
+        with open(os.path.join(self.submissions_directory, "def456", "proj4", "answer.txt"), "w") as f:
+            f.write("12345")
+        self.assertEqual(self.grade("def456"), RETURNCODE_SUCCESS)
+        self.assertEqual(self.get_summary("def456")["points_received"], 5)
+
+        self.assertEqual(self.grade("ghi789", force_do_grading=True), RETURNCODE_SUCCESS)
+        self.assertEqual(self.get_run_count(), 3)
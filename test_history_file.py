@@ -0,0 +1,65 @@
+from unittest import TestCase
+import json
+import os
+import shutil
+import tempfile
+import history_file
+from history_file import append_to_history, iterate_history, read_latest_from_history, migrate_json_history
+
+
+class TestHistoryFile(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "autograder_history.jsonl")
+        self.legacy_path = os.path.join(self.directory, "autograder_history.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_and_read(self):
+        self.assertEqual(read_latest_from_history(self.path), None)
+
+        for version in range(5):
+            append_to_history(self.path, {"graded_version": version})
+
+        self.assertEqual([record["graded_version"] for record in iterate_history(self.path)], range(5))
+        self.assertEqual(read_latest_from_history(self.path), {"graded_version": 4})
+
+    def test_latest_record_spanning_blocks(self):
+        original_block_size = history_file.read_block_size
+        history_file.read_block_size = 16
+        try:
+            append_to_history(self.path, {"output": "x" * 100})
+            append_to_history(self.path, {"output": "y" * 100})
+            self.assertEqual(read_latest_from_history(self.path), {"output": "y" * 100})
+        finally:
+            history_file.read_block_size = original_block_size
+
+    def test_partial_line_is_skipped(self):
+        append_to_history(self.path, {"graded_version": 1})
+        with open(self.path, "a") as f:
+            f.write('{"graded_vers')  # an append that was cut short
+
+        self.assertEqual(read_latest_from_history(self.path), {"graded_version": 1})
+
+        append_to_history(self.path, {"graded_version": 2})
+        self.assertEqual([record["graded_version"] for record in iterate_history(self.path)], [1, 2])
+        self.assertEqual(read_latest_from_history(self.path), {"graded_version": 2})
+
+    def test_legacy_history(self):
+        with open(self.legacy_path, "w") as f:
+            json.dump([{"graded_version": 1}, {"graded_version": 2}], f)
+
+        self.assertEqual(read_latest_from_history(self.path), {"graded_version": 2})
+
+        append_to_history(self.path, {"graded_version": 3})
+        self.assertFalse(os.path.exists(self.legacy_path))
+        self.assertEqual([record["graded_version"] for record in iterate_history(self.path)], [1, 2, 3])
+
+    def test_migrate(self):
+        with open(self.legacy_path, "w") as f:
+            json.dump([{"graded_version": 1}, {"graded_version": 2}], f)
+
+        self.assertEqual(migrate_json_history(self.legacy_path), self.path)
+        self.assertFalse(os.path.exists(self.legacy_path))
+        self.assertEqual([record["graded_version"] for record in iterate_history(self.path)], [1, 2])
@@ -0,0 +1,31 @@
+from unittest import TestCase
+import sys
+from job_scheduler import JobScheduler
+
+
+def make_job(name, returncode, seconds=0.2):
+    return name, [sys.executable, "-c", "import sys, time; time.sleep(%s); sys.exit(%d)" % (seconds, returncode)]
+
+
+class TestJobScheduler(TestCase):
+    def test_runs_every_job_within_the_limit(self):
+        scheduler = JobScheduler(2, poll_interval=0.01)
+        results = scheduler.run([make_job("job%d" % i, i) for i in range(5)])
+
+        self.assertEqual(sorted((result["name"], result["returncode"]) for result in results),
+                         [("job%d" % i, i) for i in range(5)])
+        self.assertEqual(scheduler.peak_concurrency, 2)
+        for result in results:
+            self.assertTrue(result["wall_time"] >= 0.2)
+
+        # the last jobs had to wait for the first ones to finish
+        self.assertTrue(max(result["queue_time"] for result in results) >= 0.2)
+
+    def test_overloaded_machine_runs_one_job_at_a_time(self):
+        # no machine has a load average below 0, so launches are always held back while anything is running
+        scheduler = JobScheduler(4, max_load=-1.0, poll_interval=0.01)
+        results = scheduler.run([make_job("job%d" % i, 0, seconds=0.05) for i in range(3)])
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(scheduler.peak_concurrency, 1)
+        self.assertTrue(scheduler.throttled_launches > 0)
@@ -0,0 +1,46 @@
+import BaseHTTPServer
+import urllib2
+from http_test_server import HTTPServerTestCase
+from urllib2_extension import ConnectionPool, KeepAliveHandler
+
+
+class KeepAliveRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = "hello " + self.path
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestKeepAliveHandler(HTTPServerTestCase):
+    handler_class = KeepAliveRequestHandler
+
+    def test_connection_is_reused(self):
+        pool = ConnectionPool(max_per_host=2)
+        opener = urllib2.build_opener(KeepAliveHandler(pool))
+
+        for i in range(3):
+            page = opener.open(self.base_url + "/%d" % i)
+            self.assertEqual(page.read(), "hello /%d" % i)
+            page.close()
+
+        self.assertEqual(pool.opened, 1)
+        self.assertEqual(pool.reused, 2)
+        pool.close()
+
+    def test_unread_response_is_not_reused(self):
+        pool = ConnectionPool(max_per_host=2)
+        opener = urllib2.build_opener(KeepAliveHandler(pool))
+
+        opener.open(self.base_url + "/a").close()
+        opener.open(self.base_url + "/b").read()
+
+        self.assertEqual(pool.opened, 2)
+        self.assertEqual(pool.reused, 0)
+        pool.close()
@@ -0,0 +1,60 @@
+from unittest import TestCase
+import os
+import tempfile
+from urllib2_extension import MultiPartForm
+
+
+class TestMultiPartForm(TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(fd, "wb") as f:
+            f.write("autograder output\n" * 5000)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def build_form(self):
+        form = MultiPartForm()
+        form.boundary = "BOUNDARY"
+        form.add_field("key", "value")
+        form.add_file_from_path("file", self.path, filename="results.txt")
+        return form
+
+    def test_body_matches_in_memory_form(self):
+        in_memory = MultiPartForm()
+        in_memory.boundary = "BOUNDARY"
+        in_memory.add_field("key", "value")
+        with open(self.path, "rb") as f:
+            in_memory.add_file("file", "results.txt", f)
+
+        expected = "\r\n".join(["--BOUNDARY",
+                                'Content-Disposition: form-data; name="key"',
+                                "",
+                                "value",
+                                "--BOUNDARY",
+                                'Content-Disposition: file; name="file"; filename="results.txt"',
+                                "Content-Type: text/plain",
+                                "",
+                                "autograder output\n" * 5000,
+                                "--BOUNDARY--",
+                                ""])
+
+        self.assertEqual(str(in_memory), expected)
+        self.assertEqual(str(self.build_form()), expected)
+
+    def test_length_is_known_and_body_streams_in_chunks(self):
+        body = self.build_form().get_body()
+        expected = str(self.build_form())
+
+        chunks = []
+        chunk = body.read(8192)
+        while chunk:
+            self.assertTrue(len(chunk) <= 8192)
+            chunks.append(chunk)
+            chunk = body.read(8192)
+
+        self.assertEqual(len(body), len(expected))
+        self.assertEqual("".join(chunks), expected)
+
+        body.seek(0)
+        self.assertEqual(body.read(), expected)
@@ -0,0 +1,63 @@
+import BaseHTTPServer
+import json
+import urlparse
+from http_test_server import HTTPServerTestCase
+from utils import add_url_params, download_all_objects_to_list, get_remaining_page_urls
+
+
+class PaginatedRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves 25 numbered objects, 10 per page.  /bookmarks/ pages only link to the next page."""
+    protocol_version = "HTTP/1.1"
+    object_count = 25
+
+    def do_GET(self):
+        parsed = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(parsed.query))
+        page = int(query.get("page", 1))
+        per_page = int(query.get("per_page", 10))
+        last_page = (self.object_count + per_page - 1) // per_page
+        base = "http://%s:%d%s" % (self.server.server_address + (parsed.path,))
+
+        links = ['<%s?page=%d&per_page=%d>; rel="current"' % (base, page, per_page)]
+        if page < last_page:
+            links.append('<%s?page=%d&per_page=%d>; rel="next"' % (base, page + 1, per_page))
+        if parsed.path != "/bookmarks/":
+            links.append('<%s?page=%d&per_page=%d>; rel="last"' % (base, last_page, per_page))
+
+        body = json.dumps(range((page - 1) * per_page, min(page * per_page, self.object_count)))
+        self.send_response(200)
+        self.send_header("Link", ",".join(links))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPagination(HTTPServerTestCase):
+    handler_class = PaginatedRequestHandler
+
+    def test_get_remaining_page_urls(self):
+        page_links = {"current": "https://x/api/v1/users?page=1&per_page=100",
+                      "last": "https://x/api/v1/users?page=3&per_page=100"}
+        urls = get_remaining_page_urls(page_links)
+
+        self.assertEqual(len(urls), 2)
+        self.assertEqual(dict(urlparse.parse_qsl(urlparse.urlparse(urls[1]).query)),
+                         {"page": "3", "per_page": "100"})
+
+        self.assertEqual(get_remaining_page_urls({"next": "https://x/api/v1/users?page=2"}), None)
+        self.assertEqual(get_remaining_page_urls({"last": "https://x/api/v1/users?page=bookmark:abc"}), None)
+
+    def test_pages_are_fetched_in_order(self):
+        objects = []
+        download_all_objects_to_list(add_url_params(self.base_url + "/numbered/", {"per_page": 10}), "token", objects)
+
+        self.assertEqual(objects, range(25))
+
+    def test_falls_back_to_next_links(self):
+        objects = []
+        download_all_objects_to_list(add_url_params(self.base_url + "/bookmarks/", {"per_page": 10}), "token", objects)
+
+        self.assertEqual(objects, range(25))
@@ -0,0 +1,156 @@
+from unittest import TestCase
+import copy
+import json
+import os
+import shutil
+import tempfile
+from autograder_results import read_autograder_summary
+from canvas_client import CanvasClient
+from canvas_groups import write_group_file
+from record_all_grades import record_uploaded_version, check_grade_is_new, upload_team_results, bulk_upload_grades, \
+                              collect_grades, is_canvas_group
+
+
+class RecordingCanvasClient(CanvasClient):
+    """Records the uploads and comments it is asked to make, instead of making them"""
+
+    def __init__(self):
+        CanvasClient.__init__(self, "token")
+        self.uploads = []
+        self.comments = []
+
+    def upload_comment_file(self, course_id, assignment_id, user_id, path, name=None):
+        self.uploads.append(user_id)
+        return 1000 + len(self.uploads)
+
+    def put_submission(self, course_id, assignment_id, user_id, grade=None, comment=None, file_ids=[], data={}):
+        self.comments.append((user_id, grade, file_ids, data))
+        return {}
+
+    def update_grades(self, course_id, assignment_id, grade_data):
+        self.grade_data = grade_data
+        return {"id": 77, "workflow_state": "queued"}
+
+    def wait_for_progress(self, progress, poll_interval=2.0, timeout=600):
+        return progress
+
+
+class TestRecordUploadedVersion(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.autograder_results = os.path.join(self.directory, "autograder_results.txt")
+        self.autograder_summary = {"team_login_ids": ["abc123", "def456"], "graded_version": "2018-03-01T12:00:00Z",
+                                   "percent_as_string": "90.0%"}
+        with open(self.autograder_results, "w") as f:
+            f.write("checking answer.txt\n")
+            f.write(json.dumps(self.autograder_summary))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_teammates_sharing_a_file(self):
+        # each teammate's copy of the summary is made before either upload is recorded
+        first = copy.deepcopy(self.autograder_summary)
+        second = copy.deepcopy(self.autograder_summary)
+
+        record_uploaded_version(second, "def456", self.autograder_results)
+        record_uploaded_version(first, "abc123", self.autograder_results)
+
+        autograder_summary = read_autograder_summary(self.autograder_results)
+        self.assertEqual(autograder_summary["uploaded_version"],
+                         {"abc123": "2018-03-01T12:00:00Z", "def456": "2018-03-01T12:00:00Z"})
+        self.assertFalse(check_grade_is_new(autograder_summary, "abc123"))
+        self.assertFalse(check_grade_is_new(autograder_summary, "def456"))
+
+        with open(self.autograder_results, "r") as f:
+            self.assertEqual(f.readline(), "checking answer.txt\n")
+
+
+class TestUploadTeamResults(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        autograder_results = os.path.join(self.directory, "autograder_results.txt")
+        autograder_summary = {"team_login_ids": ["abc123", "def456"], "graded_version": "2018-03-01T12:00:00Z",
+                              "percent_as_string": "90.0%"}
+        with open(autograder_results, "w") as f:
+            f.write(json.dumps(autograder_summary))
+
+        self.team_uploads = [("abc123", 11, autograder_summary, autograder_results),
+                             ("def456", 22, autograder_summary, autograder_results)]
+        self.client = RecordingCanvasClient()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_file_is_uploaded_once(self):
+        results = upload_team_results(self.client, 1, 2, self.team_uploads)
+
+        self.assertEqual([succeeded for pending_upload, succeeded in results], [True, True])
+        self.assertEqual(self.client.uploads, [11])
+        self.assertEqual(self.client.comments, [(11, "90.0%", [1001], {}), (22, "90.0%", [1001], {})])
+
+    def test_group_comment_needs_a_canvas_group(self):
+        # the team comes from the submission, so on its own it isn't known to be a Canvas group
+        self.assertFalse(is_canvas_group(self.team_uploads))
+
+        write_group_file(self.directory, 5, "Team 5", ["abc123", "def456", "ghi789"], "abc123")
+        self.assertFalse(is_canvas_group(self.team_uploads))
+
+        write_group_file(self.directory, 5, "Team 5", ["abc123", "def456"], "abc123")
+        self.assertTrue(is_canvas_group(self.team_uploads))
+
+    def test_group_comment(self):
+        results = upload_team_results(self.client, 1, 2, self.team_uploads, group_comment=True)
+
+        self.assertEqual([pending_upload[0] for pending_upload, succeeded in results], ["abc123", "def456"])
+        self.assertEqual([succeeded for pending_upload, succeeded in results], [True, True])
+        self.assertEqual(self.client.uploads, [11])
+        self.assertEqual(self.client.comments, [(11, "90.0%", [1001], {"comment[group_comment]": "true"})])
+
+
+class TestBulkUploadGrades(TestCase):
+    def setUp(self):
+        self.pending_uploads = [("abc123", 11, {"percent_as_string": "90.0%", "points_received": 9}, "a.txt"),
+                                ("def456", 22, {"percent_as_string": "50.0%"}, "b.txt")]
+        self.client = RecordingCanvasClient()
+
+    def test_comment_that_cannot_be_formatted_leaves_the_student_out(self):
+        progress, sent_uploads, left_out_uploads = bulk_upload_grades(self.client, 1, 2, self.pending_uploads,
+                                                                      "Score: %(points_received)s")
+
+        self.assertEqual([pending_upload[0] for pending_upload in sent_uploads], ["abc123"])
+        self.assertEqual([pending_upload[0] for pending_upload in left_out_uploads], ["def456"])
+        self.assertEqual(self.client.grade_data, {11: {"posted_grade": "90.0%", "text_comment": "Score: 9"}})
+
+        # the job hadn't finished when we stopped waiting, which isn't the same as failing
+        self.assertEqual(progress, {"id": 77, "workflow_state": "queued"})
+
+
+class TestCollectGrades(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.submissions_directory = os.path.join(self.directory, "submissions")
+        self.roster_file = os.path.join(self.directory, "roster.csv")
+        with open(self.roster_file, "w") as f:
+            f.write("id,login_id\n11,abc123\n22,def456\n")
+
+        # each teammate's directory has a copy of the team's results
+        autograder_summary = {"team_login_ids": ["abc123", "def456"], "points_received": 9, "points_possible": 10,
+                              "graded_version": "2018-03-01T12:00:00Z"}
+        for login_id in ["abc123", "def456"]:
+            assignment_directory = os.path.join(self.submissions_directory, login_id, "proj4")
+            os.makedirs(assignment_directory)
+            with open(os.path.join(assignment_directory, "autograder_results.txt"), "w") as f:
+                f.write(json.dumps(autograder_summary))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_teammates_are_queued_once(self):
+        grades, pending_uploads, fail_list, already_uploaded_count = \
+            collect_grades(self.submissions_directory, "proj4", upload_results=True, roster_file=self.roster_file)
+
+        self.assertEqual(sorted((pending_upload[0], pending_upload[1]) for pending_upload in pending_uploads),
+                         [("abc123", 11), ("def456", 22)])
+        self.assertEqual(pending_uploads[0][2]["percent_as_string"], "90.0%")
+        self.assertEqual(fail_list, [])
@@ -0,0 +1,54 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+from sandbox import Sandbox
+
+
+class TestSandbox(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, "proj4")
+        os.makedirs(os.path.join(self.source, "src"))
+        for path in ["submission.json", "autograder_results.txt", os.path.join("src", "main.c")]:
+            with open(os.path.join(self.source, path), "w") as f:
+                f.write("original %s" % path)
+
+        self.sandbox_directory = os.path.join(self.directory, "abc123_tmp")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assert_same_tree(self):
+        for path in ["submission.json", "autograder_results.txt", os.path.join("src", "main.c")]:
+            with open(os.path.join(self.sandbox_directory, path), "r") as f:
+                self.assertEqual(f.read(), "original %s" % path)
+
+    def test_copy(self):
+        sandbox = Sandbox(self.source, self.sandbox_directory, method="copy")
+        self.assertEqual(sandbox.create(), "copy")
+        self.assert_same_tree()
+
+        sandbox.destroy()
+        self.assertFalse(os.path.exists(self.sandbox_directory))
+        self.assertTrue(sandbox.setup_seconds >= 0 and sandbox.teardown_seconds >= 0)
+
+    def test_auto_makes_a_copy_either_way(self):
+        sandbox = Sandbox(self.source, self.sandbox_directory)
+        self.assertIn(sandbox.create(), ["reflink", "copy"])
+        self.assert_same_tree()
+
+    def test_hardlinks_except_mutable_files(self):
+        sandbox = Sandbox(self.source, self.sandbox_directory, method="hardlink",
+                          mutable_files=["autograder_results.txt"])
+        self.assertEqual(sandbox.create(), "hardlink")
+        self.assert_same_tree()
+
+        main = os.path.join("src", "main.c")
+        self.assertTrue(os.path.samefile(os.path.join(self.source, main), os.path.join(self.sandbox_directory, main)))
+
+        # writing a mutable file in the sandbox leaves the original alone
+        with open(os.path.join(self.sandbox_directory, "autograder_results.txt"), "w") as f:
+            f.write("new results")
+        with open(os.path.join(self.source, "autograder_results.txt"), "r") as f:
+            self.assertEqual(f.read(), "original autograder_results.txt")
@@ -0,0 +1,37 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+from state_store import StateStore
+
+
+class TestStateStore(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = StateStore(os.path.join(self.directory, "state.db"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_stale_work(self):
+        for login_id in ["abc123", "def456", "ghi789"]:
+            self.store.record_submission(login_id, "proj4", "2018-03-01T12:00:00Z")
+
+        self.store.record_grading_run("abc123", "proj4", 0, {"graded_version": "2018-03-01T12:00:00Z",
+                                                            "points_received": 9, "points_possible": 10})
+        self.store.record_grading_run("def456", "proj4", 5, {"graded_version": "2018-03-01T12:00:00Z"})
+        self.store.record_grading_run("ghi789", "proj4", 4)
+        self.assertEqual(self.store.get_ungraded("proj4"), ["ghi789"])
+        self.assertEqual(self.store.get_unuploaded("proj4"), ["abc123", "def456"])
+
+        self.store.record_upload("abc123", "proj4", "2018-03-01T12:00:00Z", "90.0%")
+        self.assertEqual(self.store.get_unuploaded("proj4"), ["def456"])
+
+        # a newer submission makes the old grade stale
+        self.store.record_submission("abc123", "proj4", "2018-03-02T12:00:00Z")
+        self.assertEqual(self.store.get_ungraded("proj4"), ["abc123", "ghi789"])
+        self.store.record_grading_run("abc123", "proj4", 0, {"graded_version": "2018-03-02T12:00:00Z"})
+        self.assertEqual(self.store.get_ungraded("proj4"), ["ghi789"])
+        self.assertEqual(self.store.get_unuploaded("proj4"), ["abc123", "def456"])
+        self.assertEqual(self.store.get_ungraded("proj5"), [])
@@ -0,0 +1,65 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import watch_submissions
+from canvas_groups import write_group_file
+from watch_submissions import get_new_submissions, read_watch_file, write_watch_file, build_new_submissions_url, \
+                              get_next_submitted_since
+
+
+class TestWatchSubmissions(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.submissions_directory = os.path.join(self.directory, "submissions")
+        os.mkdir(self.submissions_directory)
+
+        self.original_roster_file = watch_submissions.roster_file
+        watch_submissions.roster_file = os.path.join(self.directory, "roster.csv")
+        with open(watch_submissions.roster_file, "w") as f:
+            f.write("id,login_id,name\n11,abc123,Ann\n22,def456,Dan\n33,ghi789,Gil\n")
+
+    def tearDown(self):
+        watch_submissions.roster_file = self.original_roster_file
+        shutil.rmtree(self.directory)
+
+    def test_watch_file(self):
+        watch_file = os.path.join(self.directory, "watch.json")
+        self.assertEqual(read_watch_file(watch_file), None)
+
+        write_watch_file(watch_file, "2018-03-01T12:00:00Z")
+        self.assertEqual(read_watch_file(watch_file), "2018-03-01T12:00:00Z")
+        self.assertEqual(sorted(os.listdir(self.directory)), ["roster.csv", "submissions", "watch.json"])
+        self.assertTrue("submitted_since=2018-03-01T12:00:00Z" in
+                        build_new_submissions_url(1, 2, read_watch_file(watch_file)))
+
+    def test_new_submissions(self):
+        # ghi789's submissions are kept in def456's directory
+        for login_id in ["def456", "ghi789"]:
+            assignment_directory = os.path.join(self.submissions_directory, login_id, "proj4")
+            os.makedirs(assignment_directory)
+            write_group_file(assignment_directory, 5, "Team 5", ["def456", "ghi789"], "def456")
+
+        submissions = [{"user_id": 11, "attempt": 1, "submitted_at": "2018-03-01T12:00:00Z"},
+                       {"user_id": 11, "attempt": 2, "submitted_at": "2018-03-02T12:00:00Z"},
+                       {"user_id": 22, "attempt": 1, "submitted_at": "2018-03-03T12:00:00Z"},
+                       {"user_id": 33, "attempt": 1, "submitted_at": "2018-03-03T12:00:00Z"},
+                       {"user_id": 44, "attempt": 1, "submitted_at": "2018-03-03T12:00:00Z"},
+                       {"user_id": 11, "attempt": None, "submitted_at": None}]
+
+        new_submissions = get_new_submissions(submissions, self.submissions_directory, "proj4")
+
+        self.assertEqual(sorted(new_submissions), ["abc123", "def456"])
+        self.assertEqual(new_submissions["abc123"], (11, submissions[1]))
+        self.assertEqual(new_submissions["def456"], (22, submissions[2]))
+
+    def test_next_submitted_since(self):
+        new_submissions = {"abc123": (11, {"submitted_at": "2018-03-02T12:00:00Z"}),
+                           "def456": (22, {"submitted_at": "2018-03-03T12:00:00Z"})}
+
+        self.assertEqual(get_next_submitted_since(None, new_submissions, []), "2018-03-03T12:00:00Z")
+        self.assertEqual(get_next_submitted_since("2018-03-01T12:00:00Z", {}, []), "2018-03-01T12:00:00Z")
+
+        # a failed download or grading run is tried again from the same point
+        self.assertEqual(get_next_submitted_since("2018-03-01T12:00:00Z", new_submissions, ["abc123"]),
+                         "2018-03-01T12:00:00Z")
@@ -0,0 +1,84 @@
+from unittest import TestCase
+import BaseHTTPServer
+import csv
+import json
+import os
+import shutil
+import tempfile
+import urllib2
+from http_test_server import HTTPServerTestCase
+from canvas_session import get_session
+from utils import write_objects_to_csv, iterate_all_objects
+
+
+class FailingPageRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves one page of students, linking to a second page that fails."""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/users/?page=2":
+            body = "404 Not Found"
+            self.send_response(404)
+        else:
+            body = json.dumps([{"id": 11, "login_id": "abc123"}])
+            self.send_response(200)
+            self.send_header("Link", '<http://%s:%d/users/?page=2>; rel="next"' % self.server.server_address)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestWrite_objects_to_csv(TestCase):
+    def setUp(self):
+        fd, self.destination = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.destination)
+
+    def read_rows(self):
+        with open(self.destination) as f:
+            return list(csv.DictReader(f))
+
+    def test_later_objects_with_new_keys(self):
+        objects = iter([{"id": 1}, {"id": 2, "login_id": "abc123"}, {"id": 3, "name": "Student"}])
+        count = write_objects_to_csv(objects, self.destination)
+
+        self.assertEqual(count, 3)
+        self.assertEqual(self.read_rows(), [{"id": "1", "login_id": "", "name": ""},
+                                            {"id": "2", "login_id": "abc123", "name": ""},
+                                            {"id": "3", "login_id": "", "name": "Student"}])
+
+    def test_declared_schema(self):
+        objects = iter([{"id": 1, "extra": "x"}, {"id": 2, "login_id": "abc123"}])
+        write_objects_to_csv(objects, self.destination, fieldnames=["id", "login_id"])
+
+        self.assertEqual(self.read_rows(), [{"id": "1", "login_id": ""},
+                                            {"id": "2", "login_id": "abc123"}])
+
+
+class TestWriteObjectsToCsvFailure(HTTPServerTestCase):
+    handler_class = FailingPageRequestHandler
+
+    def setUp(self):
+        HTTPServerTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.destination = os.path.join(self.directory, "roster.csv")
+        with open(self.destination, "w") as f:
+            f.write("id,login_id\n11,abc123\n22,def456\n")
+
+    def tearDown(self):
+        get_session().close()
+        HTTPServerTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def test_failed_download_keeps_the_old_file(self):
+        with self.assertRaises(urllib2.HTTPError):
+            write_objects_to_csv(iterate_all_objects(self.base_url + "/users/", "token"), self.destination)
+
+        with open(self.destination) as f:
+            self.assertEqual(f.read(), "id,login_id\n11,abc123\n22,def456\n")
+        self.assertEqual(os.listdir(self.directory), ["roster.csv"])
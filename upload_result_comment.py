@@ -1,10 +1,12 @@
 from optparse import OptionParser
+import atexit
 import os
-from utils import get_assignment_name_and_id, get_netid_and_user_id, build_canvas_url, open_canvas_page_as_string, \
-                  get_token, post_file_using_curl, get_header, put_using_curl, write_to_log
+from utils import get_assignment_name_and_id, get_netid_and_user_id, get_token, write_to_log, \
+                  write_session_stats_to_log
+from canvas_client import CanvasClient
 import time, datetime
-import json
 import sys
+import urllib2
 
 
 parser = OptionParser(usage="Usage: %prog [options]",
@@ -57,9 +59,51 @@ RETURNCODE_ALREADY_UPLOADED = 1
 RETURNCODE_FAILED = 4
 
 
+def upload_result_comment(client, course_id, assignment_id, user_id, login_id, results_file, grade=None,
+                          results_file_lock=None, file_id=None, group_comment=False):
+    '''
+    Upload a results file, then add a comment to the student's submission with the file attached (and the grade, if
+    given)
+    :param client: CanvasClient
+    :param course_id: Canvas course_id
+    :param assignment_id: Canvas assignment_id
+    :param user_id: Canvas user_id of the student
+    :param login_id: login_id (netid) of the student
+    :param results_file: the file to upload
+    :param grade: the grade to post (e.g. "85.0%"), if any
+    :param results_file_lock: a lock to hold while the file is being read and uploaded, if something else may be
+                              writing to it at the same time
+    :param file_id: the Canvas id of the results file, if it was already uploaded (e.g. for a teammate)
+    :param group_comment: for a group assignment, add the comment to every group member's submission?
+    :return: (the Canvas id of the uploaded file, the updated submission)
+    '''
+    timestamp = datetime.datetime.fromtimestamp(time.time())
+    upload_name = "%s_%s_%s" % (login_id[:8], timestamp.strftime('%Y-%m-%d_%H.%M.%S'), os.path.basename(results_file))
+    comment_text = "results attached " + timestamp.strftime('%Y-%m-%d %H:%M:%S')
+
+    if file_id is None:
+        if results_file_lock is None:
+            file_id = client.upload_comment_file(course_id, assignment_id, user_id, results_file, name=upload_name)
+        else:
+            with results_file_lock:
+                file_id = client.upload_comment_file(course_id, assignment_id, user_id, results_file,
+                                                     name=upload_name)
+        print("uploaded file id: %s" % file_id)
+
+    data = {}
+    if group_comment:
+        data["comment[group_comment]"] = "true"
+
+    submission = client.put_submission(course_id, assignment_id, user_id, grade=grade or None, comment=comment_text,
+                                       file_ids=[file_id], data=data)
+    return file_id, submission
+
+
 if __name__ == "__main__":
     (options, args) = parser.parse_args()
 
+    atexit.register(write_session_stats_to_log, __file__)
+
     course_id = options.course_id
     assert isinstance(course_id, int), "course_id is not an int: %s" % course_id
 
@@ -97,56 +141,14 @@ if __name__ == "__main__":
     token_json_file = options.token_json_file
     token = get_token(token_json_file)
 
-    # upload file in 3 steps
-    # (https://canvas.instructure.com/doc/api/file.file_uploads.html#method.file_uploads.post)
-    # step 1
-    url = build_canvas_url(["courses", course_id, "assignments", assignment_id, "submissions", user_id, "comments",
-                            "files"], params={})
-    results_filename = os.path.basename(results_file)
-    size = os.stat(results_file).st_size
-    timestamp = datetime.datetime.fromtimestamp(time.time())
-    post_data = {"name": "%s_%s_%s" % (login_id[:8], timestamp.strftime('%Y-%m-%d_%H.%M.%S'), results_filename),
-                 "size": size,}
-    response = open_canvas_page_as_string(url, token, data=post_data)
-    response = json.loads(response)
-    print(response)
-
-    # step 2
-    upload_url = str(response["upload_url"])
-    upload_params = response["upload_params"]
-    files = {"file": results_file}
-
-    response2, headers = post_file_using_curl(upload_url, data=upload_params, file=results_file)
-    print('response 2')
-    print(response2)
-    print("headers")
-    print(headers)
-
-    # step 3
-    location = get_header("Location", headers)
-    print("location: %s" % location)
-
-    response3 = open_canvas_page_as_string(str(location), token, method="POST")
-    print("response 3")
-    print(response3)
-
-    # upload comment and attach the previously uploaded file
-    comment_url = build_canvas_url(["courses", course_id, "assignments", assignment_id, "submissions", user_id])
-    upload_id = json.loads(response3)["id"]
-    comment_text = "results attached " + timestamp.strftime('%Y-%m-%d %H:%M:%S')
-    put_data = {"comment[text_comment]": comment_text, "comment[file_ids][]": upload_id}
-
-    if grade:
-        put_data["submission[posted_grade]"] = grade
-
-    print(put_data)
-    response4, headers = put_using_curl(comment_url, token, data=put_data)
-    print(response4)
+    client = CanvasClient(token)
 
     try:
-        json.loads(response4)
-    except (ValueError, TypeError) as E:
-        msg = "%s: final PUT request received non-json response [%s]" % (__file__, E)
+        file_id, submission = upload_result_comment(client, course_id, assignment_id, user_id, login_id, results_file,
+                                                    grade)
+        print(submission)
+    except (urllib2.URLError, ValueError, TypeError) as E:
+        msg = "%s: upload for netid [%s] failed [%s]" % (__file__, login_id, E)
         write_to_log(msg)
         print(msg)
         sys.exit(RETURNCODE_FAILED)
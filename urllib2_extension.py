@@ -1,6 +1,10 @@
-import itertools
+import httplib
 import mimetools
 import mimetypes
+import os
+import socket
+import threading
+import urllib
 import urllib2
 
 
@@ -20,6 +24,242 @@ class MethodRequest(urllib2.Request):
         return urllib2.Request.get_method(self, *args, **kwargs)
 
 
+class ConnectionPool(object):
+    """Keep idle keep-alive connections around (a bounded number per host) so later requests can reuse them."""
+
+    def __init__(self, max_per_host=4):
+        self.max_per_host = max_per_host
+        self.opened = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+        return
+
+    def get(self, scheme, host, timeout, fresh=False):
+        """Return (connection, reused) for the given host, opening a new connection if none is idle (or if fresh)."""
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle and not fresh:
+                self.reused += 1
+                return idle.pop(), True
+            self.opened += 1
+
+        if scheme == "https":
+            return httplib.HTTPSConnection(host, timeout=timeout), False
+        return httplib.HTTPConnection(host, timeout=timeout), False
+
+    def put(self, scheme, host, conn):
+        """Hand a connection back once its response has been read.  Connections beyond the limit are closed."""
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.max_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class PooledResponse(object):
+    """Wrap an httplib response so that its connection goes back to the pool once the body is fully read."""
+
+    def __init__(self, response, release, discard):
+        self._response = response
+        self._release = release
+        self._discard = discard
+        self._done = False
+        self.msg = response.msg
+        self.status = response.status
+        self.reason = response.reason
+        return
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self._finish()
+        return data
+
+    # socket._fileobject reads through recv()
+    recv = read
+
+    def close(self):
+        if not self._done and self._response.length == 0:
+            # nothing left to read (e.g. a 204 or a HEAD response)
+            self._response.close()
+        self._finish()
+
+    def _finish(self):
+        if self._done:
+            return
+        self._done = True
+
+        if self._response.isclosed() and not self._response.will_close:
+            self._release()
+        else:
+            # the body was not drained (or the server is closing the connection), so it can't be reused
+            self._response.close()
+            self._discard()
+
+
+class KeepAliveHandler(urllib2.HTTPHandler, urllib2.HTTPSHandler):
+    """An HTTP(S) handler that reuses persistent connections from a ConnectionPool instead of opening a new
+    connection (and doing a new TCP + TLS handshake) for every request."""
+
+    def __init__(self, pool=None, connect_timeout=None, read_timeout=None):
+        urllib2.HTTPHandler.__init__(self)
+        urllib2.HTTPSHandler.__init__(self)
+        if pool is None:
+            pool = ConnectionPool()
+        self.pool = pool
+        # default timeouts, which a request can override with its own connect_timeout and read_timeout attributes
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        return
+
+    def http_open(self, req):
+        return self.pooled_open("http", req)
+
+    def https_open(self, req):
+        return self.pooled_open("https", req)
+
+    def pooled_open(self, scheme, req):
+        if req._tunnel_host:
+            # tunnelled (proxied https) connections are not pooled
+            return self.do_open(httplib.HTTPSConnection, req)
+
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError("no host given")
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items() if k not in headers))
+        headers = dict((name.title(), val) for name, val in headers.items())
+
+        conn, reused = self.pool.get(scheme, host, req.timeout)
+        try:
+            response = self._send(conn, req, headers)
+        except (socket.error, httplib.HTTPException) as err:
+            conn.close()
+            if not reused:
+                raise urllib2.URLError(err)
+
+            # the server may have dropped the idle connection, so try once more on a fresh one
+            if hasattr(req.data, "seek"):
+                req.data.seek(0)
+            conn, reused = self.pool.get(scheme, host, req.timeout, fresh=True)
+            try:
+                response = self._send(conn, req, headers)
+            except (socket.error, httplib.HTTPException) as err:
+                conn.close()
+                raise urllib2.URLError(err)
+
+        pooled = PooledResponse(response,
+                                release=lambda: self.pool.put(scheme, host, conn),
+                                discard=conn.close)
+        fp = socket._fileobject(pooled, close=True)
+
+        resp = urllib.addinfourl(fp, pooled.msg, req.get_full_url())
+        resp.code = pooled.status
+        resp.msg = pooled.reason
+        return resp
+
+    def _send(self, conn, req, headers):
+        if conn.sock is None:
+            # connect here (rather than letting httplib connect on demand) so connecting and reading can have
+            # different timeouts
+            conn.timeout = self._get_timeout(req, "connect_timeout")
+            conn.connect()
+        conn.sock.settimeout(self._get_timeout(req, "read_timeout"))
+
+        conn.request(req.get_method(), req.get_selector(), req.data, headers)
+        return conn.getresponse(buffering=True)
+
+    def _get_timeout(self, req, name):
+        timeout = getattr(req, name, None)
+        if timeout is None:
+            timeout = getattr(self, name)
+        if timeout is None or timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+            timeout = req.timeout
+        if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+            timeout = socket.getdefaulttimeout()
+        return timeout
+
+
+class NoRedirectHandler(urllib2.HTTPRedirectHandler):
+    """Hand 3xx responses back to the caller instead of following them."""
+
+    def http_error_302(self, req, fp, code, msg, headers):
+        return fp
+
+    http_error_301 = http_error_303 = http_error_307 = http_error_302
+
+
+class MultiPartBody(object):
+    """A file-like multipart request body.  Attached files are read from disk as the body is sent, so the
+    body's length is known up front but the files themselves are never held in memory."""
+
+    def __init__(self, segments):
+        # each segment is either a string, or a (path, size) tuple for a file on disk
+        self.segments = segments
+        self.length = 0
+        for segment in segments:
+            if isinstance(segment, tuple):
+                self.length += segment[1]
+            else:
+                self.length += len(segment)
+        self.seek(0)
+        return
+
+    def __len__(self):
+        return self.length
+
+    def seek(self, offset, whence=0):
+        """Only rewinding to the start is supported (e.g. to resend the body)."""
+        assert offset == 0 and whence == 0, "MultiPartBody can only be rewound to the start"
+        self.close()
+        self._index = 0
+        self._offset = 0
+        return
+
+    def read(self, size=-1):
+        chunks = []
+        remaining = size
+
+        while self._index < len(self.segments) and (size < 0 or remaining > 0):
+            segment = self.segments[self._index]
+
+            if isinstance(segment, tuple):
+                if self._file is None:
+                    self._file = open(segment[0], "rb")
+                data = self._file.read(remaining if size >= 0 else -1)
+            else:
+                end = self._offset + remaining if size >= 0 else len(segment)
+                data = segment[self._offset:end]
+                self._offset += len(data)
+
+            if not data:
+                # this segment is used up, move on to the next one
+                self.close()
+                self._index += 1
+                self._offset = 0
+                continue
+
+            chunks.append(data)
+            remaining -= len(data)
+
+        return "".join(chunks)
+
+    def close(self):
+        if getattr(self, "_file", None) is not None:
+            self._file.close()
+        self._file = None
+
+
 class MultiPartForm(object):
     """Accumulate the data to be used when posting a form."""
 
@@ -38,47 +278,53 @@ class MultiPartForm(object):
         return
 
     def add_file(self, fieldname, filename, fileHandle, mimetype=None):
-        """Add a file to be uploaded."""
+        """Add a file to be uploaded.  The file's contents are read into memory."""
         body = fileHandle.read()
         if mimetype is None:
             mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
         self.files.append((fieldname, filename, mimetype, body))
         return
 
-    def __str__(self):
-        """Return a string representing the form data, including attached files."""
-        # Build a list of lists, each containing "lines" of the
-        # request.  Each part is separated by a boundary string.
-        # Once the list is built, return a string where each
-        # line is separated by '\r\n'.
-        parts = []
+    def add_file_from_path(self, fieldname, path, filename=None, mimetype=None):
+        """Add a file to be uploaded.  The file is streamed from disk when the body is sent."""
+        if filename is None:
+            filename = os.path.basename(path)
+        if mimetype is None:
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self.files.append((fieldname, filename, mimetype, (path, os.path.getsize(path))))
+        return
+
+    def get_body(self):
+        """Return a MultiPartBody representing the form data, including attached files."""
+        # Each part is a boundary line and some header lines, followed by a blank line, the part's content and
+        # a line break.  The content is either a string or (for files added by path) a (path, size) tuple.
+        segments = []
         part_boundary = '--' + self.boundary
 
         # Add the form fields
-        parts.extend(
-            [part_boundary,
-             'Content-Disposition: form-data; name="%s"' % name,
-             '',
-             value,
-             ]
-            for name, value in self.form_fields
-        )
+        for name, value in self.form_fields:
+            segments.append('\r\n'.join([part_boundary,
+                                          'Content-Disposition: form-data; name="%s"' % name,
+                                          '',
+                                          '']))
+            segments.append(value)
+            segments.append('\r\n')
 
         # Add the files to upload
-        parts.extend(
-            [part_boundary,
-             'Content-Disposition: file; name="%s"; filename="%s"' % \
-             (field_name, filename),
-             'Content-Type: %s' % content_type,
-             '',
-             body,
-             ]
-            for field_name, filename, content_type, body in self.files
-        )
-
-        # Flatten the list and add closing boundary marker,
-        # then return CR+LF separated data
-        flattened = list(itertools.chain(*parts))
-        flattened.append('--' + self.boundary + '--')
-        flattened.append('')
-        return '\r\n'.join(flattened)
\ No newline at end of file
+        for field_name, filename, content_type, body in self.files:
+            segments.append('\r\n'.join([part_boundary,
+                                          'Content-Disposition: file; name="%s"; filename="%s"' %
+                                          (field_name, filename),
+                                          'Content-Type: %s' % content_type,
+                                          '',
+                                          '']))
+            segments.append(body)
+            segments.append('\r\n')
+
+        # Add closing boundary marker
+        segments.append('--' + self.boundary + '--\r\n')
+        return MultiPartBody(segments)
+
+    def __str__(self):
+        """Return a string representing the form data, including attached files."""
+        return self.get_body().read()
@@ -1,15 +1,23 @@
 import json
-import urllib2, urllib
+import urllib
+import urllib2
+import urlparse
 import os
 import csv
+from csv_index import get_csv_index
 from setup import download_assignments
 import urllib2_extension
-import subprocess
-import sys
+from canvas_session import get_session
+import tempfile
+import time
 from optparse import OptionParser
+from multiprocessing.pool import ThreadPool
 
 
 log_filename = "canvaslib.log"
+download_chunk_size = 64 * 1024
+max_per_page = 100    # the most objects Canvas will return per page
+pagination_workers = 4
 
 
 def convert_Z_to_UTC(time_string):
@@ -72,7 +80,7 @@ def write_to_log(message):
         f.write(message + "\n")
 
 
-def post_multipart_form(url, data, files, headers=[]):
+def post_multipart_form(url, data, files, headers={}):
     assert isinstance(url, str), "url is not a string: %s" % url
     assert isinstance(data, dict), "data is not a dict: %s" % data
     assert isinstance(files, dict), "files is not a dict: %s" % files
@@ -80,22 +88,17 @@ def post_multipart_form(url, data, files, headers=[]):
     form = urllib2_extension.MultiPartForm()
 
     for field in data:
-        form.add_field(field, data[field])
+        # the body is built from byte strings, and Canvas hands us upload params as unicode
+        form.add_field(unicode(field).encode("utf-8"), unicode(data[field]).encode("utf-8"))
 
     for fieldname in files:
-        this_file = files[fieldname]
-        with open(this_file, "rb") as f:
-            form.add_file(fieldname, this_file, f)
+        form.add_file_from_path(fieldname, files[fieldname])
 
-    request = urllib2.Request(url)
+    headers = dict(headers)
+    headers["Content-Type"] = form.get_content_type()
 
-    for headername in headers:
-        request.add_header(headername, headers[headername])
-
-    body = str(form)
-    request.add_data(body)
-
-    return urllib2.urlopen(request)
+    # don't follow redirects, so the caller can read the Location header
+    return get_session().open(url, body=form.get_body(), headers=headers, method="POST", follow_redirects=False)
 
 
 def get_header(header_name, headers):
@@ -110,97 +113,43 @@ def get_header(header_name, headers):
     return None
 
 
-def put_using_curl(url, token, data):
-    assert isinstance(url, str), "url is not a string: %s" % url
-    assert isinstance(token, str), "token is not a string: %s" % token
-    assert isinstance(data, dict), "data is not a dict: %s" % data
-
-    headers = {"Authorization": "Bearer %s" % token}
-
-    result, headers = do_curl(url, method="PUT", data=data, headers=headers)
-
-    return result, headers
+def read_response(response):
+    '''
+    Read a response in one go
+    :param response: a response (or urllib2.HTTPError) returned by the session
+    :return: the body, and the response headers as a list of "Name: value" strings
+    '''
+    try:
+        return response.read(), response.info().headers
+    finally:
+        response.close()
 
 
-def do_curl(url, method=None, data={}, headers={}, files={}):
+def put_form(url, token, data):
     assert isinstance(url, str), "url is not a string: %s" % url
-    assert method in ["PUT", "GET", "POST", "HEAD", "DELETE", "CONNECT", "OPTIONS", "TRACE", "PATCH", None], \
-        "Not a valid method: %s" % method
-    if data:
-        assert isinstance(data, dict), "data is not a dict: %s" % data
-    if headers:
-        assert isinstance(headers, dict), "headers is not a dict: %s" % headers
-    if files:
-        assert isinstance(files, dict), "files is not a dict: %s" % files
-
-    args = ["curl"]
-
-    if method:
-        args.extend(["-X", method])
-
-    args.append(url)
-
-    if method == "PUT":
-        data_flag = "-d"
-    else:
-        data_flag = "-F"
-
-    for header_name in headers:
-        #args.extend(["-H", header_name+"="+urllib.quote(str(headers[header_name]))])
-        #args.extend(["-H", "\""+header_name + ": " + headers[header_name]+"\""])
-        args.extend(["-H", header_name + ": " + headers[header_name]])
-
-    for param_name in data:
-        args.extend([data_flag, param_name+"="+urllib.quote(str(data[param_name]))])
-
-    for param_name in files:
-        args.extend([data_flag, param_name+"="+str(files[param_name])])
-
-    headers_file = "resp_headers.txt"
-    args.extend(["-D", headers_file])
-
-    # args.append("-v")
-    # args.extend(["--trace", "-"])
-
-    print(" ".join(args))
-    p = subprocess.Popen(args, stdout=subprocess.PIPE)
-    p.wait()
-    result = p.stdout.read()
-    #result = subprocess.call(args)
-
-    with open(headers_file, "r") as f:
-        resp_headers = f.readlines()
+    assert isinstance(token, str), "token is not a string: %s" % token
+    assert isinstance(data, dict), "data is not a dict: %s" % data
 
-    os.remove(headers_file)
+    try:
+        response = get_session().open(url, token, data=data, method="PUT")
+    except urllib2.HTTPError as e:
+        # the error body is still useful to the caller
+        response = e
 
-    return result, resp_headers
+    return read_response(response)
 
 
-def post_file_using_curl(url, data, file):
+def post_file(url, data, file):
     assert isinstance(url, str), "url is not a string: %s" % url
     assert isinstance(data, dict), "data is not a dict: %s" % data
     assert os.path.isfile(file), "file is not a file: %s" % file
 
-    args = ["curl", url]
-
-    for param_name in data:
-        args.append("-F")
-        args.append(param_name+"="+str(data[param_name]))
-
-    args.append("-F")
-    args.append("file=@"+file)
-
-    args.extend(["-D", "headers.txt"])
-
-    print(" ".join(args))
-    p = subprocess.Popen(args, stdout=subprocess.PIPE)
-    p.wait()
-    result = p.stdout.read()
-
-    with open("headers.txt", "r") as f:
-        headers = f.readlines()
+    try:
+        response = post_multipart_form(url, data, {"file": file})
+    except urllib2.HTTPError as e:
+        response = e
 
-    return result, headers
+    return read_response(response)
 
 
 def make_new_directory(dir_name, path):
@@ -230,107 +179,249 @@ def get_token(token_json_file):
     return token
 
 
-def open_canvas_page(url, token, data=None, method=None):
+def open_canvas_page(url, token, data=None, method=None, retry=None):
+    '''
+    Open a Canvas page through the shared session.  Raises urllib2.HTTPError (after logging it) if the request fails,
+    so that a caller running many requests can carry on with the others.
+    '''
     assert isinstance(url, str), "url is not a string: %s" % url
     assert isinstance(token, str), "token is not a string: %s" % token
 
-    #request = urllib2.Request(url)
-    request = urllib2_extension.MethodRequest(url, method)
-    request.add_header("Authorization", "Bearer %s" % token)
-
-    if data:
-        request.add_data(urllib.urlencode(data))
-
     try:
-        page = urllib2.urlopen(request)
+        page = get_session().open(url, token, data=data, method=method, retry=retry)
     except urllib2.HTTPError as e:
         print(e)
-        write_to_log(e)
-        sys.exit(1)
+        write_to_log(str(e))
+        raise
 
     return page
 
 
-def open_canvas_page_as_string(url, token, data=None, method=None):
+def format_session_stats(stats):
+    return "%d connections opened, %d connections reused, %d requests throttled by Canvas, " \
+           "%d requests retried, %.1f seconds spent in retry backoff, %d cache hits, %d cache misses" % \
+           (stats["connections_opened"], stats["connections_reused"], stats["requests_throttled"],
+            stats["requests_retried"], stats["backoff_seconds"], stats["cache_hits"], stats["cache_misses"])
+
+
+def format_durations(durations):
+    '''
+    Summarize a list of durations for a run summary
+    :param durations: list of durations, in seconds
+    :return: string, e.g. "mean 1.20s, median 0.90s, max 4.10s"
+    '''
+    if not durations:
+        return "n/a"
+
+    ordered = sorted(durations)
+    return "mean %.2fs, median %.2fs, max %.2fs" % \
+           (sum(ordered) / len(ordered), ordered[len(ordered) // 2], ordered[-1])
+
+
+def write_session_stats_to_log(script_name):
+    '''
+    Log this process's session stats
+    '''
+    write_to_log("%s: %s" % (script_name, format_session_stats(get_session().get_stats())))
+
+
+def get_run_session_stats():
+    '''
+    :return: dictionary of this process's session stats, for a run summary
+    '''
+    return dict(get_session().get_stats())
+
+
+def download_file(url, destination, token=None, chunk_size=download_chunk_size):
+    '''
+    Stream a file to disk in fixed-size chunks.  The chunks are written to a temporary file in the destination's
+    directory, which is renamed into place once the download is complete.
+    :param url: the url of the file
+    :param destination: path to save the file to
+    :param token: Canvas token (only needed if the url requires authorization)
+    :param chunk_size: number of bytes to read and write at a time
+    :return: the number of bytes downloaded
+    '''
+    assert isinstance(url, str), "url is not a string: %s" % url
+    assert isinstance(destination, basestring), "destination is not a string: %s" % destination
+
+    start = time.time()
+    response = get_session().open(url, token)
+
+    directory = os.path.dirname(os.path.abspath(destination))
+    fd, temp_path = tempfile.mkstemp(prefix="." + os.path.basename(destination) + ".", suffix=".part", dir=directory)
+    total_bytes = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                total_bytes += len(chunk)
+
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, destination)
+    except:
+        os.remove(temp_path)
+        raise
+    finally:
+        response.close()
+
+    duration = time.time() - start
+    msg = "downloaded %s: %d bytes in %.2f seconds (%.1f KB/s)" % \
+          (destination, total_bytes, duration, total_bytes / 1024.0 / max(duration, 0.001))
+    write_to_log(msg)
+
+    return total_bytes
+
+
+def open_canvas_page_as_string(url, token, data=None, method=None, retry=None):
     #return urllib.unquote(open_canvas_page(url, token, data, method).read())
-    return open_canvas_page(url, token, data, method).read()
+    return open_canvas_page(url, token, data, method, retry).read()
 
 
-def are_more_pages_remaining(page):
-    info = page.info()
-    full_link = info.getheader("Link")
-    links = full_link.split(",")
+def get_page_links(page):
+    '''
+    Parse the Link header of a paginated Canvas response
+    :param page: a response returned by open_canvas_page
+    :return: a dictionary mapping each rel (e.g. "next", "last") to its url
+    '''
+    page_links = {}
 
-    for link in links:
-        rel_current = 'rel="current"'
-        rel_last = 'rel="last"'
+    full_link = page.info().getheader("Link")
+    if not full_link:
+        return page_links
 
-        if rel_current in link:
-            current_link = link[1:link.find(">")]
-            continue
+    for link in full_link.split(","):
+        link_url, _, link_params = link.partition(";")
+        link_url = link_url.strip()[1:-1]    # strip the <>
 
-        if rel_last in link:
-            last_link = link[1:link.find(">")]
-            continue
+        for link_param in link_params.split(";"):
+            name, _, value = link_param.strip().partition("=")
+            if name == "rel":
+                page_links[value.strip('"')] = str(link_url)
+
+    return page_links
 
-    if current_link == last_link:
-        more_remaining = False
-    else:
-        more_remaining = True
 
-    return more_remaining
+def are_more_pages_remaining(page):
+    return "next" in get_page_links(page)
 
 
 def get_next_page_url(page):
-    info = page.info()
-    full_link = info.getheader("Link")
-    links = full_link.split(",")
-
-    for link in links:
-        rel_current = 'rel="current"'
-        rel_last = 'rel="last"'
-        rel_next = 'rel="next"'
-
-        if rel_current in link:
-            current_link = link[1:link.find(">")]
-            continue
-
-        if rel_last in link:
-            last_link = link[1:link.find(">")]
-            continue
-
-        if rel_next in link:
-            next_url = link[1:link.find(">")]
-            continue
-
-    if current_link == last_link:
-        is_valid = False
-        next_url = None
-    else:
-        is_valid = True
-        assert isinstance(next_url, str)
+    next_url = get_page_links(page).get("next")
 
-    return is_valid, next_url
+    return next_url is not None, next_url
 
 
-def download_all_objects_to_list(url, token, mylist):
+def add_url_params(url, params):
+    '''
+    Add (or replace) query parameters on a url
+    :param url: the url
+    :param params: a dictionary of query parameters
+    :return: the new url
+    '''
+    assert isinstance(url, str), "url is not a string: %s" % url
+    assert isinstance(params, dict), "params is not a dict: %s" % params
+
+    parsed = urlparse.urlparse(url)
+    query = [(key, value) for key, value in urlparse.parse_qsl(parsed.query, keep_blank_values=True)
+             if key not in params]
+    query.extend(params.items())
+
+    return urlparse.urlunparse(parsed._replace(query=urllib.urlencode(query)))
+
+
+def get_remaining_page_urls(page_links):
+    '''
+    Use the rel="last" link of the first page to work out the urls of all the other pages
+    :param page_links: the links of the first page, as returned by get_page_links
+    :return: a list of urls for pages 2 through last, or None if the pages can't be numbered (e.g. there is no
+             rel="last" link, or Canvas uses opaque bookmarks instead of page numbers)
+    '''
+    if "last" not in page_links:
+        return None
+
+    last_url = page_links["last"]
+    query = dict(urlparse.parse_qsl(urlparse.urlparse(last_url).query))
+
+    try:
+        last_page = int(query["page"])
+    except (KeyError, ValueError):
+        return None
+
+    return [add_url_params(last_url, {"page": page_num}) for page_num in range(2, last_page + 1)]
+
+
+def get_canvas_page_objects(url, token):
+    '''
+    Download one page of a paginated Canvas collection
+    :param url: url of the page
+    :param token: Canvas token
+    :return: the list of objects on the page, and the page's links (see get_page_links)
+    '''
+    page = get_session().open(url, token)
+    response = page.read().decode('utf-8', "ignore").encode("ascii", "ignore")
+    page.close()
+
+    return json.loads(response), get_page_links(page)
+
+
+def iterate_canvas_objects(url, token):
+    '''
+    Generate every object in a paginated Canvas collection, yielding each page's objects as soon as that page arrives
+    :param url: url of the first page
+    :param token: Canvas token
+    :return: a generator of objects, in the order Canvas lists them.  Raises urllib2.HTTPError if a page fails.
+    '''
     assert isinstance(url, str), "url is not a string: %s" % url
     assert isinstance(token, str), "token is not a string: %s" % token
-    assert isinstance(mylist, list), "mylist is not a list: %s" % mylist
 
-    should_continue = True
+    if "per_page=" not in url:
+        url = add_url_params(url, {"per_page": max_per_page})
+
+    items, page_links = get_canvas_page_objects(url, token)
+    for item in items:
+        yield item
+
+    page_urls = get_remaining_page_urls(page_links)
+    if page_urls is None:
+        # no usable rel="last" link, so follow the rel="next" links one page at a time
+        while "next" in page_links:
+            items, page_links = get_canvas_page_objects(page_links["next"], token)
+            for item in items:
+                yield item
+    elif len(page_urls) > 0:
+        # fetch the remaining pages concurrently (imap hands back the pages in order, as they become available)
+        pool = ThreadPool(min(pagination_workers, len(page_urls)))
+        try:
+            for items in pool.imap(lambda page_url: get_canvas_page_objects(page_url, token)[0], page_urls):
+                for item in items:
+                    yield item
+        finally:
+            pool.close()
+            pool.join()
+
+
+def iterate_all_objects(url, token):
+    '''
+    Same as iterate_canvas_objects, but logs the error (like open_canvas_page) before raising it if a page fails
+    '''
+    try:
+        for item in iterate_canvas_objects(url, token):
+            yield item
+    except urllib2.HTTPError as e:
+        print(e)
+        write_to_log(str(e))
+        raise
 
-    while should_continue == True:
-        page = open_canvas_page(url, token)
-        response = page.read().decode('utf-8', "ignore").encode("ascii", "ignore")
-        #response = response.decode("unicode-escape").encode("ascii", "ignore")
-        #print(response)
-        response = json.loads(response)
 
-        for item in response:
-            mylist.append(item)
+def download_all_objects_to_list(url, token, mylist):
+    assert isinstance(mylist, list), "mylist is not a list: %s" % mylist
+
+    mylist.extend(iterate_all_objects(url, token))
 
-        should_continue, url = get_next_page_url(page)
 
 def write_header_row(writer, fieldnames):
     assert isinstance(writer, csv.DictWriter), "writer is not a DictWriter: %s" % writer
@@ -345,20 +436,93 @@ def write_header_row(writer, fieldnames):
     return
 
 
-def write_list_to_csv(mylist, destination):
-    assert isinstance(mylist, list), "mylist is not a list: %s" % mylist
-    assert isinstance(destination, str), "destination is not a string: %s" % destination
+def write_objects_to_csv(objects, destination, fieldnames=None):
+    '''
+    Write objects to a csv file as they are generated, without holding them all in memory
+    :param objects: an iterable of dictionaries (e.g. from iterate_all_objects)
+    :param destination: path of the csv file
+    :param fieldnames: the columns to write.  If omitted, the columns are the union of every object's keys: any key
+                       not seen before is added as a new column at the end, and once all objects are written, the
+                       header is rewritten and earlier rows are padded to match.
+    :return: the number of objects written
+    '''
+    assert isinstance(destination, basestring), "destination is not a string: %s" % destination
+
+    declared_schema = fieldnames is not None
+    if declared_schema:
+        fieldnames = list(fieldnames)
+
+    # the rows go to a temporary file that only replaces destination once the last one is written, so a download
+    # that fails part way leaves the old file as it was
+    fd, temp_path = tempfile.mkstemp(suffix=".csv", dir=os.path.dirname(os.path.abspath(destination)))
+    try:
+        count = 0
+        initial_fieldnames = None
+        with os.fdopen(fd, "w") as f:
+            writer = csv.writer(f)
+
+            if declared_schema:
+                initial_fieldnames = fieldnames
+                writer.writerow(fieldnames)
 
-    with open(destination, "w") as f:
-        fieldnames = mylist[0].keys()
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+            for item in objects:
+                if fieldnames is None:
+                    fieldnames = item.keys()
+
+                if initial_fieldnames is None:
+                    initial_fieldnames = list(fieldnames)
+                    writer.writerow(initial_fieldnames)
+
+                if not declared_schema:
+                    for key in item:
+                        if key not in fieldnames:
+                            fieldnames.append(key)
+
+                writer.writerow([item.get(fieldname, "") for fieldname in fieldnames])
+                count += 1
+
+        if initial_fieldnames is not None and fieldnames != initial_fieldnames:
+            rewrite_csv_header(temp_path, fieldnames)
+
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, destination)
+    except:
+        os.remove(temp_path)
+        raise
 
-        # write header row
-        # writer.writeheader()  # apparently this doesn't work in Python 2.6
-        write_header_row(writer, fieldnames)
+    return count
+
+
+def rewrite_csv_header(destination, fieldnames):
+    '''
+    Replace the header row of a csv file whose later rows grew extra columns, padding the shorter rows
+    :param destination: path of the csv file
+    :param fieldnames: the full list of columns
+    :return: None
+    '''
+    fd, temp_path = tempfile.mkstemp(suffix=".csv", dir=os.path.dirname(os.path.abspath(destination)))
+    try:
+        with open(destination, "r") as old, os.fdopen(fd, "w") as new:
+            reader = csv.reader(old)
+            writer = csv.writer(new)
+
+            reader.next()
+            writer.writerow(fieldnames)
+
+            for row in reader:
+                writer.writerow(row + [""] * (len(fieldnames) - len(row)))
+
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, destination)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def write_list_to_csv(mylist, destination):
+    assert isinstance(mylist, list), "mylist is not a list: %s" % mylist
 
-        for item in mylist:
-            writer.writerow(item)
+    write_objects_to_csv(mylist, destination)
 
 
 def build_canvas_url(api_subdirectories, params={}):
@@ -397,11 +561,9 @@ def get_assignment_name_and_id(assignment_name, assignment_id, assignment_list,
 def get_attribute_from_csv_using_search_attribute(search_key, search_value, target_key, csv_file):
     assert os.path.isfile(csv_file)
 
-    with open(csv_file) as f:
-        reader = csv.DictReader(f) # values in the first row of the csvfile will be used as the fieldnames.
-        for row in reader:
-            if str(row[search_key]).lower() == str(search_value).lower():
-                return row[target_key]
+    row = get_csv_index(csv_file).lookup(search_key, search_value)
+    if row is not None:
+        return row[target_key]
 
     raise Exception("Key-value [" + search_key + "=" + str(search_value) + "] not found in csv file [" + csv_file + "]")
 
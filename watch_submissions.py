@@ -0,0 +1,314 @@
+from optparse import OptionParser
+import httplib
+import json
+import os
+import socket
+import tempfile
+import time
+import urllib2
+from canvas_client import CanvasClient
+from canvas_groups import read_group_file, fan_out_group_results
+from download_all_submissions import download_queued_submission, build_assignment_url, get_or_make_directory
+from download_submission import RETURNCODE_SUCCESS, RETURNCODE_NOT_NEWER
+from grade_all_submissions import build_grade_submission_arguments
+from grade_submission import RETURNCODE_ALREADY_GRADED
+from job_scheduler import JobScheduler
+from sandbox import sandbox_methods
+from state_store import StateStore, graded_returncodes
+from utils import get_token, get_assignment_name_and_id, get_netid_from_user_id, build_canvas_url, max_per_page, \
+                  make_new_directory, write_to_log
+
+
+parser = OptionParser(usage="Usage: %prog [options]",
+                      description="Keep watching an assignment for new submissions, and download (and optionally grade) "
+                                  "each one as it arrives.  Each poll only asks Canvas for submissions made since the "
+                                  "last one seen, which is kept in a file so that a restart picks up where it left "
+                                  "off.  For example, try:                                                       "
+                                  "python " + __file__ + " -c <course_id> -a <assignment_name> -d <submissions-directory> "
+                                                         "-C 'python <your-autograder-script>'")
+parser.add_option("-c", "--course-id",
+                  dest="course_id", default=None, type=int,
+                  help="The Canvas course_id.  e.g. 43589")
+parser.add_option("-a", "--assignment-name",
+                  dest="assignment_name", default=None, type=str,
+                  help="The name of the assignment to watch.  e.g. 'proj4'")
+parser.add_option("-i", "--assignment-id",
+                  dest="assignment_id", default=None, type=int,
+                  help="The Canvas assignment_id of the assignment to watch.")
+parser.add_option("-d", "--submissions-directory",
+                  dest="submissions_directory", default="submissions/", type=str,
+                  help="The path to download the submissions to (see download_all_submissions.py -h).  "
+                       "Default: %default")
+parser.add_option("-o", "--download-filename",
+                  dest="download_filename", default=None, type=str,
+                  help="The name to give the downloaded files.  If omitted, the name of each student's uploaded file "
+                       "will be used.")
+parser.add_option("-m",
+                  dest="make_assignment_directory", action="store_true", default=False,
+                  help="If the directory <assignment_name> doesn't exist, should it be created?")
+parser.add_option("-C", "--autograder-command",
+                  dest="autograder_command", default=None, type=str,
+                  help="If given, grade each new submission with this command (see grade_submission.py -h).")
+parser.add_option("-j", "--jobs",
+                  dest="jobs", default=8, type=int,
+                  help="The number of submissions to download, and to grade, at the same time.  Default: %default")
+parser.add_option("-s", "--sandbox",
+                  dest="sandbox_method", default="auto", type="choice", choices=sandbox_methods,
+                  help="How to make the scratch copy of each submission that is graded (see grade_submission.py -h).  "
+                       "Default: %default")
+parser.add_option("-t", "--scratch-directory",
+                  dest="scratch_directory", default=None, type=str,
+                  help="Where to make the scratch copies.  Default: the submissions directory")
+parser.add_option("-K", "--grading-cache",
+                  dest="grading_cache_directory", default=None, type=str,
+                  help="Reuse autograder results for identical submissions (see grade_submission.py -h).")
+parser.add_option("-D", "--state-db",
+                  dest="state_db", default=None, type=str,
+                  help="Also record the downloads and grading runs in this SQLite database (see state_store.py).")
+parser.add_option("-p", "--poll-interval",
+                  dest="poll_interval", default=60, type=int,
+                  help="Seconds to wait between polls.  Default: %default")
+parser.add_option("-w", "--watch-file",
+                  dest="watch_file", default=None, type=str,
+                  help="Where to keep the time of the latest submission seen.  Default: "
+                       "resources/watch_<course_id>_<assignment_id>.json")
+parser.add_option("-1", "--once",
+                  dest="once", action="store_true", default=False,
+                  help="Poll once and exit, e.g. when run from cron.")
+
+resources_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), "resources")
+roster_file = os.path.join(resources_directory, "roster.csv")
+token_json_file = os.path.join(resources_directory, "token.json")
+
+
+def build_new_submissions_url(course_id, assignment_id, submitted_since=None):
+    '''
+    :param submitted_since: only list submissions made after this time (e.g. "2018-03-01T12:00:00Z"), if given
+    :return: the url listing the assignment's submissions
+    '''
+    params = {"student_ids[]": "all", "assignment_ids[]": assignment_id, "per_page": max_per_page}
+    if submitted_since is not None:
+        params["submitted_since"] = submitted_since
+
+    return build_canvas_url(["courses", course_id, "students", "submissions"], params)
+
+
+def read_watch_file(watch_file):
+    '''
+    :param watch_file: path to the watch file
+    :return: the time of the latest submission seen (e.g. "2018-03-01T12:00:00Z"), or None if there is none yet
+    '''
+    if not os.path.isfile(watch_file):
+        return None
+
+    with open(watch_file, "r") as f:
+        return json.load(f)["submitted_since"]
+
+
+def write_watch_file(watch_file, submitted_since):
+    '''
+    Save the time of the latest submission seen, atomically, so an interrupted write can't lose it
+    :param watch_file: path to the watch file
+    :param submitted_since: the time of the latest submission seen
+    :return: None
+    '''
+    directory = os.path.dirname(os.path.abspath(watch_file))
+    fd, temp_path = tempfile.mkstemp(prefix="." + os.path.basename(watch_file) + ".", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump({"submitted_since": submitted_since, "written_at": time.time()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_path, watch_file)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def get_new_submissions(submissions, submissions_directory, assignment_name):
+    '''
+    Work out whose directory each new submission goes to, keeping one submission per directory
+    :param submissions: the submissions Canvas listed
+    :param submissions_directory: the path to the submissions directory
+    :param assignment_name: the name of the assignment
+    :return: dictionary mapping each netid to a (user_id, submission) tuple
+    '''
+    new_submissions = {}
+    for submission in submissions:
+        if submission.get("attempt") is None or submission.get("submitted_at") is None:
+            continue
+
+        user_id = submission["user_id"]
+        try:
+            netid = get_netid_from_user_id(user_id, roster_file)
+        except Exception as E:
+            msg = "%s: skipping user_id [%s], not in roster [%s]" % (__file__, user_id, E)
+            write_to_log(msg)
+            print(msg)
+            continue
+
+        # group members share one submission, which is kept in one member's directory
+        # (see download_all_submissions.py -G)
+        group_summary = read_group_file(os.path.join(submissions_directory, netid, assignment_name))
+        if group_summary is not None and group_summary["representative"] != netid:
+            continue
+
+        if netid not in new_submissions or \
+                submission["submitted_at"] > new_submissions[netid][1]["submitted_at"]:
+            new_submissions[netid] = (user_id, submission)
+
+    return new_submissions
+
+
+def get_next_submitted_since(submitted_since, new_submissions, failed):
+    '''
+    :param submitted_since: the time polled from this time
+    :param new_submissions: dictionary mapping each netid to a (user_id, submission) tuple (see get_new_submissions)
+    :param failed: netids whose download or grading failed
+    :return: the time to poll from next time: that of the latest new submission, or submitted_since again if any
+             failed, so that they are retried (the others are skipped as not newer and already graded)
+    '''
+    if len(failed) > 0:
+        return submitted_since
+
+    for user_id, submission in new_submissions.values():
+        if submitted_since is None or submission["submitted_at"] > submitted_since:
+            submitted_since = submission["submitted_at"]
+
+    return submitted_since
+
+
+def poll(client, token, course_id, assignment_id, assignment_name, assignment_summary, submitted_since, options,
+         state_store=None):
+    '''
+    Download (and grade, with options.autograder_command) the submissions made since submitted_since
+    :param state_store: a StateStore to record the downloads in, if any
+    :return: the time of the latest submission that has been dealt with, to poll from next time
+    '''
+    submissions = client.get_all(build_new_submissions_url(course_id, assignment_id, submitted_since))
+    new_submissions = get_new_submissions(submissions, options.submissions_directory, assignment_name)
+
+    jobs = []
+    for netid in sorted(new_submissions):
+        user_id, submission = new_submissions[netid]
+        netid_directory = get_or_make_directory(options.submissions_directory, netid)
+        jobs.append({"course_id": course_id,
+                     "assignment_id": assignment_id,
+                     "user_id": user_id,
+                     "netid": netid,
+                     "download_directory": os.path.join(netid_directory, assignment_name),
+                     "token": token,
+                     "download_filename": options.download_filename,
+                     "make_assignment_directory": options.make_assignment_directory,
+                     "remote_submission_summary": submission,
+                     "assignment_summary": assignment_summary,
+                     "state_store": state_store,
+                     "queued_at": time.time()})
+
+    downloaded = []
+    failed_downloads = []
+    for netid, returncode, queue_wait, latency, downloaded_bytes in \
+            client.imap_unordered(download_queued_submission, jobs):
+        # a submission that is already on disk may still need grading, e.g. if the last run stopped part way
+        if returncode in [RETURNCODE_SUCCESS, RETURNCODE_NOT_NEWER]:
+            downloaded.append(netid)
+        if returncode is None:
+            failed_downloads.append(netid)
+
+    graded = []
+    failed_grades = []
+    if options.autograder_command is not None and len(downloaded) > 0:
+        grade_jobs = []
+        for netid in sorted(downloaded):
+            grade_jobs.append((netid, build_grade_submission_arguments(
+                options.submissions_directory, assignment_name, netid, options.autograder_command,
+                make_assignment_directory=options.make_assignment_directory, sandbox_method=options.sandbox_method,
+                scratch_directory=options.scratch_directory, grading_cache_directory=options.grading_cache_directory,
+                state_db=options.state_db)))
+
+        for result in JobScheduler(options.jobs, max_load=float(options.jobs)).run(grade_jobs):
+            if result["returncode"] in graded_returncodes:
+                graded.append(result["name"])
+                fan_out_group_results(options.submissions_directory, assignment_name, result["name"])
+            elif result["returncode"] != RETURNCODE_ALREADY_GRADED:
+                failed_grades.append(result["name"])
+
+    msg = "%s: %d submissions listed since [%s] for %d directories, %d downloads failed %s, %d graded %s, " \
+          "%d grading failed %s" % \
+          (__file__, len(submissions), submitted_since, len(new_submissions), len(failed_downloads),
+           failed_downloads, len(graded), graded, len(failed_grades), failed_grades)
+    write_to_log(msg)
+    print(msg)
+
+    return get_next_submitted_since(submitted_since, new_submissions, failed_downloads + failed_grades)
+
+
+if __name__ == "__main__":
+    (options, args) = parser.parse_args()
+
+    course_id = options.course_id
+    assert isinstance(course_id, int), "course_id is not an int: %s" % course_id
+
+    assignment_name = options.assignment_name
+    assignment_id = options.assignment_id
+    assert isinstance(assignment_name, str) or isinstance(assignment_id, int), \
+        "A valid assignment_name or assignment_id must be provided.\n" \
+        "assignment_name: [%s]\n" \
+        "assignment_id: [%s]" % (assignment_name, assignment_id)
+
+    assignment_list = os.path.join(resources_directory, "assignments.csv")
+    assert os.path.isfile(assignment_list), "assignment_list is not a file: %s" % assignment_list
+
+    assignment_name, assignment_id = get_assignment_name_and_id(assignment_name, assignment_id, assignment_list,
+                                                                course_id)
+
+    if not os.path.isdir(options.submissions_directory):
+        options.submissions_directory = make_new_directory("submissions_directory", options.submissions_directory)
+    options.submissions_directory = os.path.abspath(options.submissions_directory)
+
+    assert options.jobs > 0, "jobs must be positive: %s" % options.jobs
+    assert options.poll_interval > 0, "poll_interval must be positive: %s" % options.poll_interval
+
+    watch_file = options.watch_file
+    if watch_file is None:
+        watch_file = os.path.join(resources_directory, "watch_%s_%s.json" % (course_id, assignment_id))
+
+    token = get_token(token_json_file)
+    client = CanvasClient(token, concurrency=options.jobs)
+    assignment_summary = client.get(build_assignment_url(course_id, assignment_id))
+
+    state_store = None
+    if options.state_db is not None:
+        state_store = StateStore(options.state_db)
+        state_store.record_assignment(assignment_id, assignment_name, course_id)
+
+    submitted_since = read_watch_file(watch_file)
+    msg = "%s: watching [%s] for submissions since [%s]" % (__file__, assignment_name, submitted_since)
+    write_to_log(msg)
+    print(msg)
+
+    try:
+        while True:
+            try:
+                submitted_since = poll(client, token, course_id, assignment_id, assignment_name, assignment_summary,
+                                       submitted_since, options, state_store)
+            except (urllib2.URLError, socket.error, httplib.HTTPException, ValueError) as E:
+                # e.g. Canvas can't be reached, the connection drops, or a page of JSON is cut short
+                msg = "%s: poll failed [%s].  Trying again in %d seconds." % (__file__, E, options.poll_interval)
+                write_to_log(msg)
+                print(msg)
+            else:
+                if submitted_since is not None:
+                    write_watch_file(watch_file, submitted_since)
+
+            if options.once:
+                break
+            time.sleep(options.poll_interval)
+    except KeyboardInterrupt:
+        msg = "%s: stopped watching [%s]" % (__file__, assignment_name)
+        write_to_log(msg)
+        print(msg)
+    finally:
+        client.close()
+        if state_store is not None:
+            state_store.close()